@@ -0,0 +1,145 @@
+"""Admission control for incoming calls.
+
+Each call is gated at /incoming-call instead of failing mid-conversation
+once the realtime API runs out of budget. The controller keeps the latest
+request and token budgets from `rate_limits.updated` events and counts the
+calls being relayed, plus the calls admitted whose stream has not started
+yet. A call is connected while the ceilings leave room. Otherwise it is
+held in a FIFO queue: the TwiML says its position and redirects back to
+/incoming-call after a pause. Once the queue is full, calls overflow to the
+fallback.
+"""
+import time
+import logging
+from collections import OrderedDict
+
+from metrics import ADMISSION
+
+logger = logging.getLogger(__name__)
+
+CONNECT, HOLD, OVERFLOW = 'connect', 'hold', 'overflow'
+
+
+class AdmissionController:
+    """Decides connect / hold / overflow per call. All methods run on the event loop.
+
+    `max_calls` caps relayed plus admitted-but-not-started calls (0 = no cap).
+    New calls are held while fewer than `min_tokens` tokens or
+    `min_requests` requests remain in the budget, until that budget's
+    reset time passes. Held callers come back every `hold_seconds`; one that
+    stops coming back (hung up) leaves the queue after `queue_ttl` seconds.
+    An admitted call whose stream never starts stops counting after
+    `pending_ttl` seconds.
+    """
+
+    def __init__(self, max_calls=0, min_tokens=0, min_requests=0, max_queue=10, hold_seconds=10.0,
+                 queue_ttl=None, pending_ttl=30.0):
+        self.max_calls = max_calls
+        self.min_tokens = min_tokens
+        self.min_requests = min_requests
+        self.max_queue = max_queue
+        self.hold_seconds = hold_seconds
+        self.queue_ttl = queue_ttl if queue_ttl is not None else hold_seconds * 2 + 5
+        self.pending_ttl = pending_ttl
+        self.active = 0
+        self.pending = {}  # call_sid -> admitted at
+        self.queue = OrderedDict()  # call_sid -> last seen, oldest caller first
+        self.budgets = {}  # 'tokens' / 'requests' -> {'remaining', 'limit', 'reset_at'}
+        self.stats = {CONNECT: 0, HOLD: 0, OVERFLOW: 0}
+
+    def observe_rate_limits(self, rate_limits):
+        """Take the budgets from a rate_limits.updated event's `rate_limits` list."""
+        now = time.monotonic()
+        for limit in rate_limits:
+            name = limit.get('name')
+            if name in ('tokens', 'requests') and limit.get('remaining') is not None:
+                self.budgets[name] = {
+                    'remaining': limit['remaining'],
+                    'limit': limit.get('limit'),
+                    'reset_at': now + float(limit.get('reset_seconds') or 0),
+                }
+
+    def session_started(self, call_sid):
+        self.pending.pop(call_sid, None)
+        self.active += 1
+
+    def session_ended(self):
+        self.active -= 1
+
+    def _expire(self, now):
+        for call_sid, admitted_at in list(self.pending.items()):
+            if now - admitted_at >= self.pending_ttl:
+                del self.pending[call_sid]
+        # Callers who hung up stop coming back; the others keep their places
+        for call_sid, seen in list(self.queue.items()):
+            if now - seen >= self.queue_ttl:
+                del self.queue[call_sid]
+
+    def _budget_short(self, now):
+        """Name of a budget below its floor, or None."""
+        for name, floor in (('tokens', self.min_tokens), ('requests', self.min_requests)):
+            budget = self.budgets.get(name)
+            if floor and budget and budget['remaining'] < floor and now < budget['reset_at']:
+                return name
+        return None
+
+    def free_slots(self, now=None):
+        """How many more calls can be connected right now."""
+        now = time.monotonic() if now is None else now
+        if self._budget_short(now):
+            return 0
+        if not self.max_calls:
+            return float('inf')
+        return max(0, self.max_calls - self.active - len(self.pending))
+
+    def admit(self, call_sid):
+        """(decision, queue position) for a call arriving at, or redirected back to, /incoming-call."""
+        now = time.monotonic()
+        self._expire(now)
+        free = self.free_slots(now)
+        if call_sid in self.queue:
+            position = list(self.queue).index(call_sid) + 1
+            if position <= free:
+                del self.queue[call_sid]
+                return self._decide(CONNECT, call_sid, now)
+            self.queue[call_sid] = now
+            # Still waiting; only a caller's first hold is counted
+            return HOLD, position
+        if free > len(self.queue):
+            return self._decide(CONNECT, call_sid, now)
+        if call_sid and len(self.queue) < self.max_queue:
+            self.queue[call_sid] = now
+            return self._decide(HOLD, call_sid, now, len(self.queue))
+        return self._decide(OVERFLOW, call_sid, now)
+
+    def _decide(self, decision, call_sid, now, position=0):
+        if decision == CONNECT and call_sid:
+            self.pending[call_sid] = now
+        self.stats[decision] += 1
+        ADMISSION.labels(decision).inc()
+        if decision == OVERFLOW:
+            logger.warning(f"📵 Call {call_sid} overflowed: {self.active} active, {len(self.queue)} holding, "
+                           f"budget short: {self._budget_short(now)}")
+        return decision, position
+
+    def status(self):
+        now = time.monotonic()
+        self._expire(now)
+        free = self.free_slots(now)
+        return {
+            'active': self.active,
+            'pending': len(self.pending),
+            'holding': len(self.queue),
+            'free_slots': None if free == float('inf') else free,
+            'budget_short': self._budget_short(now),
+            'budgets': {
+                name: {'remaining': b['remaining'], 'limit': b['limit'],
+                       'resets_in': round(max(0.0, b['reset_at'] - now), 1)}
+                for name, b in self.budgets.items()
+            },
+            'ceilings': {
+                'max_calls': self.max_calls, 'min_tokens': self.min_tokens, 'min_requests': self.min_requests,
+                'max_queue': self.max_queue
+            },
+            **self.stats
+        }
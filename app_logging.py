@@ -0,0 +1,148 @@
+"""Logging that never blocks the event loop.
+
+Records go onto a bounded queue and a QueueListener thread formats and
+writes them, so a slow stdout or log collector cannot stall audio relay.
+When the queue is full records are dropped and counted instead of waiting.
+Every record carries the current call's stream_sid and call_sid, set once
+per media stream with `bind_call()`; asyncio tasks inherit it.
+"""
+import sys
+import json
+import atexit
+import time
+import queue
+import logging
+import contextvars
+import logging.handlers
+
+from metrics import LOG_DROPPED
+
+_call_context = contextvars.ContextVar('call_context', default={})
+
+MAX_CHARS = 500  # Default cap for truncate()
+
+
+def bind_call(**fields):
+    """Attach fields (stream_sid, call_sid) to every record logged from this task and its children."""
+    _call_context.set({**_call_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+def truncate(value, limit=None):
+    """Compact text for a log line: dicts and lists as JSON, cut to `limit` characters."""
+    limit = MAX_CHARS if limit is None else limit
+    text = value if isinstance(value, str) else json.dumps(value, default=str, separators=(',', ':'))
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...(+{len(text) - limit} chars)"
+
+
+class Sampler:
+    """Per-key token bucket: at most `rate` records a second per key, with bursts up to `burst`.
+
+    For per-frame and per-event logs, e.g. `if sampler.allow(event_type): logger.debug(...)`.
+    Suppressed records are counted and reported on the next one let through.
+    """
+
+    def __init__(self, rate=1.0, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # key -> [tokens, last refill, suppressed]
+
+    def allow(self, key=None):
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        return True
+
+    def suppressed(self, key=None):
+        """Records suppressed for `key` since the last call; resets the count."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return 0
+        count, bucket[2] = bucket[2], 0
+        return count
+
+
+class _CallContextFilter(logging.Filter):
+    def filter(self, record):
+        context = _call_context.get()
+        record.stream_sid = context.get('stream_sid', '-')
+        record.call_sid = context.get('call_sid', '-')
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the call context and any `extra` fields."""
+
+    _standard = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._standard and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Libraries that log every frame or request at DEBUG/INFO; LOG_LEVEL=DEBUG is meant for this app
+QUIET_LOGGERS = ('websockets', 'httpx', 'httpcore', 'asyncio', 'multipart')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(call_sid)s %(stream_sid)s] %(message)s'
+
+_listener = None
+
+
+def setup_logging(level='INFO', fmt='text', queue_size=10000, max_chars=500, stream=None):
+    """Route the root logger through a bounded queue to a writer thread. Safe to call again."""
+    global _listener, MAX_CHARS
+    MAX_CHARS = max_chars
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    handler = _DroppingQueueHandler(queue.Queue(queue_size))
+    # Context is read on the caller's task, before the record crosses to the writer thread
+    handler.addFilter(_CallContextFilter())
+
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if isinstance(h, _DroppingQueueHandler)]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(root.level, logging.WARNING))
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+@atexit.register
+def stop_logging():
+    """Flush queued records and stop the writer thread; runs at exit."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
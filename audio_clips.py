@@ -0,0 +1,162 @@
+"""Pre-rendered mu-law clips for the greeting and canned fallback replies.
+
+Each clip is captured once from the realtime API's own response.audio.delta
+output, in the assistant's voice, and stored as raw 8 kHz mu-law under a
+name that fingerprints the voice, the instructions and the clip text, so
+changing any of them renders a new clip and the stale file is pruned.
+Clips are memory-mapped and streamed to Twilio as-is, with no model round
+trip and no tokens spent.
+"""
+import os
+import json
+import mmap
+import base64
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 3200  # 400 ms of 8 kHz mu-law per Twilio media message
+
+
+class ClipCache:
+    """Named clips in `directory`, rendered for one voice and set of instructions."""
+
+    def __init__(self, directory, texts, voice, instructions, capture_timeout=30.0):
+        self.directory = directory
+        self.texts = dict(texts)  # name -> exact words of the clip
+        self.voice = voice
+        self.instructions = instructions
+        self.capture_timeout = capture_timeout
+        self._maps = {}  # name -> mmap
+        self._files = {}
+
+    def fingerprint(self, name):
+        key = json.dumps([self.voice, self.instructions, self.texts[name], 'g711_ulaw'])
+        return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}-{self.fingerprint(name)}.ulaw")
+
+    def load(self):
+        """Map every clip that is on disk for the current fingerprints and delete stale ones."""
+        os.makedirs(self.directory, exist_ok=True)
+        current = {os.path.basename(self.path(name)) for name in self.texts}
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.ulaw') and filename not in current:
+                os.remove(os.path.join(self.directory, filename))
+        for name in self.texts:
+            self._map(name)
+
+    def _map(self, name):
+        path = self.path(name)
+        if name in self._maps or not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        f = open(path, 'rb')
+        self._files[name] = f
+        self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def retarget(self, texts):
+        """Switch to a new set of clips. Returns True if some are not rendered yet.
+
+        Clips whose text is unchanged stay mapped; the rest are unmapped and
+        picked up from disk or rendered by the next capture_missing().
+        """
+        old_paths = {name: self.path(name) for name in self._maps}
+        self.texts = dict(texts)
+        for name, path in old_paths.items():
+            if name not in self.texts or self.path(name) != path:
+                self._maps.pop(name).close()
+                self._files.pop(name).close()
+        return any(not self.has(name) for name in self.texts)
+
+    def has(self, name):
+        return name in self._maps
+
+    def text(self, name):
+        return self.texts[name]
+
+    def duration_ms(self, name):
+        return len(self._maps[name]) // 8 if name in self._maps else 0
+
+    def chunks(self, name):
+        """Base64 media payloads of a clip, CHUNK_BYTES of audio each."""
+        clip = self._maps[name]
+        for start in range(0, len(clip), CHUNK_BYTES):
+            yield base64.b64encode(clip[start:start + CHUNK_BYTES]).decode()
+
+    async def capture_missing(self, connect):
+        """Render every clip that is not on disk yet. Failures are logged and retried on the next start."""
+        for name in list(self.texts):
+            if name not in self.texts:
+                continue  # Retargeted away while we were capturing
+            await asyncio.to_thread(self._map, name)  # Another worker may have rendered it already
+            if self.has(name):
+                continue
+            text = self.texts[name]
+            try:
+                audio = await asyncio.wait_for(self._capture(connect, text), self.capture_timeout)
+            except Exception as e:
+                logger.warning(f"Could not capture audio clip {name!r}: {e!r}")
+                continue
+            if self.texts.get(name) != text:
+                continue
+            await asyncio.to_thread(self._store, name, audio)
+            logger.info(f"🔊 Captured audio clip {name!r}: {len(audio) // 8} ms")
+
+    async def _capture(self, connect, text):
+        """Have the realtime API speak `text` in the session's voice and collect the mu-law audio."""
+        openai_ws = await connect()
+        async with openai_ws:
+            await openai_ws.send(json.dumps({
+                "type": "session.update",
+                "session": {
+                    "voice": self.voice,
+                    "instructions": self.instructions,
+                    "output_audio_format": "g711_ulaw",
+                    "modalities": ["text", "audio"],
+                    "turn_detection": None,
+                }
+            }))
+            await openai_ws.send(json.dumps({
+                "type": "response.create",
+                "response": {
+                    "modalities": ["text", "audio"],
+                    "instructions": f"Say exactly the following, word for word, and nothing else: {text}",
+                }
+            }))
+            audio = bytearray()
+            async for message in openai_ws:
+                event = json.loads(message)
+                if event.get('type') == 'response.audio.delta':
+                    audio += base64.b64decode(event['delta'])
+                elif event.get('type') == 'response.done':
+                    break
+                elif event.get('type') == 'error':
+                    raise RuntimeError(f"Realtime API error: {event.get('error')}")
+        if not audio:
+            raise RuntimeError("Response had no audio")
+        return bytes(audio)
+
+    def _store(self, name, audio):
+        path = self.path(name)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(audio)
+            f.flush()
+            os.fsync(f.fileno())
+        # Readers in other workers only ever see a complete clip
+        os.replace(temp_path, path)
+        self._map(name)
+
+    def status(self):
+        return {name: {'cached': self.has(name), 'duration_ms': self.duration_ms(name)} for name in self.texts}
+
+    def close(self):
+        for clip in self._maps.values():
+            clip.close()
+        for f in self._files.values():
+            f.close()
+        self._maps.clear()
+        self._files.clear()
@@ -0,0 +1,252 @@
+"""Rebuild conversations and leads from a transcription.json log, in parallel.
+
+    python backfill_transcripts.py [transcription.json] [--output leads.jsonl] [--outbox lead_outbox.db]
+
+The log is memory-mapped and cut into newline-aligned chunks that a process
+pool parses; the parent merges each chunk's per-SID messages in file order
+and hands every conversation that has ended to the pool again for lead
+extraction and scoring, in batches. One JSON line per ended conversation is
+written to --output (stdout by default); with --outbox, leads worth sending
+are also queued in the lead outbox for a running app to deliver. Messages
+keep the record's Twilio Timestamp, or none if the record predates it.
+Memory is bounded by the chunks in flight, the calls still open and the
+SIDs that ended in the last few chunks, which are kept to drop late records
+of calls already written out.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import argparse
+import itertools
+import resource
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from lead_extractor import build_lead_payload, calculate_lead_score, extract_lead_info, has_enough_for_lead
+from lead_outbox import LeadOutbox
+from relay_codec import dumps, loads
+from transcripts import is_conversation_end, new_conversation, parse_transcription_message
+
+
+def no_timestamp():
+    return None
+
+
+def chunk_bounds(path, chunk_bytes):
+    """(start, end) byte ranges covering the file, each ending just after a newline or at EOF."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    bounds = []
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            newline = data.find(b'\n', min(start + chunk_bytes, size) - 1)
+            end = size if newline == -1 else newline + 1
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def parse_chunk(path, start, end):
+    """Fold the records of one chunk into {sid: [call_sid, [(track, message)], ended]}, in first-seen order."""
+    conversations = {}
+    records = malformed = 0
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        lines = data[start:end].split(b'\n')
+    for line in lines:
+        line = line.strip()
+        if len(line) <= 5:
+            continue
+        try:
+            record = loads(line)
+        except json.JSONDecodeError:
+            malformed += 1
+            continue
+        if not isinstance(record, dict):
+            malformed += 1
+            continue
+        records += 1
+        sid = record.get('TranscriptionSid')
+        if not sid:
+            continue
+        conversation = conversations.get(sid)
+        if conversation is None:
+            conversation = conversations[sid] = [None, [], False]
+        if conversation[2]:
+            # Late records after the end of a call are ignored, as the app does
+            continue
+        if record.get('CallSid'):
+            conversation[0] = record['CallSid']
+        try:
+            parsed = parse_transcription_message(record, now=no_timestamp)
+        except json.JSONDecodeError:
+            malformed += 1
+            parsed = None
+        if parsed:
+            message, track = parsed
+            conversation[1].append((track, message))
+        if is_conversation_end(record):
+            conversation[2] = True
+    return conversations, records, malformed
+
+
+def extract_leads(conversations):
+    """One output row per (sid, conversation), with the lead and its score."""
+    rows = []
+    for sid, conversation in conversations:
+        lead_info = extract_lead_info(conversation)
+        messages = conversation['all_messages']
+        rows.append({
+            'transcription_sid': sid,
+            'call_sid': conversation.get('call_sid'),
+            'started_at': messages[0]['timestamp'] if messages else None,
+            'ended_at': messages[-1]['timestamp'] if messages else None,
+            'customer_messages': len(conversation['customer_messages']),
+            'ai_messages': len(conversation['ai_messages']),
+            'lead': lead_info,
+            'lead_score': calculate_lead_score(lead_info),
+            # The same bar process_conversation applies before creating a lead
+            'qualifies': bool(conversation['customer_messages']) and has_enough_for_lead(lead_info, conversation),
+        })
+    return rows
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of the largest worker, in MB (Linux units)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, workers
+
+
+class Backfill:
+    """Merges parsed chunks in file order and streams ended conversations through lead extraction."""
+
+    def __init__(self, pool, output, outbox=None, batch_size=500, late_chunks=2):
+        self.pool = pool
+        self.output = output
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.open = {}  # sid -> conversation still waiting for its end record
+        # SIDs ended per chunk, for the current and last `late_chunks` chunks; a record
+        # arriving later than that opens a call that never ends and is left out
+        self.ended = deque(maxlen=late_chunks + 1)
+        self.batch = []
+        self.extracting = deque()  # Futures, in output order
+        self.conversations = 0
+        self.qualified = 0
+        self.queued = 0
+
+    def has_ended(self, sid):
+        return any(sid in ended for ended in self.ended)
+
+    def merge(self, chunk):
+        self.ended.append(set())
+        for sid, (call_sid, messages, ended) in chunk.items():
+            if self.has_ended(sid):
+                continue
+            conversation = self.open.get(sid)
+            if conversation is None:
+                conversation = self.open[sid] = new_conversation()
+            if call_sid:
+                conversation['call_sid'] = call_sid
+            for track, message in messages:
+                conversation['all_messages'].append(message)
+                if track == 'inbound_track':
+                    conversation['customer_messages'].append(message)
+                elif track == 'outbound_track':
+                    conversation['ai_messages'].append(message)
+            if ended:
+                self.ended[-1].add(sid)
+                self.batch.append((sid, self.open.pop(sid)))
+                if len(self.batch) >= self.batch_size:
+                    self.submit()
+
+    def submit(self):
+        if self.batch:
+            self.extracting.append(self.pool.submit(extract_leads, self.batch))
+            self.batch = []
+
+    def write_done(self, wait=False, max_pending=None):
+        """Write finished batches in order; wait for all, or until at most `max_pending` are left."""
+        while self.extracting and (wait or self.extracting[0].done()
+                                   or (max_pending is not None and len(self.extracting) > max_pending)):
+            rows = self.extracting.popleft().result()
+            for row in rows:
+                self.output.write(dumps(row) + '\n')
+            self.conversations += len(rows)
+            qualified = [row for row in rows if row['qualifies']]
+            self.qualified += len(qualified)
+            if self.outbox and qualified:
+                self.queued += self.outbox.insert_many(
+                    (row['transcription_sid'],
+                     build_lead_payload(row['lead'], row['transcription_sid'], created_at=row['ended_at']))
+                    for row in qualified
+                )
+
+
+def backfill(source, output, outbox_path=None, workers=None, chunk_mb=8, batch_size=500):
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    bounds = chunk_bounds(source, int(chunk_mb * 1024 * 1024))
+    outbox = LeadOutbox(outbox_path, send=None) if outbox_path else None
+    records = malformed = 0
+    with ProcessPoolExecutor(workers) as pool:
+        job = Backfill(pool, output, outbox, batch_size)
+        # At most two chunks per worker in flight, so a huge log is never all in memory
+        pending = iter(bounds)
+        parsing = deque(pool.submit(parse_chunk, source, start, end)
+                        for start, end in itertools.islice(pending, workers * 2))
+        while parsing:
+            chunk, chunk_records, chunk_malformed = parsing.popleft().result()
+            bound = next(pending, None)
+            if bound:
+                parsing.append(pool.submit(parse_chunk, source, *bound))
+            records += chunk_records
+            malformed += chunk_malformed
+            job.merge(chunk)
+            job.write_done(max_pending=workers * 2)
+        job.submit()
+        job.write_done(wait=True)
+    output.flush()
+
+    elapsed = time.perf_counter() - started
+    size_mb = os.path.getsize(source) / (1024 * 1024)
+    own_rss, worker_rss = peak_rss_mb()
+    report = sys.stderr
+    print(f"✅ Backfilled {records} records in {elapsed:.2f} s: {records / max(elapsed, 1e-9):.0f} records/s, "
+          f"{size_mb / max(elapsed, 1e-9):.1f} MB/s with {workers} workers", file=report)
+    print(f"   {job.conversations} ended conversations, {job.qualified} qualify as leads"
+          + (f", {job.queued} newly queued in {outbox_path}" if outbox else ""), file=report)
+    if malformed:
+        print(f"   Skipped {malformed} malformed records", file=report)
+    if job.open:
+        print(f"   {len(job.open)} conversations never ended and were left out", file=report)
+    print(f"   Peak RSS: {own_rss:.1f} MB parent, {worker_rss:.1f} MB largest worker", file=report)
+    return job
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('source', nargs='?', default='transcription.json')
+    parser.add_argument('--output', default='-', help="JSONL file for one row per ended conversation, - for stdout")
+    parser.add_argument('--outbox', help="Also queue qualifying leads in this lead outbox database")
+    parser.add_argument('--workers', type=int, help="Processes to parse with (default: one per CPU)")
+    parser.add_argument('--chunk-mb', type=float, default=8.0)
+    parser.add_argument('--batch-size', type=int, default=500, help="Conversations per lead extraction task")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.source):
+        print(f"❌ {args.source} not found", file=sys.stderr)
+        return 1
+    if args.output == '-':
+        backfill(args.source, sys.stdout, args.outbox, args.workers, args.chunk_mb, args.batch_size)
+    else:
+        with open(args.output, 'w') as output:
+            backfill(args.source, output, args.outbox, args.workers, args.chunk_mb, args.batch_size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Stress test for the tour booking engine.
+
+Fires hundreds of concurrent hold/confirm attempts at the knowledge base
+slots, many of them racing for the same slot, then checks that no slot was
+given out twice (also after replaying the log) and reports throughput.
+
+    python benchmarks/booking_stress.py [attempts]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from booking import BookingEngine, BookingError
+
+KNOWLEDGE_BASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'knowledge_base.json')
+
+
+async def caller(engine, unit, start, caller_id, results):
+    try:
+        hold = await engine.hold(unit, start, call_sid=f"CA{caller_id}")
+    except BookingError:
+        results['rejected'] += 1
+        return
+    await asyncio.sleep(random.random() / 100)  # Caller thinks it over
+    if random.random() < 0.2:
+        await engine.release(hold['hold_id'])
+        results['released'] += 1
+        return
+    await engine.confirm(hold['hold_id'], {'name': f"Caller {caller_id}"})
+    results['confirmed'].append((unit, start))
+
+
+async def main(attempts):
+    with open(KNOWLEDGE_BASE) as file:
+        vacancies = json.load(file)['properties'][0]['vacancies']
+    all_slots = [(v['unit'], slot) for v in vacancies for slot in v['appointment_slots']]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, 'bookings.log')
+        engine = BookingEngine(log_path)
+        engine.load_calendar(vacancies)
+
+        results = {'rejected': 0, 'released': 0, 'confirmed': []}
+        # Concentrate traffic on a few popular slots so callers really collide
+        targets = [random.choice(all_slots[:20]) for _ in range(attempts)]
+        started = time.perf_counter()
+        await asyncio.gather(*(caller(engine, unit, start, i, results) for i, (unit, start) in enumerate(targets)))
+        elapsed = time.perf_counter() - started
+
+        confirmed = results['confirmed']
+        assert len(confirmed) == len(set(confirmed)), "a slot was booked twice"
+
+        replayed = BookingEngine(log_path)
+        replayed_bookings = {(r['unit'], r['minute']) for r in replayed.reservations.values() if r['state'] == 'booked'}
+        assert len(replayed_bookings) == len(confirmed), "log replay disagrees with live state"
+
+        print(f"{attempts} attempts in {elapsed * 1000:.1f} ms ({attempts / elapsed:,.0f} attempts/s)")
+        print(f"confirmed {len(confirmed)}, released {results['released']}, rejected {results['rejected']} - no double bookings")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
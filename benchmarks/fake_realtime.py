@@ -0,0 +1,220 @@
+"""Local stand-in for the OpenAI Realtime API, with simulated network latency.
+
+    python benchmarks/fake_realtime.py [port]
+
+Point the app at it with OPENAI_REALTIME_URL=ws://127.0.0.1:<port>/v1/realtime.
+It answers session.update with session.updated and, once the caller has
+sent `speak_after_frames` audio appends, streams one assistant response of
+`response_ms` of mu-law silence as response.audio.delta events.
+
+With `turn_frames` set it runs a conversation instead: every `turn_frames`
+inbound frames the caller "speaks" for `speech_frames` frames
+(input_audio_buffer.speech_started / speech_stopped), and `response_delay_ms`
+after speech stops the assistant answers. Speech that starts while the
+assistant is still talking interrupts it, as server_vad would.
+
+Every audio frame sent out starts with its send time (`stamp_frame`), and
+stamped frames coming in are timed with `frame_latency`, so a harness on
+the same host can measure end-to-end latency through the app per frame.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import struct
+import asyncio
+import itertools
+
+import websockets
+
+FRAME_BYTES = 160  # 20 ms of 8 kHz mu-law
+FRAME_SECONDS = 0.02
+SILENCE = base64.b64encode(b'\xff' * FRAME_BYTES).decode()
+STAMP = struct.Struct('>d')
+STAMP_PAD = b'\xff' * (FRAME_BYTES - STAMP.size)
+
+
+def stamp_frame():
+    """One base64 frame of silence carrying the current wall clock time."""
+    return base64.b64encode(STAMP.pack(time.time()) + STAMP_PAD).decode()
+
+
+def frame_latency(frame, now=None):
+    """Seconds since a stamped frame was sent, or None if it carries no stamp."""
+    if len(frame) < STAMP.size:
+        return None
+    sent = STAMP.unpack_from(frame)[0]
+    now = time.time() if now is None else now
+    # Unstamped silence decodes to NaN, which fails the comparison
+    return now - sent if 0 <= now - sent < 60 else None
+
+
+class FakeRealtimeServer:
+    """Minimal realtime protocol: session events, audio appends in, audio deltas out.
+
+    `handshake_ms` delays every connection before it is accepted and
+    `one_way_ms` delays every message in each direction, roughly modelling
+    TLS setup and the network path to the real API. Messages are delayed,
+    not serialized, so a 20 ms frame stream keeps its rate. Deltas go out
+    every `delta_interval_ms`, or all at once when it is 0.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, handshake_ms=150, one_way_ms=40,
+                 speak_after_frames=1, response_ms=1000, turn_frames=0, speech_frames=25,
+                 response_delay_ms=300, delta_interval_ms=0):
+        self.host = host
+        self.port = port
+        self.handshake_ms = handshake_ms
+        self.one_way_ms = one_way_ms
+        self.speak_after_frames = speak_after_frames
+        self.response_ms = response_ms
+        self.turn_frames = turn_frames
+        self.speech_frames = speech_frames
+        self.response_delay_ms = response_delay_ms
+        self.delta_interval_ms = delta_interval_ms
+        self.connections = 0
+        self.session_updates = 0
+        self.live = set()
+        self._ids = itertools.count(1)
+        self._server = None
+        self.reset_stats()
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/v1/realtime"
+
+    def reset_stats(self):
+        self.stats = {'frames_in': 0, 'deltas_out': 0, 'responses': 0, 'interrupted': 0}
+        self.inbound_latencies = []  # Seconds from the caller stamping a frame to it arriving here
+
+    async def _process_request(self, connection, request):
+        await asyncio.sleep(self.handshake_ms / 1000)
+        return None
+
+    async def _writer(self, ws, outbox):
+        """Send queued events once their simulated one-way delay has passed."""
+        loop = asyncio.get_running_loop()
+        while True:
+            due, event = await outbox.get()
+            if due > loop.time():
+                await asyncio.sleep(due - loop.time())
+            if event.get('type') == 'response.audio.delta':
+                event = {**event, 'delta': stamp_frame()}
+                self.stats['deltas_out'] += 1
+            await ws.send(json.dumps(event))
+
+    async def _respond(self, emit, delay=0.0):
+        item_id = f"item_{next(self._ids)}"
+        self.stats['responses'] += 1
+        if delay:
+            await asyncio.sleep(delay)
+        emit({'type': 'response.created', 'response': {'id': f"resp_{item_id}"}})
+        try:
+            for _ in range(max(1, self.response_ms // 20)):
+                emit({'type': 'response.audio.delta', 'item_id': item_id})
+                if self.delta_interval_ms:
+                    await asyncio.sleep(self.delta_interval_ms / 1000)
+        except asyncio.CancelledError:
+            self.stats['interrupted'] += 1
+            emit({'type': 'response.done', 'response': {'id': f"resp_{item_id}", 'status': 'cancelled'}})
+            raise
+        emit({'type': 'response.audio.done', 'item_id': item_id})
+        emit({'type': 'response.done', 'response': {'id': f"resp_{item_id}", 'status': 'completed'}})
+
+    def _crossed(self, before, after, offset):
+        """Whether the caller's frame count passed `offset` frames into a turn (turns start at turn_frames)."""
+        def boundaries(frames):
+            return max(0, (frames - offset) // self.turn_frames)
+        return boundaries(after) > boundaries(before)
+
+    async def _handler(self, ws):
+        self.connections += 1
+        self.live.add(ws)
+        loop = asyncio.get_running_loop()
+        delay = self.one_way_ms / 1000
+        outbox = asyncio.Queue()
+        inbox = asyncio.Queue()
+
+        def emit(event):
+            outbox.put_nowait((loop.time() + delay, event))
+
+        async def reader():
+            async for message in ws:
+                # Arrival time, before any simulated delay, for the inbound latency
+                inbox.put_nowait((loop.time() + delay, time.time(), message))
+            inbox.put_nowait((None, None, None))
+
+        emit({'type': 'session.created', 'session': {}})
+        writer = asyncio.create_task(self._writer(ws, outbox))
+        reading = asyncio.create_task(reader())
+        frames = 0
+        responding = None
+        try:
+            while True:
+                due, arrived, message = await inbox.get()
+                if message is None:
+                    break
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                event = json.loads(message)
+                kind = event.get('type')
+                if kind == 'session.update':
+                    self.session_updates += 1
+                    emit({'type': 'session.updated', 'session': event.get('session', {})})
+                elif kind == 'input_audio_buffer.append':
+                    audio = base64.b64decode(event.get('audio', ''))
+                    for start in range(0, len(audio), FRAME_BYTES):
+                        latency = frame_latency(audio[start:start + FRAME_BYTES], arrived)
+                        if latency is not None:
+                            self.inbound_latencies.append(latency)
+                    count = max(1, len(audio) // FRAME_BYTES)
+                    before, frames = frames, frames + count
+                    self.stats['frames_in'] += count
+                    if not self.turn_frames:
+                        if before < self.speak_after_frames <= frames and responding is None:
+                            responding = asyncio.create_task(self._respond(emit))
+                        continue
+                    if self._crossed(before, frames, 0):
+                        emit({'type': 'input_audio_buffer.speech_started', 'audio_start_ms': frames * 20})
+                        if responding is not None and not responding.done():
+                            responding.cancel()
+                    if self._crossed(before, frames, self.speech_frames):
+                        emit({'type': 'input_audio_buffer.speech_stopped', 'audio_end_ms': frames * 20})
+                        emit({'type': 'input_audio_buffer.committed', 'item_id': f"item_{next(self._ids)}"})
+                        responding = asyncio.create_task(self._respond(emit, self.response_delay_ms / 1000))
+                elif kind == 'response.create':
+                    responding = asyncio.create_task(self._respond(emit))
+                elif kind == 'response.cancel' and responding is not None and not responding.done():
+                    responding.cancel()
+        finally:
+            self.live.discard(ws)
+            for task in (responding, writer, reading):
+                if task is not None:
+                    task.cancel()
+
+    async def start(self):
+        self._server = await websockets.serve(
+            self._handler, self.host, self.port, process_request=self._process_request, max_size=None
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def disconnect_all(self):
+        """Close every open session, as the API does when it drops connections."""
+        await asyncio.gather(*(ws.close() for ws in list(self.live)), return_exceptions=True)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+async def main(port):
+    server = await FakeRealtimeServer(port=port).start()
+    print(f"Fake realtime API listening on {server.url}")
+    await asyncio.Future()
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 8765))
@@ -0,0 +1,339 @@
+"""How many concurrent calls one app process handles: ramped load against a fake realtime API.
+
+    python benchmarks/load_test.py --steps 1,10,25,50 --duration 20 --output load.json
+    python benchmarks/load_test.py --steps 1,10,25,50 --compare load.json
+
+Starts the app under uvicorn in its own process, pointed at
+benchmarks/fake_realtime.py through OPENAI_REALTIME_URL, waits for its
+startup traffic (clip renders) to the fake API to stop, and for each step
+runs that many benchmarks/twilio_client.py callers at once. Each caller
+streams 20 ms frames, speaks every `--turn-ms` and gets answered, so calls
+see interruptions, clears and marks as in production. Per step it reports
+the app's CPU and RSS per call, event loop lag (from /metrics), end-to-end
+frame latency percentiles in both directions and frames lost on the way.
+Results are written as JSON; `--compare` prints the change against an
+earlier run.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_realtime import FakeRealtimeServer
+from twilio_client import SimulatedCall
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_usage(pid):
+    """(CPU seconds, RSS bytes) of a process, from psutil or /proc."""
+    if psutil is not None:
+        process = psutil.Process(pid)
+        cpu = process.cpu_times()
+        return cpu.user + cpu.system, process.memory_info().rss
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+    return cpu, rss
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Percentiles in milliseconds, plus the max."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {f"p{p}": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 2) for p in points}
+    result['max'] = round(ordered[-1] * 1000, 2)
+    return result
+
+
+def parse_metrics(text):
+    """Prometheus text into {(name, labels): value}."""
+    values = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        values[(name, labels.rstrip('}'))] = float(value)
+    return values
+
+
+def histogram_summary(before, after, name):
+    """Mean and bucket-bound p50/p99 in ms of what a histogram observed between two scrapes."""
+    def delta(key):
+        return after.get(key, 0.0) - before.get(key, 0.0)
+
+    count = delta((f"{name}_count", ''))
+    if not count:
+        return {}
+    buckets = sorted(
+        (float(labels.split('"')[1]), delta((series, labels)))
+        for series, labels in after if series == f"{name}_bucket" and 'Inf' not in labels
+    )
+
+    def bound(q):
+        for le, cumulative in buckets:
+            if cumulative >= q * count:
+                return round(le * 1000, 2)
+        return None  # Beyond the largest bucket
+
+    return {'mean': round(delta((f"{name}_sum", '')) / count * 1000, 2), 'p50_le': bound(0.5), 'p99_le': bound(0.99)}
+
+
+class App:
+    """main.py under uvicorn in a child process, with its state files in a temporary directory."""
+
+    def __init__(self, realtime_url, env=None):
+        self.port = free_port()
+        self.state_dir = tempfile.mkdtemp(prefix='load-test-')
+        self.env = {
+            **os.environ,
+            'OPENAI_API_KEY': 'load-test',
+            'OPENAI_REALTIME_URL': realtime_url,
+            'KB_RELOAD_INTERVAL': '0',
+            'LOG_LEVEL': 'WARNING',
+            'TRANSCRIPT_DB': os.path.join(self.state_dir, 'transcripts.db'),
+            'LEAD_OUTBOX_PATH': os.path.join(self.state_dir, 'lead_outbox.db'),
+            'BOOKINGS_LOG': os.path.join(self.state_dir, 'bookings.log'),
+            'AUDIO_CLIP_DIR': os.path.join(self.state_dir, 'audio_clips'),
+            # Cached greeting frames carry their capture-time stamps and would skew frame latency
+            'CACHED_GREETING': 'false',
+            **(env or {}),
+        }
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self.log = open(os.path.join(self.state_dir, 'app.log'), 'wb')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(self.port), '--log-level', 'warning'],
+            cwd=ROOT, env=self.env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        import httpx
+        async with httpx.AsyncClient() as client:
+            for _ in range(200):
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"App exited with {self.process.returncode}, see {self.log.name}")
+                try:
+                    await client.get(self.base_url + '/')
+                    return
+                except httpx.TransportError:
+                    await asyncio.sleep(0.05)
+        raise RuntimeError(f"App did not start, see {self.log.name}")
+
+    async def scrape(self):
+        import httpx
+        async with httpx.AsyncClient() as client:
+            return parse_metrics((await client.get(self.base_url + '/metrics')).text)
+
+    def usage(self):
+        return process_usage(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+async def wait_until_quiet(fake, quiet_s=1.0, timeout=60.0):
+    """Wait until the app has stopped talking to the fake API, e.g. after rendering clips at startup.
+
+    Returns False if it is still busy after `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    last, since = None, time.monotonic()
+    while time.monotonic() < deadline:
+        activity = (fake.connections, len(fake.live), fake.stats['deltas_out'], fake.stats['responses'])
+        if activity != last:
+            last, since = activity, time.monotonic()
+        elif not fake.live and time.monotonic() - since >= quiet_s:
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+async def run_step(app, fake, calls, args):
+    fake.reset_stats()
+    before = await app.scrape()
+    cpu_before, rss_before = app.usage()
+    rss_peak = rss_before
+
+    async def sample_rss():
+        nonlocal rss_peak
+        while True:
+            rss_peak = max(rss_peak, app.usage()[1])
+            await asyncio.sleep(0.25)
+
+    async def caller(n):
+        await asyncio.sleep(args.ramp * n / calls)
+        call = SimulatedCall(f"ws://127.0.0.1:{app.port}/media-stream", f"CAload{calls}x{n}", args.duration, args.drain)
+        return await call.run()
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(caller(n) for n in range(calls)))
+    wall = time.perf_counter() - started
+    sampler.cancel()
+    cpu_after, _ = app.usage()
+    after = await app.scrape()
+
+    frames_sent = sum(call.frames_sent for call in results)
+    frames_received = sum(call.frames_received for call in results)
+    step = {
+        'calls': calls,
+        'failed_calls': sum(1 for call in results if call.error),
+        'wall_s': round(wall, 2),
+        'cpu_per_call_pct': round((cpu_after - cpu_before) / wall / calls * 100, 2),
+        'rss_mb': round(rss_peak / 2 ** 20, 1),
+        'rss_per_call_kb': round(max(0, rss_peak - rss_before) / calls / 1024, 1),
+        'event_loop_lag_ms': histogram_summary(before, after, 'voice_event_loop_lag_seconds'),
+        'outbound_latency_ms': percentiles([s for call in results for s in call.latencies]),
+        'inbound_latency_ms': percentiles(fake.inbound_latencies),
+        'inbound_frames': {'sent': frames_sent, 'received': fake.stats['frames_in'],
+                           'dropped': max(0, frames_sent - fake.stats['frames_in'])},
+        'outbound_frames': {'sent': fake.stats['deltas_out'], 'received': frames_received,
+                            'dropped': max(0, fake.stats['deltas_out'] - frames_received)},
+        'responses': fake.stats['responses'],
+        'interruptions': fake.stats['interrupted'],
+        'clears': sum(call.clears for call in results),
+        'marks_acked': sum(call.marks_acked for call in results),
+        # Relays still open after every caller hung up
+        'calls_active_after': after.get(('voice_calls_active', ''), 0),
+        'tasks_after': after.get(('voice_asyncio_tasks', ''), 0),
+        'relay_dropped': {d: after.get(('voice_relay_audio_dropped_total', f'direction="{d}"'), 0)
+                          - before.get(('voice_relay_audio_dropped_total', f'direction="{d}"'), 0) for d in ('openai', 'twilio')},
+        'harness_max_send_lag_ms': round(max(call.max_send_lag for call in results) * 1000, 2),
+        'errors': sorted({call.error for call in results if call.error})[:5],
+    }
+    # Close whatever the app left open so the next step starts clean
+    await fake.disconnect_all()
+    await asyncio.sleep(0.5)
+    return step
+
+
+def print_step(step):
+    out, inbound = step['outbound_latency_ms'], step['inbound_latency_ms']
+    print(f"{step['calls']:>4} calls: cpu {step['cpu_per_call_pct']:.2f}%/call, rss {step['rss_mb']} MB "
+          f"(+{step['rss_per_call_kb']} KB/call), loop lag {step['event_loop_lag_ms'].get('mean', '-')} ms mean, "
+          f"out p50/p99 {out.get('p50', '-')}/{out.get('p99', '-')} ms, in p50/p99 {inbound.get('p50', '-')}/{inbound.get('p99', '-')} ms, "
+          f"dropped in/out {step['inbound_frames']['dropped']}/{step['outbound_frames']['dropped']}, "
+          f"failed {step['failed_calls']}, left open {step['calls_active_after']:.0f}, tasks {step['tasks_after']:.0f}")
+
+
+def compare(baseline_path, steps):
+    """Print the change of the headline numbers against an earlier results file, step by step."""
+    with open(baseline_path) as f:
+        baseline = {step['calls']: step for step in json.load(f)['steps']}
+    headline = [
+        ('cpu_per_call_pct', lambda s: s['cpu_per_call_pct']),
+        ('rss_per_call_kb', lambda s: s['rss_per_call_kb']),
+        ('out_p99_ms', lambda s: s['outbound_latency_ms'].get('p99')),
+        ('in_p99_ms', lambda s: s['inbound_latency_ms'].get('p99')),
+        ('loop_lag_mean_ms', lambda s: s['event_loop_lag_ms'].get('mean')),
+    ]
+    print(f"Compared with {baseline_path}:")
+    for step in steps:
+        old = baseline.get(step['calls'])
+        if old is None:
+            continue
+        changes = []
+        for name, value in headline:
+            a, b = value(old), value(step)
+            if a is None or b is None:
+                continue
+            change = f"{(b - a) / a * 100:+.0f}%" if a else 'n/a'
+            changes.append(f"{name} {a} -> {b} ({change})")
+        print(f"{step['calls']:>4} calls: " + ', '.join(changes))
+
+
+async def run(args):
+    fake = await FakeRealtimeServer(
+        handshake_ms=args.handshake_ms, one_way_ms=args.one_way_ms, response_ms=args.response_ms,
+        turn_frames=args.turn_ms // 20, speech_frames=args.speech_ms // 20,
+        response_delay_ms=args.response_delay_ms, delta_interval_ms=args.delta_interval_ms
+    ).start()
+    app = App(fake.url, dict(item.split('=', 1) for item in args.env))
+    await app.start()
+    steps = []
+    try:
+        # Startup traffic such as greeting clip renders must not count towards the first step
+        if not await wait_until_quiet(fake):
+            print("Warning: the app was still talking to the fake API after warm-up", file=sys.stderr)
+        fake.reset_stats()
+        for calls in args.steps:
+            step = await run_step(app, fake, calls, args)
+            print_step(step)
+            steps.append(step)
+    finally:
+        await fake.disconnect_all()
+        app.stop()
+        await fake.stop()
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'steps': steps,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(args.compare, steps)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--steps', type=lambda v: [int(n) for n in v.split(',')], default=[1, 5, 10, 25],
+                        help='Concurrent calls per step, comma separated')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds each caller streams audio')
+    parser.add_argument('--ramp', type=float, default=1.0, help='Seconds over which a step\'s calls are started')
+    parser.add_argument('--drain', type=float, default=2.0, help='Seconds callers keep listening after they stop talking')
+    parser.add_argument('--handshake-ms', type=int, default=150)
+    parser.add_argument('--one-way-ms', type=int, default=40)
+    parser.add_argument('--turn-ms', type=int, default=4000, help='The caller starts speaking this often')
+    parser.add_argument('--speech-ms', type=int, default=800, help='How long the caller speaks each turn')
+    parser.add_argument('--response-delay-ms', type=int, default=300)
+    parser.add_argument('--response-ms', type=int, default=2000, help='Audio per assistant answer')
+    parser.add_argument('--delta-interval-ms', type=int, default=10,
+                        help='Gap between audio deltas; the real API streams faster than real time')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='App setting for the run, e.g. --env AUDIO_COALESCE_MS=100')
+    parser.add_argument('--output', default='load_test_results.json', help='JSON results file, empty to skip')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,106 @@
+"""Time from Twilio's stream start to the first assistant audio, cold vs pre-warmed.
+
+    python benchmarks/prewarm_benchmark.py [calls]
+
+Runs the app under uvicorn against benchmarks/fake_realtime.py. A warm call
+POSTs /incoming-call first and opens the media stream `prompt_ms` later, as
+Twilio does after playing the TwiML prompts; a cold call skips the webhook.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import asyncio
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_realtime import FakeRealtimeServer
+
+FRAME = base64.b64encode(b'\xff' * 160).decode()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def one_call(app_port, call_sid, warm, prompt_ms):
+    import httpx
+    import websockets
+
+    if warm:
+        async with httpx.AsyncClient() as client:
+            await client.post(f"http://127.0.0.1:{app_port}/incoming-call", data={'CallSid': call_sid})
+        await asyncio.sleep(prompt_ms / 1000)
+
+    async with websockets.connect(f"ws://127.0.0.1:{app_port}/media-stream", close_timeout=0.1) as ws:
+        await ws.send(json.dumps({'event': 'connected'}))
+        started = time.perf_counter()
+        await ws.send(json.dumps({'event': 'start', 'start': {'streamSid': f"MZ{call_sid}", 'callSid': call_sid}}))
+
+        async def feed():
+            timestamp = 0
+            while True:
+                await ws.send(json.dumps({'event': 'media', 'media': {'timestamp': str(timestamp), 'payload': FRAME}}))
+                timestamp += 20
+                await asyncio.sleep(0.02)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            async for message in ws:
+                if json.loads(message).get('event') == 'media':
+                    return (time.perf_counter() - started) * 1000
+        finally:
+            feeder.cancel()
+
+
+async def run(calls, prompt_ms=1500):
+    fake = await FakeRealtimeServer().start()
+    app_port = free_port()
+    # Keep the app's databases and logs out of the working tree
+    state_dir = tempfile.mkdtemp(prefix='prewarm-')
+    os.environ.update({
+        'OPENAI_API_KEY': 'benchmark',
+        'OPENAI_REALTIME_URL': fake.url,
+        'KB_RELOAD_INTERVAL': '0',
+        'KNOWLEDGE_BASE_FILE': os.path.join(ROOT, 'knowledge_base.json'),
+        'TRANSCRIPT_DB': os.path.join(state_dir, 'transcripts.db'),
+        'LEAD_OUTBOX_PATH': os.path.join(state_dir, 'lead_outbox.db'),
+        'BOOKINGS_LOG': os.path.join(state_dir, 'bookings.log'),
+        'AUDIO_CLIP_DIR': os.path.join(state_dir, 'audio_clips'),
+        # Measure the realtime session's first audio, not the cached greeting
+        'CACHED_GREETING': 'false',
+    })
+    import uvicorn
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host='127.0.0.1', port=app_port, log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    results = {}
+    for mode in ('cold', 'warm'):
+        samples = [await asyncio.wait_for(one_call(app_port, f"CA{mode}{i}", mode == 'warm', prompt_ms), 30) for i in range(calls)]
+        results[mode] = samples
+    print(json.dumps(main.realtime_sessions.status()))
+
+    # Closing the realtime side first lets the relay handlers finish before uvicorn shuts down
+    await fake.stop()
+    server.should_exit = True
+    await serving
+
+    print(f"handshake {fake.handshake_ms} ms, one-way {fake.one_way_ms} ms")
+    for mode, samples in results.items():
+        print(f"{mode}: median {statistics.median(samples):.0f} ms, max {max(samples):.0f} ms to first audio")
+
+
+if __name__ == '__main__':
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
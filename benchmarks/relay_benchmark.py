@@ -0,0 +1,73 @@
+"""Micro-benchmark of per-frame relay cost, before and after the fast path.
+
+    python benchmarks/relay_benchmark.py [frames]
+"""
+import os
+import sys
+import json
+import base64
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import relay_codec
+
+STREAM_SID = 'MZ' + 'a' * 32
+PAYLOAD = base64.b64encode(os.urandom(160)).decode()  # One 20 ms mu-law frame
+
+TWILIO_FRAME = json.dumps({
+    'event': 'media',
+    'sequenceNumber': '42',
+    'media': {'track': 'inbound', 'chunk': '41', 'timestamp': '820', 'payload': PAYLOAD},
+    'streamSid': STREAM_SID
+}, separators=(',', ':'))
+
+OPENAI_DELTA = json.dumps({
+    'type': 'response.audio.delta',
+    'event_id': 'event_123',
+    'response_id': 'resp_123',
+    'item_id': 'item_123',
+    'output_index': 0,
+    'content_index': 0,
+    'delta': PAYLOAD
+}, separators=(',', ':'))
+
+
+def inbound_before():
+    data = json.loads(TWILIO_FRAME)
+    if data['event'] == 'media':
+        int(data['media']['timestamp'])
+        json.dumps({"type": "input_audio_buffer.append", "audio": data['media']['payload']})
+
+
+def inbound_after():
+    if relay_codec.peek_twilio_event(TWILIO_FRAME) == 'media':
+        _, payload = relay_codec.twilio_media_fields(TWILIO_FRAME)
+        relay_codec.openai_append_message(payload)
+
+
+def outbound_before():
+    response = json.loads(OPENAI_DELTA)
+    if response.get('type') == 'response.audio.delta' and 'delta' in response:
+        audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
+        # Starlette's send_json serializes with json.dumps
+        json.dumps({"event": "media", "streamSid": STREAM_SID, "media": {"payload": audio_payload}})
+
+
+def outbound_after():
+    if relay_codec.peek_openai_type(OPENAI_DELTA) == 'response.audio.delta':
+        _, delta = relay_codec.openai_delta_fields(OPENAI_DELTA)
+        relay_codec.twilio_media_message(STREAM_SID, delta)
+
+
+def per_frame_ns(func, frames):
+    return min(timeit.repeat(func, number=frames, repeat=5)) / frames * 1e9
+
+
+if __name__ == '__main__':
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"JSON codec for fallback path: {relay_codec.JSON_CODEC}")
+    for name, before, after in [('twilio -> openai', inbound_before, inbound_after),
+                                ('openai -> twilio', outbound_before, outbound_after)]:
+        b, a = per_frame_ns(before, frames), per_frame_ns(after, frames)
+        print(f"{name}: {b:8.0f} ns/frame before, {a:8.0f} ns/frame after ({b / a:.1f}x)")
@@ -0,0 +1,54 @@
+"""Query latency of the semantic search index on a synthetic portfolio.
+
+    python benchmarks/search_benchmark.py [units]
+"""
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semantic_search import SemanticIndex
+
+KNOWLEDGE_BASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'knowledge_base.json')
+QUERIES = [
+    "somewhere with a yard for my dog under 1300",
+    "two bedroom with an elevator",
+    "cheap one bedroom under $1,150",
+    "near the gym and pool",
+]
+
+
+def main(units):
+    with open(KNOWLEDGE_BASE) as file:
+        prop = json.load(file)['properties'][0]
+    vacancies = []
+    for i in range(units):
+        vacancy = dict(random.choice(prop['vacancies']))
+        vacancy['unit'] = f"U{i}"
+        vacancy['price'] = f"${random.randint(900, 2000)}/month"
+        vacancies.append(vacancy)
+    prop = {**prop, 'vacancies': vacancies}
+
+    started = time.perf_counter()
+    index = SemanticIndex.from_property(prop)
+    print(f"built {len(index.docs)} docs x {index.dim} dims in {time.perf_counter() - started:.2f} s")
+
+    rounds = 200
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query in QUERIES:
+            index.search(query, kind='unit')
+    single = (time.perf_counter() - started) / (rounds * len(QUERIES)) * 1000
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        index.search_batch(QUERIES * 16, kind='unit')
+    batched = (time.perf_counter() - started) / (rounds * len(QUERIES) * 16) * 1000
+    print(f"{single:.3f} ms/query single, {batched:.3f} ms/query batched")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,110 @@
+"""Simulated Twilio Media Streams caller for /media-stream.
+
+Sends `connected` and `start`, then one stamped 20 ms mu-law `media` frame
+every 20 ms on a fixed schedule, the way Twilio streams a live call. It
+plays received audio back in real time and acknowledges each `mark` once
+playback reaches it; a `clear` empties playback and acknowledges the
+pending marks at once, as Twilio does.
+"""
+import json
+import time
+import base64
+import asyncio
+
+import websockets
+
+from fake_realtime import FRAME_SECONDS, frame_latency, stamp_frame
+
+
+class SimulatedCall:
+    """One caller. `run()` streams for `duration` seconds, waits `drain` for the last audio, hangs up."""
+
+    def __init__(self, url, call_sid, duration=10.0, drain=2.0):
+        self.url = url
+        self.call_sid = call_sid
+        self.stream_sid = f"MZ{call_sid}"
+        self.duration = duration
+        self.drain = drain
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.latencies = []  # Seconds from the fake realtime server stamping a delta to it arriving here
+        self.marks_acked = 0
+        self.clears = 0
+        self.max_send_lag = 0.0  # Worst lateness of our own 20 ms schedule; large values mean the harness is overloaded
+        self.error = None
+        self._play_until = 0.0
+        self._pending_marks = {}  # mark name -> timer acknowledging it
+
+    async def run(self):
+        try:
+            async with websockets.connect(self.url, close_timeout=0.1, max_size=None) as ws:
+                await ws.send(json.dumps({'event': 'connected', 'protocol': 'Call', 'version': '1.0.0'}))
+                await ws.send(json.dumps({'event': 'start', 'streamSid': self.stream_sid, 'start': {
+                    'streamSid': self.stream_sid, 'callSid': self.call_sid, 'tracks': ['inbound'],
+                    'mediaFormat': {'encoding': 'audio/x-mulaw', 'sampleRate': 8000, 'channels': 1}}}))
+                receiving = asyncio.create_task(self._receive(ws))
+                try:
+                    await self._stream(ws)
+                    await asyncio.sleep(self.drain)
+                finally:
+                    receiving.cancel()
+                    for timer in self._pending_marks.values():
+                        timer.cancel()
+        except (OSError, websockets.WebSocketException) as e:
+            self.error = repr(e)
+        return self
+
+    async def _stream(self, ws):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        frames = round(self.duration / FRAME_SECONDS)
+        for n in range(frames):
+            due = started + n * FRAME_SECONDS
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.max_send_lag = max(self.max_send_lag, -delay)
+            await ws.send(json.dumps({
+                'event': 'media',
+                'sequenceNumber': str(n + 2),
+                'media': {'track': 'inbound', 'chunk': str(n + 1), 'timestamp': str(n * 20), 'payload': stamp_frame()},
+                'streamSid': self.stream_sid
+            }))
+            self.frames_sent += 1
+
+    async def _receive(self, ws):
+        loop = asyncio.get_running_loop()
+        async for message in ws:
+            data = json.loads(message)
+            event = data.get('event')
+            if event == 'media':
+                now = time.time()
+                latency = frame_latency(base64.b64decode(data['media']['payload']), now)
+                if latency is not None:
+                    self.latencies.append(latency)
+                self.frames_received += 1
+                self._play_until = max(self._play_until, loop.time()) + FRAME_SECONDS
+            elif event == 'mark':
+                name = data['mark']['name']
+                delay = max(0.0, self._play_until - loop.time())
+                self._pending_marks[name] = loop.call_later(delay, self._ack_mark, ws, name)
+            elif event == 'clear':
+                self.clears += 1
+                self._play_until = loop.time()
+                pending, self._pending_marks = self._pending_marks, {}
+                for name, timer in pending.items():
+                    timer.cancel()
+                    self._ack_mark(ws, name)
+
+    def _ack_mark(self, ws, name):
+        self._pending_marks.pop(name, None)
+        self.marks_acked += 1
+        asyncio.ensure_future(self._send_quietly(ws, {'event': 'mark', 'streamSid': self.stream_sid, 'mark': {'name': name}}))
+
+    @staticmethod
+    async def _send_quietly(ws, event):
+        try:
+            await ws.send(json.dumps(event))
+        except websockets.ConnectionClosed:
+            pass
@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+
+def epoch_minute(value):
+    """ISO string or naive datetime -> minutes since the epoch (slot times are property-local)."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.replace(tzinfo=timezone.utc).timestamp()) // 60
+
+
+def minute_to_iso(minute):
+    return datetime.fromtimestamp(minute * 60, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def reservation_key(reservation):
+    return (reservation['property'], reservation['unit'], reservation['minute'])
+
+
+class BookingError(Exception):
+    """A reservation could not be made or changed."""
+
+
+class BookingEngine:
+    """Tour slot reservations over the appointment_slots of knowledge_base.json.
+
+    Each unit's calendar is a sorted array of epoch minutes plus a minute ->
+    index map, so availability checks are O(1). Reservations live in one
+    dict keyed by (property, unit, minute); check-and-set happens without
+    awaiting, so it is atomic on the event loop. Every change is appended to
+    a JSONL log (group-committed with one write + fsync per batch) and
+    replayed on start; entries logged before properties were tracked belong
+    to `default_property`. A hold expires after `hold_ttl` seconds unless it
+    is confirmed, and only the call that made it can confirm or release it.
+
+    Reservations are only in this process's memory and the log is only read
+    at start, so bookings need a single app worker: two workers would each
+    hand out the same slot.
+    """
+
+    def __init__(self, log_path="bookings.log", hold_ttl=300.0, default_property=None):
+        self.log_path = log_path
+        self.hold_ttl = hold_ttl
+        self.default_property = default_property
+        self.calendars = {}  # property -> unit -> (minutes, minute -> index)
+        self.reservations = {}
+        self.holds = {}
+        self._pending_log = []
+        self._flush_task = None
+        self._replay()
+
+    def load_calendar(self, vacancies, property_key=None):
+        """(Re)build one property's slot arrays from its knowledge base vacancies. Reservations are kept."""
+        calendars = {}
+        for vacancy in vacancies:
+            minutes = array('q', sorted({epoch_minute(slot) for slot in vacancy.get('appointment_slots', [])}))
+            calendars[vacancy['unit'].upper()] = (minutes, {m: i for i, m in enumerate(minutes)})
+        self.calendars[property_key] = calendars
+
+    def drop_calendar(self, property_key):
+        self.calendars.pop(property_key, None)
+
+    def _calendar(self, property_key, unit):
+        return self.calendars.get(property_key, {}).get(unit)
+
+    def _live(self, key, now=None):
+        """The reservation on a slot, or None if it is free or its hold expired."""
+        reservation = self.reservations.get(key)
+        if reservation is None:
+            return None
+        if reservation['state'] == 'held' and reservation['expires_at'] <= (now or time.time()):
+            del self.reservations[key]
+            self.holds.pop(reservation['hold_id'], None)
+            return None
+        return reservation
+
+    def is_available(self, unit, start, property_key=None):
+        unit = unit.upper()
+        minute = epoch_minute(start)
+        calendar = self._calendar(property_key, unit)
+        if calendar is None or minute not in calendar[1]:
+            return False
+        return self._live((property_key, unit, minute)) is None
+
+    def available_slots(self, unit, day_start=None, day_end=None, property_key=None):
+        """Free slot minutes for a unit, optionally within [day_start, day_end)."""
+        unit = unit.upper()
+        calendar = self._calendar(property_key, unit)
+        if calendar is None:
+            return []
+        minutes = calendar[0]
+        lo = bisect_left(minutes, day_start) if day_start is not None else 0
+        hi = bisect_left(minutes, day_end) if day_end is not None else len(minutes)
+        now = time.time()
+        return [m for m in minutes[lo:hi] if self._live((property_key, unit, m), now) is None]
+
+    async def hold(self, unit, start, call_sid=None, property_key=None):
+        """Reserve a slot for hold_ttl seconds. Returns the hold record."""
+        unit = unit.upper()
+        minute = epoch_minute(start)
+        calendar = self._calendar(property_key, unit)
+        if calendar is None:
+            raise BookingError(f"Unit {unit} has no tour calendar")
+        if minute not in calendar[1]:
+            raise BookingError(f"{minute_to_iso(minute)} is not a tour slot for {unit}")
+        key = (property_key, unit, minute)
+        if self._live(key) is not None:
+            raise BookingError(f"{minute_to_iso(minute)} for {unit} is already taken")
+
+        reservation = {
+            'hold_id': uuid.uuid4().hex,
+            'property': property_key,
+            'unit': unit,
+            'minute': minute,
+            'state': 'held',
+            'expires_at': time.time() + self.hold_ttl,
+            'call_sid': call_sid,
+            'contact': None
+        }
+        self.reservations[key] = reservation
+        self.holds[reservation['hold_id']] = reservation
+        try:
+            await self._log('hold', reservation)
+        except BookingError:
+            self.reservations.pop(key, None)
+            self.holds.pop(reservation['hold_id'], None)
+            raise
+        return self._public(reservation)
+
+    def _check_owner(self, reservation, call_sid):
+        if call_sid is not None and reservation['call_sid'] != call_sid:
+            raise BookingError("That hold was made on another call")
+
+    async def confirm(self, hold_id, contact=None, call_sid=None):
+        """Turn a live hold into a booking. With `call_sid`, only a hold made on that call."""
+        reservation = self.holds.get(hold_id)
+        if reservation is None or self._live(reservation_key(reservation)) is None:
+            raise BookingError("That hold has expired or does not exist")
+        self._check_owner(reservation, call_sid)
+        previous = dict(reservation)
+        reservation.update(state='booked', expires_at=None, contact=contact)
+        try:
+            await self._log('confirm', reservation)
+        except BookingError:
+            reservation.update(previous)
+            raise
+        return self._public(reservation)
+
+    async def release(self, hold_id, call_sid=None):
+        """Free a held or booked slot. Returns False if there was nothing to release.
+
+        With `call_sid`, only a reservation made on that call.
+        """
+        reservation = self.holds.get(hold_id)
+        if reservation is None:
+            return False
+        self._check_owner(reservation, call_sid)
+        # Freed only once the release is on disk, as with hold and confirm
+        await self._log('release', reservation)
+        if self.holds.pop(hold_id, None) is not None:
+            self.reservations.pop(reservation_key(reservation), None)
+        return True
+
+    def bookings_for_call(self, call_sid):
+        """Confirmed bookings made during one call."""
+        return [
+            self._public(r) for r in self.holds.values()
+            if r['state'] == 'booked' and call_sid and r['call_sid'] == call_sid
+        ]
+
+    def bookings_by_call(self):
+        """Confirmed bookings grouped by the call that made them, {call_sid: [booking]}."""
+        by_call = {}
+        for reservation in self.holds.values():
+            if reservation['state'] == 'booked' and reservation['call_sid']:
+                by_call.setdefault(reservation['call_sid'], []).append(self._public(reservation))
+        return by_call
+
+    def _public(self, reservation):
+        return {
+            'hold_id': reservation['hold_id'],
+            'property': reservation['property'],
+            'unit': reservation['unit'],
+            'start': minute_to_iso(reservation['minute']),
+            'status': reservation['state'],
+            'expires_at': reservation['expires_at'],
+            'contact': reservation['contact']
+        }
+
+    # Durable log
+
+    def _replay(self):
+        try:
+            file = open(self.log_path, 'r')
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn final line from a crash
+                self._apply(entry)
+        now = time.time()
+        for key in list(self.reservations):
+            self._live(key, now)
+
+    def _apply(self, entry):
+        op = entry.pop('op')
+        entry.setdefault('property', self.default_property)
+        key = reservation_key(entry)
+        if op == 'release':
+            self.reservations.pop(key, None)
+            self.holds.pop(entry['hold_id'], None)
+        else:
+            self.reservations[key] = entry
+            self.holds[entry['hold_id']] = entry
+
+    async def _log(self, op, reservation):
+        future = asyncio.get_running_loop().create_future()
+        self._pending_log.append(({'op': op, **reservation}, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_log())
+        await future
+
+    async def _flush_log(self):
+        # Everything logged while the previous batch was being written goes out in one write
+        while self._pending_log:
+            batch, self._pending_log = self._pending_log, []
+            data = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry, _ in batch)
+            try:
+                await asyncio.to_thread(self._write, data)
+                error = None
+            except OSError as e:
+                error = e
+            for _, future in batch:
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(BookingError(f"Could not persist booking: {error}"))
+                else:
+                    future.set_result(None)
+        self._flush_task = None
+
+    def _write(self, data):
+        with open(self.log_path, 'a') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+    # Realtime function tools
+
+    async def call(self, name, arguments, call_sid=None, property_key=None):
+        """Dispatch a booking tool call for one property. `arguments` is the raw JSON string."""
+        try:
+            kwargs = json.loads(arguments) if arguments else {}
+        except json.JSONDecodeError:
+            return {'error': 'Arguments were not valid JSON'}
+        if not isinstance(kwargs, dict):
+            return {'error': f"Arguments for {name} must be a JSON object"}
+        # Every argument of these tools is a string; anything else would fail deep inside
+        wrong = [key for key, value in kwargs.items() if value is not None and not isinstance(value, str)]
+        if wrong:
+            return {'error': f"Arguments {', '.join(wrong)} for {name} must be strings"}
+        try:
+            if name == 'hold_tour':
+                return await self.hold(kwargs['unit'], kwargs['start'], call_sid, property_key)
+            if name == 'confirm_tour':
+                contact = {key: kwargs.get(key) for key in ('name', 'phone', 'email')}
+                return await self.confirm(kwargs['hold_id'], contact, call_sid)
+            if name == 'cancel_tour':
+                return {'released': await self.release(kwargs['hold_id'], call_sid)}
+        except KeyError as e:
+            return {'error': f"Missing argument {e} for {name}"}
+        except (BookingError, ValueError, TypeError, AttributeError) as e:
+            return {'error': str(e)}
+        return {'error': f"Unknown tool {name}"}
+
+
+TOOLS = [
+    {
+        "type": "function",
+        "name": "hold_tour",
+        "description": "Hold a tour slot for a unit while the caller confirms. Use a start time returned by `slots`.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "unit": {"type": "string", "description": "Unit number, e.g. A101"},
+                "start": {"type": "string", "description": "Slot start as YYYY-MM-DDTHH:MM:SS"}
+            },
+            "required": ["unit", "start"]
+        }
+    },
+    {
+        "type": "function",
+        "name": "confirm_tour",
+        "description": "Confirm a held tour slot once the caller agrees, with their contact details.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "hold_id": {"type": "string"},
+                "name": {"type": "string"},
+                "phone": {"type": "string"},
+                "email": {"type": "string"}
+            },
+            "required": ["hold_id"]
+        }
+    },
+    {
+        "type": "function",
+        "name": "cancel_tour",
+        "description": "Release a held or confirmed tour slot.",
+        "parameters": {
+            "type": "object",
+            "properties": {"hold_id": {"type": "string"}},
+            "required": ["hold_id"]
+        }
+    },
+]
+
+TOOL_NAMES = {tool['name'] for tool in TOOLS}
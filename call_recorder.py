@@ -0,0 +1,167 @@
+"""Opt-in stereo call recordings, written off the event loop.
+
+The relay only appends payload references to a list; every `batch_frames`
+items the batch is handed to a thread pool, where it is base64-decoded,
+converted from mu-law to PCM16 with vad.ULAW_TO_PCM16 in one vectorized
+lookup, placed on the call's timeline and streamed to a WAV or FLAC file.
+The caller is the left channel and the assistant the right. Twilio's
+inbound media timestamps are the clock; assistant audio is placed where it
+starts playing and cut where a clear stops it. Only the audio between the
+last write and the newest caller frame is held, so memory per call stays
+flat however long the call runs. When the pool falls behind, batches are
+dropped and counted rather than slowing the relay.
+"""
+import base64
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from playout import base64_decoded_length
+from vad import ULAW_TO_PCM16
+
+try:
+    import soundfile
+except (ImportError, OSError):  # OSError: the package is there but libsndfile is not
+    soundfile = None
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 8000
+SAMPLES_PER_MS = SAMPLE_RATE // 1000
+MAX_AHEAD_MS = 60000  # Assistant audio kept ahead of the caller's clock; Twilio never buffers this much
+MAX_GAP_SAMPLES = SAMPLE_RATE * 10  # Silence is written in pieces of at most this many samples
+
+INBOUND, OUTBOUND, CLEAR, CLOSE = range(4)
+
+
+class CallRecorder:
+    """Records one call to `path`. All methods except the worker are called from the event loop."""
+
+    def __init__(self, path, executor, audio_format='WAV', batch_frames=50, max_batches=20):
+        self.path = path
+        self.executor = executor
+        self.audio_format = audio_format.upper()
+        self.batch_frames = batch_frames
+        self.max_batches = max_batches
+        self.dropped_frames = 0
+        self.error = None
+        self._batch = []
+        self._out_cursor_ms = 0  # Where the next assistant chunk starts playing
+        self._latest_ms = 0
+        # Shared with the worker thread
+        self._batches = deque()
+        self._lock = threading.Lock()
+        self._draining = False
+        # Worker-only state
+        self._file = None
+        self._written = 0  # Samples written per channel
+        self._inbound = []  # (start sample, pcm) not yet written
+        self._outbound = []
+
+    def inbound(self, payload, media_timestamp):
+        """One caller media frame at Twilio's media timestamp (ms since the stream started)."""
+        self._latest_ms = media_timestamp
+        self._add((INBOUND, media_timestamp, payload))
+
+    def outbound(self, payload, media_timestamp):
+        """One chunk of assistant audio sent to Twilio; it plays after whatever is already queued."""
+        start = max(self._out_cursor_ms, media_timestamp)
+        self._out_cursor_ms = start + base64_decoded_length(payload) // SAMPLES_PER_MS
+        self._add((OUTBOUND, start, payload))
+
+    def clear(self, media_timestamp):
+        """Twilio was told to clear its buffer: assistant audio after this point never played."""
+        self._out_cursor_ms = media_timestamp
+        self._add((CLEAR, media_timestamp, None))
+
+    def _add(self, item):
+        self._batch.append(item)
+        if len(self._batch) >= self.batch_frames:
+            self._submit()
+
+    def _submit(self):
+        batch, self._batch = self._batch, []
+        with self._lock:
+            if len(self._batches) >= self.max_batches and batch[-1][0] != CLOSE:
+                self.dropped_frames += sum(1 for kind, _, _ in batch if kind != CLEAR)
+                return
+            self._batches.append(batch)
+            if self._draining:
+                return
+            self._draining = True
+        self.executor.submit(self._drain)
+
+    def close(self):
+        """Flush what is left and finish the file in the background."""
+        self._batch.append((CLOSE, self._latest_ms, None))
+        self._submit()
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._batches:
+                    self._draining = False
+                    return
+                batch = self._batches.popleft()
+            if self.error is not None:
+                continue
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.error = e
+                logger.error(f"Recording {self.path} failed: {e!r}")
+                self._close_file()
+
+    def _write_batch(self, batch):
+        if self._file is None:
+            self._file = soundfile.SoundFile(self.path, 'w', samplerate=SAMPLE_RATE, channels=2,
+                                             format=self.audio_format, subtype='PCM_16')
+        # One LUT lookup for the whole batch; segments are views into it
+        audio = [base64.b64decode(payload) for kind, _, payload in batch if kind in (INBOUND, OUTBOUND)]
+        pcm = ULAW_TO_PCM16[np.frombuffer(b''.join(audio), dtype=np.uint8)]
+        offset, index, closing_ms = 0, 0, None
+        for kind, timestamp, _ in batch:
+            if kind == CLEAR:
+                self._cut_outbound(timestamp * SAMPLES_PER_MS)
+            elif kind == CLOSE:
+                closing_ms = timestamp
+            else:
+                segment = pcm[offset:offset + len(audio[index])]
+                offset += len(audio[index])
+                index += 1
+                (self._inbound if kind == INBOUND else self._outbound).append((timestamp * SAMPLES_PER_MS, segment))
+        self._cut_outbound(self._written + MAX_AHEAD_MS * SAMPLES_PER_MS)
+        if closing_ms is None:
+            self._write_until(self._inbound_end())
+        else:
+            self._write_until(max(closing_ms * SAMPLES_PER_MS, self._inbound_end()))
+            self._close_file()
+
+    def _cut_outbound(self, at):
+        self._outbound = [(start, pcm[:at - start]) for start, pcm in self._outbound if start < at]
+
+    def _inbound_end(self):
+        ends = [start + len(pcm) for start, pcm in self._inbound]
+        return max(ends) if ends else self._written
+
+    def _write_until(self, end):
+        while self._written < end:
+            stop = min(end, self._written + MAX_GAP_SAMPLES)
+            frame = np.zeros((stop - self._written, 2), dtype=np.int16)
+            for channel, segments in ((0, self._inbound), (1, self._outbound)):
+                for start, pcm in segments:
+                    lo, hi = max(start, self._written), min(start + len(pcm), stop)
+                    if lo < hi:
+                        frame[lo - self._written:hi - self._written, channel] = pcm[lo - start:hi - start]
+            self._file.write(frame)
+            self._written = stop
+            # Keep only what still reaches past the write position
+            self._inbound = [(s, p) for s, p in self._inbound if s + len(p) > stop]
+            self._outbound = [(s, p) for s, p in self._outbound if s + len(p) > stop]
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
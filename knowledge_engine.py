@@ -0,0 +1,281 @@
+"""In-process query engine over one property of knowledge_base.json.
+
+The knowledge base is compiled once into indexed structures and exposed to
+the realtime model as function-calling tools, so the model looks facts up
+instead of reading them from a long system prompt.
+"""
+import re
+import json
+import itertools
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from semantic_search import SemanticIndex
+
+_PRICE_RE = re.compile(r'\d[\d,]*')
+
+# Hashed n-gram cosines between unrelated texts reach ~0.07, so weaker matches are noise
+MIN_UNIT_SCORE = 0.08
+MIN_AMENITY_SCORE = 0.2
+
+
+def parse_price(text):
+    """'$1,095/month' -> 1095. Returns None if there is no number."""
+    match = _PRICE_RE.search(text or '')
+    return int(match.group().replace(',', '')) if match else None
+
+
+def spoken_slot(slot):
+    """datetime -> 'July 3 at 9:00 AM'."""
+    hour = slot.strftime('%I').lstrip('0')
+    return f"{slot.strftime('%B')} {slot.day} at {hour}:{slot.strftime('%M %p')}"
+
+
+class KnowledgeEngine:
+    """Indexed, read-only view of a single property."""
+
+    def __init__(self, property_data, search_cache=None):
+        self.name = property_data.get('name', '')
+        self.address = property_data.get('address', '')
+        self.amenity_list = list(property_data.get('amenities', []))
+
+        # Floor plans by class, plus an inverted index feature -> classes
+        self.floorplans_by_class = {}
+        self.classes_by_feature = {}
+        for plan in property_data.get('floorplans', []):
+            plan_class = plan['class'].upper()
+            self.floorplans_by_class[plan_class] = plan
+            for room in plan.get('rooms', []):
+                for feature in room.get('features', []):
+                    self.classes_by_feature.setdefault(feature.lower(), set()).add(plan_class)
+        # Community amenities apply to every floor plan. Those marked * are only in
+        # select units the data does not name, so they are kept out of the index
+        self.select_unit_amenities = {}
+        for amenity in self.amenity_list:
+            if amenity.endswith('*'):
+                self.select_unit_amenities[amenity.rstrip('*').lower()] = amenity.rstrip('*')
+            else:
+                self.classes_by_feature.setdefault(amenity.lower(), set()).update(self.floorplans_by_class)
+
+        # Vacancies sorted by price, with a parallel price array for range lookups
+        vacancies = []
+        for vacancy in property_data.get('vacancies', []):
+            slots = sorted(datetime.fromisoformat(slot) for slot in vacancy.get('appointment_slots', []))
+            vacancies.append({
+                'unit': vacancy['unit'].upper(),
+                'class': vacancy['class'].upper(),
+                'type': vacancy['type'].upper(),
+                'price': parse_price(vacancy.get('price')),
+                'slots': slots
+            })
+        vacancies.sort(key=lambda v: (v['price'] is None, v['price'] or 0, v['unit']))
+        self.vacancies = vacancies
+        self.vacancy_prices = [v['price'] if v['price'] is not None else float('inf') for v in vacancies]
+        self.vacancies_by_unit = {v['unit']: v for v in vacancies}
+        self.vacancies_by_type = {}
+        for vacancy in vacancies:
+            self.vacancies_by_type.setdefault(vacancy['type'], []).append(vacancy)
+
+        # Free-text matching of caller wording to units, floor plans and amenities
+        self.search_index = SemanticIndex.from_property(property_data, cache_path=search_cache)
+
+    def _unit_summary(self, vacancy):
+        return {
+            'unit': vacancy['unit'],
+            'type': vacancy['type'],
+            'class': vacancy['class'],
+            'price_per_month': vacancy['price']
+        }
+
+    def find_units(self, max_price=None, min_price=None, type=None, feature=None):
+        """Vacant units filtered by price range, type and feature, cheapest first."""
+        lo = bisect_left(self.vacancy_prices, min_price) if min_price is not None else 0
+        hi = bisect_right(self.vacancy_prices, max_price) if max_price is not None else len(self.vacancies)
+        candidates = self.vacancies[lo:hi]
+        if type:
+            wanted = type.upper().replace(' ', '')
+            candidates = [v for v in candidates if v['type'] == wanted]
+        note = None
+        if feature:
+            classes = self.classes_by_feature.get(feature.lower(), set())
+            select_units = self.select_unit_amenities.get(feature.lower())
+            if select_units and not classes:
+                note = f"{select_units} is available in select units only; the leasing office can say which"
+            candidates = [v for v in candidates if v['class'] in classes]
+        result = {'units': [self._unit_summary(v) for v in candidates]}
+        if note:
+            result['note'] = note
+        return result
+
+    def unit_details(self, unit):
+        vacancy = self.vacancies_by_unit.get((unit or '').upper())
+        if vacancy is None:
+            return {'error': f"Unit {unit} is not available"}
+        details = self._unit_summary(vacancy)
+        plan = self.floorplans_by_class.get(vacancy['class'])
+        if plan:
+            details['size'] = plan.get('range')
+            rooms = plan.get('rooms', [])
+            if rooms:
+                details['occupancy'] = rooms[0].get('occupancy')
+                details['features'] = rooms[0].get('features', [])
+        details['next_tour_slots'] = self.next_tour_slots(vacancy['unit'])
+        return details
+
+    def next_tour_slots(self, unit, is_free=None, count=3):
+        """The first `count` spoken tour slots for a unit, skipping any `is_free(start)` rejects."""
+        vacancy = self.vacancies_by_unit.get((unit or '').upper())
+        if vacancy is None:
+            return []
+        slots = (s for s in vacancy['slots'] if is_free is None or is_free(s))
+        return [spoken_slot(s) for s in itertools.islice(slots, count)]
+
+    def slots(self, unit, date=None):
+        """Tour slots for a unit, optionally limited to one day (YYYY-MM-DD)."""
+        vacancy = self.vacancies_by_unit.get((unit or '').upper())
+        if vacancy is None:
+            return {'error': f"Unit {unit} is not available"}
+        slots = vacancy['slots']
+        if date:
+            try:
+                day = datetime.fromisoformat(date[:10])
+            except ValueError:
+                return {'error': f"Could not understand date {date}, use YYYY-MM-DD"}
+            slots = slots[bisect_left(slots, day):bisect_left(slots, day + timedelta(days=1))]
+        return {
+            'unit': vacancy['unit'],
+            'slots': [{'start': s.isoformat(), 'spoken': spoken_slot(s)} for s in slots]
+        }
+
+    def search_units(self, query, max_results=5):
+        """Rank vacant units and related amenities for a free-text request."""
+        units = [
+            {**self._unit_summary(self.vacancies_by_unit[doc['id']]), 'score': round(score, 3)}
+            for doc, score in self.search_index.search(query, max_results, kind='unit', min_score=MIN_UNIT_SCORE)
+            if doc['id'] in self.vacancies_by_unit
+        ]
+        amenities = [
+            f"{doc['id']} (select units)" if doc['id'].lower() in self.select_unit_amenities else doc['id']
+            for doc, _ in self.search_index.search(query, 3, kind='amenity', min_score=MIN_AMENITY_SCORE)
+        ]
+        return {'units': units, 'matching_amenities': amenities}
+
+    def amenities(self):
+        return {
+            'property': self.name,
+            'amenities': [a for a in self.amenity_list if not a.endswith('*')],
+            'in_select_units': list(self.select_unit_amenities.values())
+        }
+
+    def floorplans(self, type=None):
+        """Floor plan summaries, optionally only one type (e.g. 2BHK)."""
+        wanted = type.upper().replace(' ', '') if type else None
+        plans = []
+        for plan_class, plan in self.floorplans_by_class.items():
+            rooms = plan.get('rooms', [])
+            if wanted and not any(r.get('type', '').upper() == wanted for r in rooms):
+                continue
+            plans.append({
+                'class': plan_class,
+                'size': plan.get('range'),
+                'rooms': [
+                    {'type': r.get('type'), 'price': r.get('price'), 'level': r.get('level'),
+                     'occupancy': r.get('occupancy')}
+                    for r in rooms
+                ]
+            })
+        return {'floorplans': plans}
+
+    def call(self, name, arguments):
+        """Dispatch a realtime function call. `arguments` is the raw JSON string."""
+        handler = TOOL_HANDLERS.get(name)
+        if handler is None:
+            return {'error': f"Unknown tool {name}"}
+        try:
+            kwargs = json.loads(arguments) if arguments else {}
+        except json.JSONDecodeError:
+            return {'error': 'Arguments were not valid JSON'}
+        try:
+            return handler(self, **kwargs)
+        except Exception as e:
+            # Valid JSON of the wrong shape or types ({"unit": 101}) goes back to the model, not up the call
+            return {'error': f"Bad arguments for {name}: {e!r}"}
+
+
+TOOL_HANDLERS = {
+    'find_units': KnowledgeEngine.find_units,
+    'unit_details': KnowledgeEngine.unit_details,
+    'slots': KnowledgeEngine.slots,
+    'search_units': KnowledgeEngine.search_units,
+    'amenities': KnowledgeEngine.amenities,
+    'floorplans': KnowledgeEngine.floorplans,
+}
+
+TOOLS = [
+    {
+        "type": "function",
+        "name": "find_units",
+        "description": "List vacant units, cheapest first. Use for availability and price questions.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "max_price": {"type": "number", "description": "Maximum monthly rent in dollars"},
+                "min_price": {"type": "number", "description": "Minimum monthly rent in dollars"},
+                "type": {"type": "string", "description": "Unit type, e.g. 1BHK or 2BHK"},
+                "feature": {"type": "string", "description": "Required feature or amenity, e.g. Dishwasher"}
+            }
+        }
+    },
+    {
+        "type": "function",
+        "name": "unit_details",
+        "description": "Details of one vacant unit: type, class, price, size, features and next tour slots.",
+        "parameters": {
+            "type": "object",
+            "properties": {"unit": {"type": "string", "description": "Unit number, e.g. A101"}},
+            "required": ["unit"]
+        }
+    },
+    {
+        "type": "function",
+        "name": "slots",
+        "description": "Tour appointment slots for a unit, optionally on a single date.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "unit": {"type": "string", "description": "Unit number, e.g. A101"},
+                "date": {"type": "string", "description": "Date as YYYY-MM-DD"}
+            },
+            "required": ["unit"]
+        }
+    },
+    {
+        "type": "function",
+        "name": "search_units",
+        "description": "Free-text search for vacant units matching what the caller described, "
+                       "e.g. 'somewhere with a yard for my dog under 1300'. Best match first.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "The caller's request in their own words"},
+                "max_results": {"type": "integer", "description": "How many units to return (default 5)"}
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "type": "function",
+        "name": "amenities",
+        "description": "Community amenities of the property, and those only in select units.",
+        "parameters": {"type": "object", "properties": {}}
+    },
+    {
+        "type": "function",
+        "name": "floorplans",
+        "description": "Floor plans with size, prices per level and occupancy.",
+        "parameters": {
+            "type": "object",
+            "properties": {"type": {"type": "string", "description": "Unit type, e.g. 1BHK or 2BHK"}}
+        }
+    },
+]
@@ -0,0 +1,243 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field
+
+from knowledge_engine import KnowledgeEngine
+
+logger = logging.getLogger(__name__)
+
+
+def property_key(prop):
+    """Stable id of a property: its `id`, else its name as a slug."""
+    return str(prop.get('id') or re.sub(r'[^a-z0-9]+', '-', prop['name'].lower()).strip('-'))
+
+
+def normalize_number(number):
+    """Digits only, so '+1 (254) 555-0100' from the file matches Twilio's '+12545550100'."""
+    return re.sub(r'\D', '', number or '')
+
+
+def entry_digest(prop):
+    return hashlib.sha1(json.dumps(prop, sort_keys=True).encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class PropertyConfig:
+    """One property compiled for calls; rebuilt only when its knowledge base entry changes."""
+    key: str
+    digest: str
+    data: dict
+    engine: KnowledgeEngine
+    session_update: str  # Pre-serialized session.update event
+
+
+@dataclass(frozen=True)
+class KnowledgeSnapshot:
+    """One immutable, fully derived version of knowledge_base.json."""
+    version: int
+    knowledge_base: dict
+    properties: dict  # key -> PropertyConfig, in file order
+    numbers: dict  # normalized dialed number -> property key
+    default: PropertyConfig  # First property; takes calls to numbers no property lists
+    signature: tuple
+    load_ms: float
+    rebuilt: int = 0  # Properties compiled for this version; the rest were carried over
+    loaded_at: float = field(default_factory=time.time)
+
+    def route(self, number):
+        """The property serving calls to a dialed number."""
+        key = self.numbers.get(normalize_number(number))
+        return self.default if key is None else self.properties[key]
+
+
+def validate_knowledge_base(data):
+    """Raise ValueError if the knowledge base is not usable."""
+    properties = data.get('properties') if isinstance(data, dict) else None
+    if not isinstance(properties, list) or not properties:
+        raise ValueError("knowledge base needs a non-empty 'properties' list")
+    keys = set()
+    numbers = set()
+    for index, prop in enumerate(properties):
+        if not isinstance(prop, dict):
+            raise ValueError(f"property {index} must be an object")
+        if not prop.get('name') or not isinstance(prop['name'], str):
+            raise ValueError(f"property {index} has no name")
+        for name in ('vacancies', 'floorplans', 'amenities'):
+            if not isinstance(prop.get(name, []), list):
+                raise ValueError(f"{name} of {prop['name']} must be a list")
+        if not all(isinstance(a, str) for a in prop.get('amenities', [])):
+            raise ValueError(f"amenities of {prop['name']} must be strings")
+        if not all(isinstance(p, dict) and isinstance(p.get('class'), str)
+                   and isinstance(p.get('rooms', []), list) and all(isinstance(r, dict) for r in p.get('rooms', []))
+                   for p in prop.get('floorplans', [])):
+            raise ValueError(f"floorplans of {prop['name']} must be objects with a class and a list of rooms")
+        key = property_key(prop)
+        if key in keys:
+            raise ValueError(f"two properties have the id {key!r}; give one an 'id'")
+        keys.add(key)
+        phone_numbers = prop.get('phone_numbers', [])
+        if not isinstance(phone_numbers, list) or not all(isinstance(n, str) for n in phone_numbers):
+            raise ValueError(f"phone_numbers of {prop['name']} must be a list of strings")
+        for number in phone_numbers:
+            if normalize_number(number) in numbers:
+                raise ValueError(f"{number} is listed by more than one property")
+            numbers.add(normalize_number(number))
+        for vacancy in prop.get('vacancies', []):
+            if not isinstance(vacancy, dict):
+                raise ValueError(f"vacancies of {prop['name']} must be objects")
+            missing = [key for key in ('unit', 'class', 'type', 'price') if key not in vacancy]
+            if missing:
+                raise ValueError(f"vacancy in {prop['name']} is missing {', '.join(missing)}")
+            wrong = [key for key in ('unit', 'class', 'type', 'price') if not isinstance(vacancy[key], str)]
+            slots = vacancy.get('appointment_slots', [])
+            if not isinstance(slots, list) or not all(isinstance(slot, str) for slot in slots):
+                wrong.append('appointment_slots')
+            if wrong:
+                raise ValueError(f"vacancy in {prop['name']} has the wrong type for {', '.join(wrong)}")
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def compile_property(prop, build_session_update, search_cache=None, digest=None):
+    key = property_key(prop)
+    try:
+        engine = KnowledgeEngine(prop, f"{search_cache}-{key}" if search_cache else None)
+    except Exception as e:
+        raise ValueError(f"could not compile {prop['name']}: {e!r}") from e
+    return PropertyConfig(key, digest or entry_digest(prop), prop, engine, json.dumps(build_session_update(engine)))
+
+
+def load_snapshot(path, build_session_update, version=1, search_cache=None, previous=None):
+    """Read, validate and compile the knowledge base. Blocking; run off the event loop.
+
+    Properties whose entry is unchanged since `previous` keep their compiled
+    config (and its identity), so a reload only compiles what changed.
+    """
+    started = time.perf_counter()
+    signature = file_signature(path)
+    with open(path, 'r') as file:
+        data = json.load(file)
+    validate_knowledge_base(data)
+    properties = {}
+    rebuilt = 0
+    for prop in data['properties']:
+        key = property_key(prop)
+        digest = entry_digest(prop)
+        config = previous.properties.get(key) if previous else None
+        if config is None or config.digest != digest:
+            config = compile_property(prop, build_session_update, search_cache, digest)
+            rebuilt += 1
+        properties[key] = config
+    numbers = {normalize_number(number): key for key, config in properties.items()
+               for number in config.data.get('phone_numbers', [])}
+    return KnowledgeSnapshot(
+        version=version,
+        knowledge_base=data,
+        properties=properties,
+        numbers=numbers,
+        default=next(iter(properties.values())),
+        signature=signature,
+        load_ms=(time.perf_counter() - started) * 1000,
+        rebuilt=rebuilt
+    )
+
+
+class KnowledgeBaseWatcher:
+    """Poll knowledge_base.json and atomically swap in a new snapshot when it changes.
+
+    Parsing and compiling happen in a worker thread. `snapshot` is replaced by
+    a single reference assignment, so readers always see either the old or the
+    new version in full. A file that fails validation is reported and the
+    current snapshot stays in place. Subscribers (active calls) are awaited
+    with each new snapshot.
+    """
+
+    def __init__(self, path, build_session_update, interval=2.0, search_cache=None):
+        self.path = path
+        self.build_session_update = build_session_update
+        self.interval = interval
+        self.search_cache = search_cache
+        self.snapshot = load_snapshot(path, build_session_update, search_cache=search_cache)
+        self.subscribers = set()
+        self.last_error = None
+        self.last_visibility_ms = None
+        self._rejected_signature = None
+        self._task = None
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Knowledge base watcher error: {e!r}")
+
+    async def check(self):
+        """Reload if the file changed since the current snapshot. Returns True on swap."""
+        try:
+            signature = file_signature(self.path)
+        except FileNotFoundError:
+            return False
+        if signature in (self.snapshot.signature, self._rejected_signature):
+            return False
+
+        try:
+            snapshot = await asyncio.to_thread(
+                load_snapshot, self.path, self.build_session_update, self.snapshot.version + 1, self.search_cache,
+                self.snapshot
+            )
+        except Exception as e:
+            # Any failure to read, validate or compile rejects this version of the file; keep
+            # serving the last good one and do not retry it until the file changes again
+            self.last_error = str(e)
+            self._rejected_signature = signature
+            logger.error(f"❌ Rejected knowledge base change: {e}")
+            return False
+
+        self.snapshot = snapshot
+        self.last_error = None
+        # From file write (mtime) to the new version being served
+        self.last_visibility_ms = (time.time() - snapshot.signature[0] / 1e9) * 1000
+        logger.info(f"📚 Knowledge base v{snapshot.version} live: loaded in {snapshot.load_ms:.1f} ms "
+                    f"({snapshot.rebuilt} of {len(snapshot.properties)} properties rebuilt), "
+                    f"visible {self.last_visibility_ms:.0f} ms after write")
+
+        for subscriber in list(self.subscribers):
+            try:
+                await subscriber(snapshot)
+            except Exception as e:
+                logger.error(f"Error pushing knowledge base update to a call: {e!r}")
+        return True
+
+    def status(self):
+        return {
+            'version': self.snapshot.version,
+            'loaded_at': self.snapshot.loaded_at,
+            'load_ms': round(self.snapshot.load_ms, 3),
+            'properties': len(self.snapshot.properties),
+            'routed_numbers': len(self.snapshot.numbers),
+            'last_visibility_ms': None if self.last_visibility_ms is None else round(self.last_visibility_ms, 1),
+            'subscribers': len(self.subscribers),
+            'last_error': self.last_error
+        }
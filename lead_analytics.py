@@ -0,0 +1,288 @@
+"""Lead and conversation analytics, updated as each conversation is finalized.
+
+    python lead_analytics.py [--db analytics.db] [--store sqlite] [--bookings bookings.log]
+
+Counters live in SQLite, one row per (hour, metric), so they survive
+restarts and are shared by several app workers: calls, leads, appointment
+requests, booked tours, customer and AI messages, calls per interest, and a
+histogram of lead scores in bins of 10. Only the last `hours` hourly buckets
+are kept, next to all-time totals, so reading them costs the same however
+much history there is. Each conversation is counted once, by its
+TranscriptionSid, in the hour it started; the SIDs are kept for the same
+window, and a conversation that started before it is left to a rebuild, since
+it could no longer be told apart from one already counted. Run this module
+to rebuild the counters from the stored transcripts.
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import asyncio
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from booking import BookingEngine
+from lead_extractor import calculate_lead_score, extract_lead_info, has_enough_for_lead
+from transcript_store import open_transcript_store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analytics_counters (
+    hour INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (hour, metric)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS analytics_conversations (
+    transcription_sid TEXT PRIMARY KEY,
+    hour INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS analytics_conversations_hour ON analytics_conversations (hour);
+"""
+
+TOTAL = -1  # `hour` of the all-time counters
+SCORE_BIN = 10
+HOURLY_METRICS = ('calls', 'leads', 'appointments')
+
+
+def epoch_hour(timestamp):
+    return int(timestamp // 3600)
+
+
+def started_at(conversation, default):
+    """Epoch seconds of a conversation's first message, or `default` if it has no usable timestamp."""
+    messages = conversation.get('all_messages')
+    try:
+        # Twilio timestamps end in Z, which fromisoformat only accepts from Python 3.11
+        return datetime.fromisoformat(messages[0]['timestamp'].replace('Z', '+00:00')).timestamp()
+    except (IndexError, KeyError, TypeError, AttributeError, ValueError):
+        return default
+
+
+def conversation_counters(conversation, lead_info):
+    """metric -> increment for one finalized conversation. `lead_info` is None if the caller never spoke."""
+    counters = {
+        'calls': 1,
+        'customer_messages': len(conversation.get('customer_messages', [])),
+        'ai_messages': len(conversation.get('ai_messages', []))
+    }
+    if lead_info is None:
+        return counters
+    if has_enough_for_lead(lead_info, conversation):
+        counters['leads'] = 1
+    if lead_info.get('appointment_requested'):
+        counters['appointments'] = 1
+    if lead_info.get('bookings'):
+        counters['tours_booked'] = 1
+    for interest in lead_info.get('interests', []):
+        counters[f'interest:{interest}'] = 1
+    score = calculate_lead_score(lead_info)
+    counters[f'score:{score // SCORE_BIN * SCORE_BIN}'] = 1
+    return counters
+
+
+def summarize(counters):
+    """Shape flat metric -> value counters for the /analytics response."""
+    calls = counters.get('calls', 0)
+    summary = {
+        'calls': calls,
+        'leads': counters.get('leads', 0),
+        'appointments_requested': counters.get('appointments', 0),
+        'appointment_rate': round(counters.get('appointments', 0) / calls, 4) if calls else None,
+        'tours_booked': counters.get('tours_booked', 0),
+        'customer_messages': counters.get('customer_messages', 0),
+        'ai_messages': counters.get('ai_messages', 0),
+        'interests': {},
+        'lead_scores': {}
+    }
+    for metric, value in counters.items():
+        kind, _, key = metric.partition(':')
+        if kind == 'interest':
+            summary['interests'][key] = value
+        elif kind == 'score':
+            summary['lead_scores'][key] = value
+    summary['lead_scores'] = dict(sorted(summary['lead_scores'].items(), key=lambda item: int(item[0])))
+    return summary
+
+
+class LeadAnalytics:
+    """Hourly and all-time counters over finalized conversations, in a SQLite database."""
+
+    def __init__(self, path, hours=168):
+        self.path = path
+        self.hours = hours
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._pruned_hour = None
+
+    def _connection(self):
+        # Opened lazily so importing the app does not create the database file
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _add(self, conn, hour, counters, current_hour):
+        rows = [(TOTAL, metric, value) for metric, value in counters.items() if value]
+        if hour > current_hour - self.hours:
+            rows += [(hour, metric, value) for metric, value in counters.items() if value]
+        conn.executemany(
+            "INSERT INTO analytics_counters (hour, metric, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (hour, metric) DO UPDATE SET value = value + excluded.value",
+            rows
+        )
+
+    def _prune(self, conn, current_hour):
+        # Buckets only fall out of the window when the hour changes
+        if current_hour == self._pruned_hour:
+            return
+        self._pruned_hour = current_hour
+        conn.execute("DELETE FROM analytics_counters WHERE hour != ? AND hour <= ?",
+                     (TOTAL, current_hour - self.hours))
+        conn.execute("DELETE FROM analytics_conversations WHERE hour <= ?", (current_hour - self.hours,))
+
+    def add(self, sid, conversation, lead_info):
+        """Count one finalized conversation, unless this SID was already counted. Blocking."""
+        now = time.time()
+        hour = epoch_hour(started_at(conversation, now))
+        if hour <= epoch_hour(now) - self.hours:
+            # Its SID may already have been pruned, so counting it could count it twice
+            return False
+        counters = conversation_counters(conversation, lead_info)
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO analytics_conversations (transcription_sid, hour) VALUES (?, ?)",
+                    (sid, hour)
+                )
+                if cursor.rowcount == 1:
+                    self._add(conn, hour, counters, epoch_hour(now))
+                    self._prune(conn, epoch_hour(now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return cursor.rowcount == 1
+
+    async def record(self, sid, conversation, lead_info):
+        return await asyncio.to_thread(self.add, sid, conversation, lead_info)
+
+    def rebuild(self, conversations):
+        """Replace every counter with counts over `conversations`, (sid, conversation, lead_info) triples.
+
+        One transaction, so readers and live updates see the old counters
+        until the new ones are complete. Returns the number of conversations.
+        """
+        now = time.time()
+        current_hour = epoch_hour(now)
+        hourly = defaultdict(lambda: defaultdict(int))
+        seen = {}
+        for sid, conversation, lead_info in conversations:
+            if sid in seen:
+                continue
+            seen[sid] = hour = epoch_hour(started_at(conversation, now))
+            for metric, value in conversation_counters(conversation, lead_info).items():
+                hourly[hour][metric] += value
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM analytics_counters")
+                conn.execute("DELETE FROM analytics_conversations")
+                conn.executemany("INSERT INTO analytics_conversations (transcription_sid, hour) VALUES (?, ?)",
+                                 [(sid, hour) for sid, hour in seen.items() if hour > current_hour - self.hours])
+                for hour, counters in hourly.items():
+                    self._add(conn, hour, counters, current_hour)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return len(seen)
+
+    def summary(self):
+        """All-time and last-24-hour totals, and calls, leads and appointments per hour. Blocking."""
+        now_hour = epoch_hour(time.time())
+        with self._db_lock:
+            rows = self._connection().execute(
+                "SELECT hour, metric, value FROM analytics_counters WHERE hour = ? OR hour > ?",
+                (TOTAL, now_hour - self.hours)
+            ).fetchall()
+        total = {}
+        last_24h = defaultdict(int)
+        hourly = defaultdict(dict)
+        for hour, metric, value in rows:
+            if hour == TOTAL:
+                total[metric] = value
+                continue
+            if hour > now_hour - 24:
+                last_24h[metric] += value
+            if metric in HOURLY_METRICS:
+                hourly[hour][metric] = value
+        return {
+            'window_hours': self.hours,
+            'total': summarize(total),
+            'last_24h': summarize(last_24h),
+            'hourly': [
+                {'hour': datetime.fromtimestamp(hour * 3600).isoformat(),
+                 **{metric: counts.get(metric, 0) for metric in HOURLY_METRICS}}
+                for hour, counts in sorted(hourly.items())
+            ]
+        }
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def stored_conversations(store, bookings):
+    """(sid, conversation, lead_info) for every conversation in a transcript store that has ended."""
+    by_call = bookings.bookings_by_call()
+    # Calls still in progress are counted live once they are finalized
+    for sid, conversation in store.ended_conversations().items():
+        lead_info = None
+        if conversation.get('customer_messages'):
+            # As process_conversation builds it
+            lead_info = extract_lead_info(conversation)
+            lead_info['bookings'] = by_call.get(conversation.get('call_sid'), [])
+            if lead_info['bookings']:
+                lead_info['appointment_requested'] = True
+        yield sid, conversation, lead_info
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Rebuild the lead analytics counters from the stored transcripts.")
+    parser.add_argument('--db', default=os.getenv('ANALYTICS_DB', 'analytics.db'))
+    parser.add_argument('--hours', type=int, default=int(os.getenv('ANALYTICS_HOURS', 168)))
+    parser.add_argument('--store', default=os.getenv('TRANSCRIPT_STORE', 'sqlite'), help="sqlite or jsonl")
+    parser.add_argument('--transcript-db', default=os.getenv('TRANSCRIPT_DB', 'transcripts.db'))
+    parser.add_argument('--transcription-file', default=os.getenv('TRANSCRIPTION_FILE', 'transcription.json'))
+    parser.add_argument('--state-file', default=os.getenv('TRANSCRIPTION_STATE_FILE', 'transcription_state.json'))
+    parser.add_argument('--bookings', default=os.getenv('BOOKINGS_LOG', 'bookings.log'))
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    store = open_transcript_store(args.store, db_path=args.transcript_db, file_path=args.transcription_file,
+                                  state_path=args.state_file)
+    analytics = LeadAnalytics(args.db, args.hours)
+    try:
+        counted = analytics.rebuild(stored_conversations(store, BookingEngine(args.bookings)))
+    finally:
+        store.close()
+        analytics.close()
+    print(f"✅ Rebuilt {args.db} from {counted} conversations in {time.perf_counter() - started:.2f} s",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
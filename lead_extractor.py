@@ -0,0 +1,253 @@
+"""Compiled, incremental lead extraction from call transcripts.
+
+All patterns are compiled once at import. Interest and appointment keywords
+share a single regex, scanned once per message over lowercased text, so a
+lead can be updated utterance by utterance while the call is in progress
+and is ready at hangup.
+"""
+import re
+from datetime import datetime
+
+from transcripts import parse_transcription_message
+
+EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', re.IGNORECASE)
+PHONE_RE = re.compile(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b|\b\(\d{3}\)\s?\d{3}[-.]?\d{4}\b')
+NAME_RES = [
+    re.compile(r'(?:my name is|i\'m|i am|this is|call me)\s+([a-zA-Z\s]+?)(?:\s|$|[.,!?])', re.IGNORECASE),
+    re.compile(r'(?:name)\s*[:=]\s*([a-zA-Z\s]+?)(?:\s|$|[.,!?])', re.IGNORECASE),
+    re.compile(r'(?:i\'m|i am)\s+([a-zA-Z\s]+?)(?:\s|$|[.,!?])', re.IGNORECASE)
+]
+NOT_NAMES = {'Hello', 'Hi', 'Thanks'}
+
+INTEREST_KEYWORDS = {
+    '1BHK': ['1bhk', 'one bedroom', '1 bedroom'],
+    '2BHK': ['2bhk', 'two bedroom', '2 bedroom'],
+    'Swimming Pool': ['pool', 'swimming'],
+    'Fitness Center': ['gym', 'fitness'],
+    'Pet Friendly': ['pet', 'dog', 'cat'],
+    'Ground Floor': ['ground floor', 'first floor']
+}
+APPOINTMENT = 'appointment'
+APPOINTMENT_KEYWORDS = ['tour', 'visit', 'appointment', 'schedule', 'book', 'see the place']
+
+# keyword -> interest name, or APPOINTMENT
+KEYWORD_TARGETS = {keyword: interest for interest, keywords in INTEREST_KEYWORDS.items() for keyword in keywords}
+KEYWORD_TARGETS.update((keyword, APPOINTMENT) for keyword in APPOINTMENT_KEYWORDS)
+ALL_TARGETS = frozenset(KEYWORD_TARGETS.values())
+INTEREST_ORDER = {interest: i for i, interest in enumerate(INTEREST_KEYWORDS)}
+KEYWORD_RE = re.compile('|'.join(re.escape(k) for k in sorted(KEYWORD_TARGETS, key=len, reverse=True)))
+KEYWORD_TAIL = max(len(k) for k in KEYWORD_TARGETS) - 1
+CONTACT_TAIL = 32  # Enough of the previous customer message for 'my name is' or '(555)' to carry over
+
+SUMMARY_CHARS = 500
+
+
+def match_keywords(lowered, targets):
+    """Add the target of every keyword occurring in `lowered` to `targets`."""
+    search = KEYWORD_RE.search
+    match = search(lowered)
+    while match is not None:
+        targets.add(KEYWORD_TARGETS[match.group()])
+        if len(targets) == len(ALL_TARGETS):
+            return
+        # Restart one character in, so overlapping keywords are found like substring checks would
+        match = search(lowered, match.start() + 1)
+
+
+class LeadState:
+    """Lead fields for one conversation, updated one message at a time.
+
+    Only what the final lead needs is kept: the first email, phone and name
+    match per pattern, matched keyword targets, the summary prefix, message
+    counts and the tail of the previous message, so matches that span two
+    messages are found exactly as in a scan of the joined conversation.
+    """
+
+    __slots__ = ('email', 'phone', 'name_candidates', 'targets', 'summary', 'message_count',
+                 'customer_count', '_tail', '_customer_tail')
+
+    def __init__(self):
+        self.email = None
+        self.phone = None
+        self.name_candidates = [None] * len(NAME_RES)
+        self.targets = set()
+        self.summary = ''
+        self.message_count = 0
+        self.customer_count = 0
+        self._tail = ''
+        self._customer_tail = ''
+
+    def add_message(self, text, customer=False):
+        """Fold one message into the lead. Customer messages also feed contact details."""
+        self.message_count += 1
+        if len(self.targets) < len(ALL_TARGETS):
+            window = f"{self._tail} {text.lower()}" if self.message_count > 1 else text.lower()
+            match_keywords(window, self.targets)
+            self._tail = window[-KEYWORD_TAIL:]
+        if customer:
+            self.add_customer_text(text)
+
+    def add_customer_text(self, text):
+        self.customer_count += 1
+        if len(self.summary) < SUMMARY_CHARS:
+            joined = f"{self.summary} {text}" if self.customer_count > 1 else text
+            self.summary = joined[:SUMMARY_CHARS]
+        window = f"{self._customer_tail} {text}" if self.customer_count > 1 else text
+        self._scan_contact(window)
+        self._customer_tail = window[-CONTACT_TAIL:]
+
+    def _scan_contact(self, text):
+        if self.email is None:
+            match = EMAIL_RE.search(text)
+            if match:
+                self.email = match.group()
+        if self.phone is None:
+            match = PHONE_RE.search(text)
+            if match:
+                self.phone = match.group()
+        for i, pattern in enumerate(NAME_RES):
+            if self.name_candidates[i] is None:
+                match = pattern.search(text)
+                if match:
+                    self.name_candidates[i] = match.group(1).strip().title()
+
+    @property
+    def name(self):
+        # Patterns are tried in order; each one only gets its first match, valid or not
+        for candidate in self.name_candidates:
+            if candidate is not None and len(candidate) > 1 and candidate not in NOT_NAMES:
+                return candidate
+        return None
+
+    def lead_info(self):
+        return {
+            'name': self.name,
+            'email': self.email,
+            'phone': self.phone,
+            'interests': sorted((t for t in self.targets if t != APPOINTMENT), key=INTEREST_ORDER.get),
+            'appointment_requested': APPOINTMENT in self.targets,
+            'conversation_summary': self.summary,
+            'message_count': self.message_count,
+            'source': 'voice_call'
+        }
+
+
+def lead_state_for(conversation_data):
+    """Build a LeadState from a complete conversation record in one pass per text."""
+    all_messages = conversation_data.get('all_messages', [])
+    customer_messages = conversation_data.get('customer_messages', [])
+    state = LeadState()
+    match_keywords(' '.join(msg['text'] for msg in all_messages).lower(), state.targets)
+    customer_text = ' '.join(msg['text'] for msg in customer_messages)
+    state.summary = customer_text[:SUMMARY_CHARS]
+    state._scan_contact(customer_text)
+    state.message_count = len(all_messages)
+    state.customer_count = len(customer_messages)
+    return state
+
+
+def extract_lead_info(conversation_data):
+    """Extract lead information from conversation transcripts."""
+    return lead_state_for(conversation_data).lead_info()
+
+
+def has_enough_for_lead(lead_info, conversation_data):
+    """Whether a conversation carries enough to be worth sending to Rails as a lead."""
+    return bool(lead_info.get('email') or lead_info.get('phone') or
+                lead_info.get('appointment_requested') or lead_info.get('interests') or
+                len(conversation_data.get('customer_messages', [])) >= 2)  # Or if enough conversation
+
+
+def calculate_lead_score(lead_info):
+    """Calculate lead score based on available information."""
+    score = 0
+    
+    # Contact information
+    if lead_info.get('email'): score += 30
+    if lead_info.get('phone'): score += 25
+    if lead_info.get('name'): score += 15
+    
+    # Engagement indicators
+    if lead_info.get('appointment_requested'): score += 20
+    if lead_info.get('interests'): score += 10
+    if lead_info.get('message_count', 0) >= 5: score += 10
+    
+    return min(score, 100)  # Cap at 100
+
+
+def build_lead_payload(lead_info, transcription_sid, created_at=None):
+    """Build the Rails /leads payload for an extracted lead. `created_at` defaults to now."""
+    return {
+        'lead': {
+            'email': lead_info.get('email'),
+            'payload': {
+                'source': 'voice_call_ai',
+                'transcription_sid': transcription_sid,
+                'contact_info': {
+                    'name': lead_info.get('name'),
+                    'phone': lead_info.get('phone'),
+                    'email': lead_info.get('email')
+                },
+                'interests': lead_info.get('interests', []),
+                'appointments': {
+                    'requested': lead_info.get('appointment_requested', False),
+                    'status': 'confirmed' if lead_info.get('bookings') else 'requested' if lead_info.get('appointment_requested') else 'none',
+                    'bookings': lead_info.get('bookings', [])
+                },
+                'conversation_summary': {
+                    'total_messages': lead_info.get('message_count', 0),
+                    'summary': lead_info.get('conversation_summary', ''),
+                    'source': 'voice_ai_assistant'
+                },
+                'lead_score': calculate_lead_score(lead_info),
+                'created_at': created_at or datetime.now().isoformat()
+            }
+        }
+    }
+
+
+class LeadTracker:
+    """Per-TranscriptionSid lead state fed from transcription records as they are written.
+
+    At most `max_states` calls are tracked; the oldest is dropped first. With
+    several workers a call can end on a worker other than the one tracking
+    it, and a dropped state is simply rebuilt from the stored conversation.
+    """
+
+    def __init__(self, max_states=10000):
+        self.max_states = max_states
+        self.states = {}
+
+    def observe(self, record):
+        if not isinstance(record, dict):
+            return
+        sid = record.get('TranscriptionSid')
+        try:
+            parsed = parse_transcription_message(record)
+        except ValueError:
+            return
+        if not sid or parsed is None:
+            return
+        message, status = parsed
+        state = self.states.get(sid)
+        if state is None:
+            if len(self.states) >= self.max_states:
+                del self.states[next(iter(self.states))]
+            state = self.states[sid] = LeadState()
+        state.add_message(message['text'], status == 'inbound_track')
+
+    def lead_info(self, sid, conversation_data):
+        """The tracked lead for `sid`, rebuilt from the conversation if tracking missed messages.
+
+        Tracking misses messages after a restart mid-call, so the counts are
+        checked against the conversation before the live state is trusted.
+        """
+        state = self.states.get(sid)
+        if (state is None
+                or state.message_count != len(conversation_data.get('all_messages', []))
+                or state.customer_count != len(conversation_data.get('customer_messages', []))):
+            return extract_lead_info(conversation_data)
+        return state.lead_info()
+
+    def discard(self, sid):
+        self.states.pop(sid, None)
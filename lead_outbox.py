@@ -0,0 +1,219 @@
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lead_outbox (
+    transcription_sid TEXT PRIMARY KEY,
+    idempotency_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    delivered_at REAL
+);
+CREATE INDEX IF NOT EXISTS lead_outbox_due ON lead_outbox (status, next_attempt_at);
+"""
+
+
+def idempotency_key_for(transcription_sid):
+    """Stable key Rails can use to drop repeated deliveries of the same lead."""
+    return f"voice-lead-{transcription_sid}"
+
+
+class LeadOutbox:
+    """Durable SQLite outbox for leads, keyed by transcription_sid.
+
+    enqueue() only records the lead locally, so the webhook path never waits on
+    Rails. A background worker delivers due rows concurrently through `send`
+    and reschedules failures with capped exponential backoff and full jitter.
+    A SID can only ever be enqueued once. Due rows are leased for
+    `lease_seconds` inside a write transaction, so several app workers can
+    share the database without delivering the same lead concurrently.
+    """
+
+    def __init__(self, path, send, batch_size=50, base_delay=1.0, max_delay=300.0, max_attempts=20,
+                 lease_seconds=120.0):
+        self.path = path
+        self.send = send
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _connection(self):
+        # Opened lazily so importing the app does not create the database file
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        with self._db_lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def _insert(self, transcription_sid, payload):
+        now = time.time()
+        with self._db_lock:
+            cursor = self._connection().execute(
+                "INSERT OR IGNORE INTO lead_outbox "
+                "(transcription_sid, idempotency_key, payload, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (transcription_sid, idempotency_key_for(transcription_sid),
+                 json.dumps(payload, separators=(',', ':')), now, now)
+            )
+            return cursor.rowcount == 1
+
+    def insert_many(self, leads):
+        """Store (transcription_sid, payload) pairs in one transaction, for offline tools. Blocking.
+
+        Returns how many were new; a running app's worker delivers them.
+        """
+        now = time.time()
+        with self._db_lock:
+            conn = self._connection()
+            before = conn.total_changes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO lead_outbox "
+                    "(transcription_sid, idempotency_key, payload, next_attempt_at, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(sid, idempotency_key_for(sid), json.dumps(payload, separators=(',', ':')), now, now)
+                     for sid, payload in leads]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return conn.total_changes - before
+
+    async def enqueue(self, transcription_sid, payload):
+        """Store a lead for delivery. Returns False if this SID was already queued."""
+        added = await asyncio.to_thread(self._insert, transcription_sid, payload)
+        if added:
+            self._wakeup.set()
+        return added
+
+    def _due(self):
+        """Lease the rows that are due. A lease that outlives a crashed worker simply expires."""
+        now = time.time()
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT transcription_sid, idempotency_key, payload, attempts FROM lead_outbox "
+                    "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                    (now, self.batch_size)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE lead_outbox SET next_attempt_at = ? WHERE transcription_sid = ?",
+                    [(now + self.lease_seconds, row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _seconds_until_next(self):
+        rows = self._execute(
+            "SELECT MIN(next_attempt_at) FROM lead_outbox WHERE status = 'pending'"
+        )
+        next_at = rows[0][0]
+        return None if next_at is None else max(0.0, next_at - time.time())
+
+    def _backoff(self, attempts):
+        # Full jitter: uniform in [0, min(cap, base * 2^attempts)]
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempts)))
+
+    def _mark_delivered(self, transcription_sid):
+        self._execute(
+            "UPDATE lead_outbox SET status = 'delivered', delivered_at = ?, last_error = NULL "
+            "WHERE transcription_sid = ?",
+            (time.time(), transcription_sid)
+        )
+
+    def _mark_failed(self, transcription_sid, attempts, error):
+        status = 'dead' if self.max_attempts and attempts >= self.max_attempts else 'pending'
+        self._execute(
+            "UPDATE lead_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? "
+            "WHERE transcription_sid = ?",
+            (status, attempts, time.time() + self._backoff(attempts), error, transcription_sid)
+        )
+
+    async def _deliver(self, row):
+        transcription_sid, idempotency_key, payload, attempts = row
+        try:
+            ok = await self.send(json.loads(payload), idempotency_key)
+            error = None if ok else 'rejected'
+        except Exception as e:
+            ok, error = False, repr(e)
+
+        if ok:
+            await asyncio.to_thread(self._mark_delivered, transcription_sid)
+        else:
+            logger.warning(f"⏳ Lead {transcription_sid} not delivered (attempt {attempts + 1}): {error}")
+            await asyncio.to_thread(self._mark_failed, transcription_sid, attempts + 1, error)
+
+    async def _run(self):
+        errors = 0
+        while True:
+            try:
+                await self._step()
+                errors = 0
+            except Exception as e:
+                # e.g. "database is locked"; leased rows simply become due again later
+                errors += 1
+                delay = min(self.max_delay, self.base_delay * (2 ** errors))
+                logger.error(f"❌ Lead outbox worker error, retrying in {delay:.1f} s: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def _step(self):
+        rows = await asyncio.to_thread(self._due)
+        if rows:
+            await asyncio.gather(*(self._deliver(row) for row in rows))
+            return
+
+        self._wakeup.clear()
+        delay = await asyncio.to_thread(self._seconds_until_next)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def counts(self):
+        """Number of leads per delivery status."""
+        return dict(self._execute("SELECT status, COUNT(*) FROM lead_outbox GROUP BY status"))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
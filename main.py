@@ -1,112 +1,139 @@
 import os
 import json
+import time
 import base64
 import asyncio
+import logging
 import websockets
-import re
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
 from fastapi import FastAPI, WebSocket, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.websockets import WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from fastapi.websockets import WebSocketState
 from twilio.twiml.voice_response import VoiceResponse, Connect, Say, Stream, Start, Transcription
 from dotenv import load_dotenv
 from twilio.rest import Client
-
-# Import httpx for HTTP requests
-try:
-    import httpx
-    print("httpx successfully imported")
-except ImportError as e:
-    print(f"Failed to import httpx: {e}")
-
-# Explicitly import python-multipart to ensure it's available
-try:
-    import multipart
-    print("python-multipart successfully imported")
-except ImportError as e:
-    print(f"Failed to import python-multipart: {e}")
+import booking
+from admission import AdmissionController, CONNECT, HOLD
+from audio_clips import ClipCache
+import call_recorder
+from call_recorder import CallRecorder
+from app_logging import Sampler, bind_call, setup_logging, truncate
+from knowledge_engine import TOOLS as KNOWLEDGE_TOOLS
+from knowledge_snapshot import KnowledgeBaseWatcher
+from lead_analytics import LeadAnalytics
+from lead_extractor import LeadTracker, build_lead_payload, has_enough_for_lead
+from lead_outbox import LeadOutbox
+import metrics
+import relay_codec
+from rails_client import RailsClient
+from realtime_sessions import RealtimeSessionPool
+from relay_queue import RelayQueue, pump, run_relay
+from playout import PendingBargeIn, PlayoutTracker
+from vad import LocalVAD
+from transcript_store import open_transcript_store
+from transcripts import TranscriptWriter, is_conversation_end
 
 load_dotenv()
 
-with open("knowledge_base.json", "r") as file:
-    knowledge_base = json.load(file)
 
 # Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 PORT = int(os.getenv('PORT', 5050))
+OPENAI_REALTIME_URL = os.getenv('OPENAI_REALTIME_URL', 'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2025-06-03')
+REALTIME_PREWARM_MAX = int(os.getenv('REALTIME_PREWARM_MAX', 20))  # Sessions opened at /incoming-call awaiting their media stream, 0 disables
+REALTIME_PREWARM_TTL = float(os.getenv('REALTIME_PREWARM_TTL', 30))  # Seconds an unclaimed pre-warmed session is kept
+AUDIO_CLIP_DIR = os.getenv('AUDIO_CLIP_DIR', 'audio_clips')  # Greeting and fallback clips, rendered once per voice and prompt
+CACHED_GREETING = os.getenv('CACHED_GREETING', 'true').lower() in ('1', 'true', 'yes')  # Greet from the clip cache instead of <Say> prompts
 RAILS_SERVER_URL = os.getenv('RAILS_SERVER_URL', 'http://localhost:3000')  # Your Rails server URL
+RAILS_MAX_CONNECTIONS = int(os.getenv('RAILS_MAX_CONNECTIONS', 20))  # Keep-alive pool size
+RAILS_MAX_CONCURRENCY = int(os.getenv('RAILS_MAX_CONCURRENCY', 10))  # Lead posts in flight at once
+RAILS_TIMEOUT = float(os.getenv('RAILS_TIMEOUT', 10.0))
+RAILS_BATCH_WINDOW_MS = int(os.getenv('RAILS_BATCH_WINDOW_MS', 0))  # > 0 gathers leads and posts them in bulk
+RAILS_BATCH_MAX = int(os.getenv('RAILS_BATCH_MAX', 100))
+RAILS_BULK_PATH = os.getenv('RAILS_BULK_PATH', '/leads/bulk')
+LEAD_OUTBOX_PATH = os.getenv('LEAD_OUTBOX_PATH', 'lead_outbox.db')  # Durable queue of leads awaiting delivery
+LEAD_RETRY_BASE_DELAY = float(os.getenv('LEAD_RETRY_BASE_DELAY', 1.0))  # Seconds, doubled per failed attempt
+LEAD_RETRY_MAX_DELAY = float(os.getenv('LEAD_RETRY_MAX_DELAY', 300.0))
+LEAD_MAX_ATTEMPTS = int(os.getenv('LEAD_MAX_ATTEMPTS', 20))  # 0 retries forever
+ANALYTICS_DB = os.getenv('ANALYTICS_DB', 'analytics.db')  # Lead and conversation counters served at /analytics
+ANALYTICS_HOURS = int(os.getenv('ANALYTICS_HOURS', 168))  # Hourly buckets kept next to the all-time totals
+KNOWLEDGE_BASE_FILE = os.getenv('KNOWLEDGE_BASE_FILE', 'knowledge_base.json')
+KB_RELOAD_INTERVAL = float(os.getenv('KB_RELOAD_INTERVAL', 2.0))  # Seconds between change checks, 0 disables hot reload
+SEARCH_INDEX_CACHE = os.getenv('SEARCH_INDEX_CACHE')  # Optional path prefix for a memory-mapped search index cache
+KB_RELOAD_UPDATE_ACTIVE = os.getenv('KB_RELOAD_UPDATE_ACTIVE', 'false').lower() in ('1', 'true', 'yes')  # Push session.update to live calls
+BOOKINGS_LOG = os.getenv('BOOKINGS_LOG', 'bookings.log')  # Append-only log of tour holds and bookings; holds are per process, so one worker
+BOOKING_HOLD_TTL = float(os.getenv('BOOKING_HOLD_TTL', 300))  # Seconds a tour slot stays held before it frees up again
+TRANSCRIPT_STORE = os.getenv('TRANSCRIPT_STORE', 'sqlite')  # sqlite (safe with several workers) or jsonl
+TRANSCRIPT_DB = os.getenv('TRANSCRIPT_DB', 'transcripts.db')
+TRANSCRIPTION_FILE = os.getenv('TRANSCRIPTION_FILE', 'transcription.json')  # jsonl store only
+TRANSCRIPTION_STATE_FILE = os.getenv('TRANSCRIPTION_STATE_FILE', 'transcription_state.json')  # jsonl store only: ingest offset and open calls, plus an append-only <file>.processed log
+TRANSCRIPT_QUEUE_SIZE = int(os.getenv('TRANSCRIPT_QUEUE_SIZE', 1000))  # Webhook records waiting to be written
+TRANSCRIPT_BATCH_SIZE = int(os.getenv('TRANSCRIPT_BATCH_SIZE', 256))  # Max records per write
+TRANSCRIPT_FSYNC = os.getenv('TRANSCRIPT_FSYNC', 'batch')  # batch, interval or none
+TRANSCRIPT_FSYNC_INTERVAL_MS = int(os.getenv('TRANSCRIPT_FSYNC_INTERVAL_MS', 1000))
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.1))  # Seconds between event loop lag probes for /metrics, 0 disables
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text or json (one object per line)
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # Records waiting for the writer thread; more are dropped
+LOG_MAX_CHARS = int(os.getenv('LOG_MAX_CHARS', 500))  # Event payloads in log lines are cut to this
+LOG_EVENT_RATE = float(os.getenv('LOG_EVENT_RATE', 2.0))  # Realtime event logs per second, per event type
+
+setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_MAX_CHARS)
+logger = logging.getLogger(__name__)
+# Shared by all calls, so total event log volume stays flat as calls are added
+event_log_sampler = Sampler(rate=LOG_EVENT_RATE, burst=5)
+
+# Explicitly import python-multipart to ensure it's available
+try:
+    import multipart
+    logger.debug("python-multipart successfully imported")
+except ImportError as e:
+    logger.error(f"Failed to import python-multipart: {e}")
 
-# Lead extraction patterns
-EMAIL_PATTERN = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-PHONE_PATTERN = r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b|\b\(\d{3}\)\s?\d{3}[-.]?\d{4}\b'
-NAME_PATTERNS = [
-    r'(?:my name is|i\'m|i am|this is|call me)\s+([a-zA-Z\s]+?)(?:\s|$|[.,!?])',
-    r'(?:name)\s*[:=]\s*([a-zA-Z\s]+?)(?:\s|$|[.,!?])',
-    r'(?:i\'m|i am)\s+([a-zA-Z\s]+?)(?:\s|$|[.,!?])'
-]
 SYSTEM_MESSAGE = """
-You are a friendly and professional AI voice assistant for STONE Creek Apartment and Homes, located at 2700 Trimmier Rd, Killeen, TX 76542. Your role is to assist potential tenants by providing accurate information about apartment floor plans, vacancies, amenities, and appointment scheduling based solely on the provided JSON knowledge base. You are designed for voice interactions, so your responses should be concise, natural, and suitable for spoken communication. 
-
-**Knowledge Base Summary**:
-- **Property**: STONE Creek Apartment and Homes, 2700 Trimmier Rd, Killeen, TX 76542.
-- **Amenities**: Swimming pool, fitness center, pet-friendly environment, gated community, clubhouse, on-site parking, washer/dryer connections.
-- **Floor Plans**:
-  - **A1**: 1BHK, 575 sqft, $1,095/month, 2 occupants, ground floor, features: walk-in closet, stainless steel appliances, balcony.
-  - **A2**: 1BHK, 597 sqft, $1,130/month, 2 occupants, second floor, features: open kitchen, hardwood floors, large windows.
-  - **B1**: 2BHK, 850 sqft, $1,500/month, 4 occupants, ground floor, features: two bathrooms, private patio, in-unit laundry.
-- **Vacancies**:
-  - Unit A101 (1BHK, A1): $1,100/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit A102 (1BHK, A1): $1,200/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit A201 (1BHK, A2): $1,130/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit A202 (1BHK, A2): $1,220/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit A301 (1BHK, A3): $1,285/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit A401 (1BHK, A4): $1,290/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit B101 (2BHK, B1): $1,335/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit C101 (2BHK, C1): $1,380/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit C201 (2BHK, C2): $1,410/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
-  - Unit C301 (2BHK, C3): $1,490/month, available slots throughout the week from 9:00 AM to 5:00 PM (excluding lunch 12-1 PM).
+You are a friendly and professional AI voice assistant for {property_name}, located at {property_address}. Your role is to assist potential tenants with apartment floor plans, vacancies, amenities, and tour scheduling. You are designed for voice interactions, so your responses should be concise, natural, and suitable for spoken communication.
+
+**Tools**:
+Property facts are not in this prompt. Always look them up with the tools before answering, and never quote a price, unit, feature or slot from memory:
+- `find_units`: vacant units filtered by max/min price, type (1BHK, 2BHK) or feature.
+- `search_units`: vacant units ranked against the caller's own description (e.g. "a yard for my dog under 1300").
+- `unit_details`: type, class, price, size, features and next tour slots of one unit.
+- `slots`: tour slots of a unit, optionally on one date (YYYY-MM-DD).
+- `amenities`: community amenities.
+- `floorplans`: floor plans with sizes, prices per level and occupancy.
+- `hold_tour`, `confirm_tour`, `cancel_tour`: reserve, confirm or release a tour slot.
 
 **Guidelines**:
 1. **Tone and Style**: Use a warm, welcoming, and professional tone, like a helpful leasing agent. Keep responses short (1-2 sentences when possible) for voice clarity.
 2. **Name**: Use the name "Tina" in the conversation.
-3. **Property Name**: Use the name "STONE Creek Apartment and Homes" in the conversation.
-4. **Lead Name**: Collect the name from user and use it in the conversation.
-5. **Lead Phone Number**: Collect the phone number from user.
-2. **Accuracy**: Answer queries using only the provided JSON data. Do not invent or speculate beyond the knowledge base.
-3. **Query Handling**:
-   - **Floor Plans**: For queries about floor plans (e.g., "What 1BHK apartments are available?"), mention the class (A1, A2, B1), type (1BHK, 2BHK), size, price, occupancy, level, and key features (limit to 3 features for brevity).
-   - **Vacancies**: For queries about availability (e.g., "What units are available?"), provide unit number, type, class, price, and appointment slots (formatted as, e.g., "June 25 at 4:00 PM").
-   - **Amenities**: For queries about amenities (e.g., "What amenities do you offer?"), list up to 5 amenities and offer to provide more details if asked.
-   - **Bookings**: For booking requests (e.g., "Book a tour for A101 on June 25"), confirm the unit and slot if available, or prompt for clarification (e.g., "Please specify the unit or date"), and collect the name, email and phone number of the lead. Format dates as "Month Day at Time" (e.g., "June 25 at 4:00 PM").
-   - **Specific Units**: If a unit (e.g., "A101") is mentioned, provide its details (type, class, price, slots) or say it's unavailable if not in the JSON.
-   - **Price Queries**: If asked about units under a price (e.g., "Units under $1,200"), filter vacancies by price and list matches.
-4. **Unclear Queries**: If the query is unclear or not covered by the JSON (e.g., "What's the weather like?"), respond politely: "I'm sorry, I don't have that information. Can I help with floor plans, vacancies, amenities, or tours?"
-5. **Interruptions**: If interrupted (e.g., detected by speech activity), stop speaking immediately and process the new query.
-6. **Voice Interaction**: Avoid complex terms or long lists in responses. Use conversational phrases like "We have a lovely 1BHK A1 unit" or "Let me check that for you."
-7. **Fallback**: If audio transcription fails, respond: "Sorry, I didn't catch that. Could you repeat it?"
-
-**Example Interactions**:
-- **User**: "What 1BHK apartments are available?"
-  **AI**: "We have two 1BHK options: the A1, 575 square feet at $1,095/month on the ground floor with a walk-in closet, and the A2, 597 square feet at $1,130/month on the second floor with hardwood floors. Want to hear about available units? By the way, why did the owl pick the A1? It loved the balcony view!"
-- **User**: "What amenities do you offer?"
-  **AI**: "STONE Creek offers a swimming pool, fitness center, pet-friendly environment, gated community, and clubhouse. Interested in specific details?"
-- **User**: "Can I book a tour for unit A101 on June 25?"
-  **AI**: "Yes, unit A101, a 1BHK A1 at $1,100/month, has a tour slot on June 25 at 4:00 PM. Shall I confirm it?"
-- **User**: "What's the price of unit A201?"
-  **AI**: "Unit A201 is a 1BHK A2, priced at $1,140/month, with a tour slot on June 25 at 10:00 AM. Want to book it?"
-- **User**: "Tell me about the weather."
-  **AI**: "I'm sorry, I don't have weather info. Can I help with floor plans, vacancies, amenities, or tours?"
+3. **Property Name**: Use the name "{property_name}" in the conversation.
+4. **Lead Details**: Collect the caller's name, phone number and email, and use their name in the conversation.
+5. **Accuracy**: Answer only from tool results. If a tool returns nothing or an error, say so rather than guessing.
+6. **Floor Plans and Units**: Mention type, class, size and price, and at most 3 features.
+7. **Amenities**: List up to 5 amenities and offer more details if asked.
+8. **Bookings**: Pick a free slot from `slots`, reserve it with `hold_tour`, and once the caller agrees call `confirm_tour` with their name, phone and email. If the slot is taken, offer another one. Never promise a slot that was not confirmed. Format dates as "Month Day at Time" (e.g., "July 3 at 9:00 AM").
+9. **Unclear Queries**: If the query is not about the property (e.g., "What's the weather like?"), respond: "I'm sorry, I don't have that information. Can I help with floor plans, vacancies, amenities, or tours?"
+10. **Interruptions**: If interrupted, stop speaking immediately and address the new query.
+11. **Fallback**: If audio transcription fails, respond: "Sorry, I didn't catch that. Could you repeat it?"
 
 **Initial Greeting**:
-When a call starts, greet the user with: "Hello there! I'm Tina AI assitant, Welcome to STONE Creek Apartment and Homes! how can I help you today?"
+When a call starts, greet the user with: "Hello there! I'm Tina AI assitant, Welcome to {property_name}! how can I help you today?"
 
 **Constraints**:
-- Do not access external data or APIs beyond the JSON.
 - Keep responses under 30 seconds when spoken (about 50-60 words).
-- Handle interruptions gracefully by stopping and addressing the new query.
-- Use the exact appointment slot times from the JSON, formatted for clarity.
+- Avoid long lists; offer to share more instead.
 """
 VOICE = 'alloy'
+# Spoken from the clip cache instead of being generated on every call; the greeting is rendered per property
+# Clips are rendered outside any one property's session, so they get the persona only
+CLIP_INSTRUCTIONS = "You are Tina, a warm and professional leasing agent speaking on the phone."
+GREETING_TEXT = "Hello there! I'm Tina, the AI assistant. Welcome to {property_name}! How can I help you today?"
+CLIP_TEXTS = {
+    'didnt_catch': "Sorry, I didn't catch that. Could you repeat it?",
+    'unknown_question': "I'm sorry, I don't have that information. Can I help with floor plans, vacancies, amenities, or tours?",
+}
 LOG_EVENT_TYPES = [
     'error', 'response.content.done', 'rate_limits.updated',
     'response.done', 'input_audio_buffer.committed',
@@ -115,276 +142,282 @@ LOG_EVENT_TYPES = [
 ]
 SHOW_TIMING_MATH = False
 
-def parse_transcription_file(file_path="transcription.json"):
-    """Parse the transcription.json file and extract conversation data."""
-    conversations = {}
-    
-    try:
-        with open(file_path, 'r') as file:
-            content = file.read().strip()
-            if not content:
-                return conversations
-                
-            # Split by lines and parse each JSON object (each line is a separate JSON object)
-            lines = content.split('\n')
-            print(f"📄 Found {len(lines)} lines in transcription file")
-            
-            for line_num, line in enumerate(lines, 1):
-                line = line.strip()
-                if line and len(line) > 5:  # Skip very short lines
-                    # Clean up common JSON formatting issues
-                    if line.startswith('{') and not line.endswith('}'):
-                        # Try to find the next complete JSON object
-                        continue
-                    
-                    try:
-                        data = json.loads(line)
-                        sid = data.get('TranscriptionSid')
-                        print(f"   Line {line_num}: SID={sid}, Status={data.get('TranscriptionStatus')}")
-                        
-                        if sid:
-                            if sid not in conversations:
-                                conversations[sid] = {
-                                    'customer_messages': [],
-                                    'ai_messages': [],
-                                    'all_messages': []
-                                }
-                            
-                            transcript_data = data.get('TranscriptionData')
-                            if transcript_data:
-                                try:
-                                    # Parse the nested JSON string
-                                    transcript_json = json.loads(transcript_data)
-                                    transcript = transcript_json.get('transcript', '').strip()
-                                    confidence = transcript_json.get('confidence', 0)
-                                    status = data.get('TranscriptionStatus')
-                                    
-                                    print(f"     Transcript: '{transcript}' (confidence: {confidence})")
-                                    
-                                    if transcript and confidence > 0.3:  # Lowered confidence threshold
-                                        message = {
-                                            'text': transcript,
-                                            'confidence': confidence,
-                                            'timestamp': datetime.now().isoformat()
-                                        }
-                                        
-                                        conversations[sid]['all_messages'].append(message)
-                                        
-                                        if status == 'inbound_track':  # Customer speaking
-                                            conversations[sid]['customer_messages'].append(message)
-                                        elif status == 'outbound_track':  # AI speaking
-                                            conversations[sid]['ai_messages'].append(message)
-                                except json.JSONDecodeError as nested_e:
-                                    print(f"     Nested JSON decode error: {nested_e}")
-                                        
-                    except json.JSONDecodeError as e:
-                        print(f"   Line {line_num}: JSON decode error - {e}")
-                        print(f"     Problematic line: {line[:100]}...")
-                        continue
-                        
-    except FileNotFoundError:
-        print(f"Transcription file {file_path} not found")
-        
-    print(f"🎯 Parsed {len(conversations)} conversations")
-    return conversations
-
-def extract_lead_info(conversation_data):
-    """Extract lead information from conversation transcripts."""
-    customer_text = ' '.join([msg['text'] for msg in conversation_data.get('customer_messages', [])])
-    all_text = ' '.join([msg['text'] for msg in conversation_data.get('all_messages', [])])
-    
-    lead_info = {
-        'name': None,
-        'email': None,
-        'phone': None,
-        'interests': [],
-        'appointment_requested': False,
-        'conversation_summary': customer_text[:500],  # First 500 chars
-        'message_count': len(conversation_data.get('all_messages', [])),
-        'source': 'voice_call'
-    }
-    
-    # Extract email
-    email_match = re.search(EMAIL_PATTERN, customer_text, re.IGNORECASE)
-    if email_match:
-        lead_info['email'] = email_match.group()
-    
-    # Extract phone
-    phone_match = re.search(PHONE_PATTERN, customer_text)
-    if phone_match:
-        lead_info['phone'] = phone_match.group()
-    
-    # Extract name
-    for pattern in NAME_PATTERNS:
-        name_match = re.search(pattern, customer_text, re.IGNORECASE)
-        if name_match:
-            candidate_name = name_match.group(1).strip().title()
-            # Simple validation
-            if len(candidate_name) > 1 and candidate_name not in ['Hello', 'Hi', 'Thanks']:
-                lead_info['name'] = candidate_name
-                break
-    
-    # Extract interests
-    interests_keywords = {
-        '1BHK': ['1bhk', 'one bedroom', '1 bedroom'],
-        '2BHK': ['2bhk', 'two bedroom', '2 bedroom'],
-        'Swimming Pool': ['pool', 'swimming'],
-        'Fitness Center': ['gym', 'fitness'],
-        'Pet Friendly': ['pet', 'dog', 'cat'],
-        'Ground Floor': ['ground floor', 'first floor']
+def build_session_update(engine):
+    """session.update event for one compiled property."""
+    return {
+        "type": "session.update",
+        "session": {
+            "turn_detection": {"type": "server_vad"},
+            "input_audio_format": "g711_ulaw",
+            "output_audio_format": "g711_ulaw",
+            "voice": VOICE,
+            "instructions": SYSTEM_MESSAGE.format(property_name=engine.name, property_address=engine.address),
+            "tools": KNOWLEDGE_TOOLS + booking.TOOLS,
+            "tool_choice": "auto",
+            "modalities": ["text", "audio"],
+            "temperature": 0.8,
+        }
     }
-    
-    for interest, keywords in interests_keywords.items():
-        if any(keyword in all_text.lower() for keyword in keywords):
-            lead_info['interests'].append(interest)
-    
-    # Check for appointment requests
-    appointment_keywords = ['tour', 'visit', 'appointment', 'schedule', 'book', 'see the place']
-    if any(keyword in all_text.lower() for keyword in appointment_keywords):
-        lead_info['appointment_requested'] = True
-    
-    return lead_info
+
+# Immutable knowledge base snapshot (per-property engine + serialized session.update), swapped on file change
+kb_watcher = KnowledgeBaseWatcher(KNOWLEDGE_BASE_FILE, build_session_update, KB_RELOAD_INTERVAL, SEARCH_INDEX_CACHE)
+
+# Tour reservations over each property's appointment slots
+booking_engine = booking.BookingEngine(BOOKINGS_LOG, BOOKING_HOLD_TTL, default_property=kb_watcher.snapshot.default.key)
+booking_calendars = {}  # property key -> digest of the entry its calendar was built from
+
+def load_booking_calendars(snapshot):
+    """Rebuild the calendars of properties that changed and drop those of removed ones."""
+    for key, config in snapshot.properties.items():
+        if booking_calendars.get(key) != config.digest:
+            booking_engine.load_calendar(config.data.get('vacancies', []), key)
+            booking_calendars[key] = config.digest
+    for key in set(booking_calendars) - set(snapshot.properties):
+        booking_engine.drop_calendar(key)
+        del booking_calendars[key]
+
+load_booking_calendars(kb_watcher.snapshot)
+
+async def reload_booking_calendars(snapshot):
+    load_booking_calendars(snapshot)
+
+def greeting_clip(config):
+    return f"greeting-{config.key}"
+
+def clip_texts(snapshot):
+    """Clip name -> words: the shared replies plus one greeting per property."""
+    texts = dict(CLIP_TEXTS)
+    for config in snapshot.properties.values():
+        texts[greeting_clip(config)] = GREETING_TEXT.format(property_name=config.engine.name)
+    return texts
+
+async def reload_greeting_clips(snapshot):
+    """Render greetings for new or renamed properties in the background."""
+    # Rendering opens realtime sessions, which costs tokens; not worth it when the clips go unused
+    if clip_cache.retarget(clip_texts(snapshot)) and CACHED_GREETING:
+        asyncio.create_task(clip_cache.capture_missing(connect_realtime))
+
+kb_watcher.subscribers.add(reload_booking_calendars)
+FAST_RELAY = os.getenv('FAST_RELAY', 'true').lower() in ('1', 'true', 'yes')  # Splice audio payloads without full JSON decode
+MARK_INTERVAL_MS = int(os.getenv('MARK_INTERVAL_MS', 200))  # Playout confirmation cadence in ms of assistant audio
+AUDIO_COALESCE_MS = int(os.getenv('AUDIO_COALESCE_MS', 0))  # > 0 batches inbound frames into one append per window
+LOCAL_VAD = os.getenv('LOCAL_VAD', 'false').lower() in ('1', 'true', 'yes')  # Barge-in from in-process VAD, before server_vad confirms
+LOCAL_VAD_MIN_ENERGY_DB = float(os.getenv('LOCAL_VAD_MIN_ENERGY_DB', -45.0))
+LOCAL_VAD_START_FRAMES = int(os.getenv('LOCAL_VAD_START_FRAMES', 2))  # 20 ms frames of speech before firing
+LOCAL_VAD_CONFIRM_MS = int(os.getenv('LOCAL_VAD_CONFIRM_MS', 800))  # Wait this long for server_vad to confirm a local barge-in, else resume playback
+RELAY_OPENAI_MAX_AUDIO = int(os.getenv('RELAY_OPENAI_MAX_AUDIO', 250))  # Caller audio messages queued for OpenAI; the oldest are dropped beyond this
+RELAY_TWILIO_MAX_AUDIO = int(os.getenv('RELAY_TWILIO_MAX_AUDIO', 1500))  # Assistant audio deltas queued for Twilio (~30 s); the oldest are dropped beyond this
+RELAY_STALL_MS = float(os.getenv('RELAY_STALL_MS', 100))  # A socket send slower than this counts as a stall
+RECORD_CALLS = os.getenv('RECORD_CALLS', 'false').lower() in ('1', 'true', 'yes')  # Stereo recording of every call: caller left, assistant right
+RECORDINGS_DIR = os.getenv('RECORDINGS_DIR', 'recordings')
+RECORDING_FORMAT = os.getenv('RECORDING_FORMAT', 'wav')  # wav or flac
+RECORDING_WORKERS = int(os.getenv('RECORDING_WORKERS', 2))  # Threads decoding and writing recordings for all calls
+RECORDING_MAX_BATCHES = int(os.getenv('RECORDING_MAX_BATCHES', 20))  # Per call, ~1 s each; beyond this recorded audio is dropped
+ADMISSION_MAX_CALLS = int(os.getenv('ADMISSION_MAX_CALLS', 0))  # Calls relayed at once before new callers are held, 0 = no cap
+ADMISSION_MIN_TOKENS = int(os.getenv('ADMISSION_MIN_TOKENS', 0))  # Hold new callers while fewer realtime tokens remain, 0 disables
+ADMISSION_MIN_REQUESTS = int(os.getenv('ADMISSION_MIN_REQUESTS', 0))  # Hold new callers while fewer realtime requests remain, 0 disables
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 10))  # Callers on hold; more overflow
+ADMISSION_HOLD_SECONDS = int(os.getenv('ADMISSION_HOLD_SECONDS', 10))  # Pause before a held caller is tried again
+ADMISSION_OVERFLOW_NUMBER = os.getenv('ADMISSION_OVERFLOW_NUMBER')  # Overflow calls are forwarded here; unset asks them to call back
+
+if RECORD_CALLS and call_recorder.soundfile is None:
+    logger.warning("RECORD_CALLS is set but soundfile is not available; calls will not be recorded")
+    RECORD_CALLS = False
+# Shared by every call's recorder, so recording never runs on the event loop
+recording_pool = ThreadPoolExecutor(RECORDING_WORKERS, thread_name_prefix='recorder') if RECORD_CALLS else None
+
+# Realtime budgets from rate_limits.updated and the calls in flight decide whether /incoming-call connects
+admission = AdmissionController(
+    max_calls=ADMISSION_MAX_CALLS,
+    min_tokens=ADMISSION_MIN_TOKENS,
+    min_requests=ADMISSION_MIN_REQUESTS,
+    max_queue=ADMISSION_MAX_QUEUE,
+    hold_seconds=ADMISSION_HOLD_SECONDS
+)
+
+rails_client = RailsClient(
+    RAILS_SERVER_URL,
+    max_connections=RAILS_MAX_CONNECTIONS,
+    max_concurrency=RAILS_MAX_CONCURRENCY,
+    timeout=RAILS_TIMEOUT,
+    batch_window_ms=RAILS_BATCH_WINDOW_MS,
+    batch_max=RAILS_BATCH_MAX,
+    bulk_path=RAILS_BULK_PATH
+)
+
+lead_outbox = LeadOutbox(
+    LEAD_OUTBOX_PATH,
+    send=rails_client.create_lead,
+    base_delay=LEAD_RETRY_BASE_DELAY,
+    max_delay=LEAD_RETRY_MAX_DELAY,
+    max_attempts=LEAD_MAX_ATTEMPTS
+)
+
+# Counters updated as each conversation is finalized; `python lead_analytics.py` rebuilds them
+lead_analytics = LeadAnalytics(ANALYTICS_DB, ANALYTICS_HOURS)
 
 async def create_lead_in_rails(lead_info, transcription_sid):
     """Send lead information to Rails server to create a lead."""
     try:
-        # Prepare payload for Rails API
-        payload = {
-            'lead': {
-                'email': lead_info.get('email'),
-                'payload': {
-                    'source': 'voice_call_ai',
-                    'transcription_sid': transcription_sid,
-                    'contact_info': {
-                        'name': lead_info.get('name'),
-                        'phone': lead_info.get('phone'),
-                        'email': lead_info.get('email')
-                    },
-                    'interests': lead_info.get('interests', []),
-                    'appointments': {
-                        'requested': lead_info.get('appointment_requested', False),
-                        'status': 'requested' if lead_info.get('appointment_requested') else 'none'
-                    },
-                    'conversation_summary': {
-                        'total_messages': lead_info.get('message_count', 0),
-                        'summary': lead_info.get('conversation_summary', ''),
-                        'source': 'voice_ai_assistant'
-                    },
-                    'lead_score': calculate_lead_score(lead_info),
-                    'created_at': datetime.now().isoformat()
-                }
-            }
-        }
-        
-        rails_url = f"{RAILS_SERVER_URL}/leads"
-        print(f"🚀 Sending POST request to Rails: {rails_url}")
-        print(f"📦 Payload: {json.dumps(payload, indent=2)}")
-        
-        # Ensure we're using httpx properly for POST request
-        if 'httpx' not in globals():
-            print("❌ httpx not available, falling back to requests")
-            import requests
-            response = requests.post(
-                rails_url,
-                json=payload,
-                headers={
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json'
-                },
-                timeout=10.0
-            )
-            
-            if response.status_code in [200, 201]:
-                print(f"✅ Lead created successfully in Rails: {response.json()}")
-                return True
-            else:
-                print(f"❌ Failed to create lead: {response.status_code} - {response.text}")
-                return False
-        else:
-            async with httpx.AsyncClient() as client:
-                print("📡 Making POST request with httpx...")
-                response = await client.post(
-                    rails_url,
-                    json=payload,
-                    headers={
-                        'Content-Type': 'application/json',
-                        'Accept': 'application/json',
-                        'User-Agent': 'FastAPI-Voice-Assistant/1.0'
-                    },
-                    timeout=10.0
-                )
-                
-                print(f"📈 Response status: {response.status_code}")
-                print(f"📄 Response headers: {dict(response.headers)}")
-                
-                if response.status_code in [200, 201]:
-                    try:
-                        response_data = response.json()
-                        print(f"✅ Lead created successfully in Rails: {response_data}")
-                        return True
-                    except:
-                        print(f"✅ Lead created successfully in Rails (non-JSON response): {response.text}")
-                        return True
-                else:
-                    print(f"❌ Failed to create lead: {response.status_code}")
-                    print(f"❌ Response text: {response.text}")
-                    return False
-                
+        payload = build_lead_payload(lead_info, transcription_sid)
+        logger.info(f"🚀 Sending lead {transcription_sid} to Rails")
+        return await rails_client.create_lead(payload)
     except Exception as e:
-        print(f"❌ Error creating lead in Rails: {e}")
-        import traceback
-        print(f"❌ Full traceback: {traceback.format_exc()}")
+        logger.error(f"❌ Error creating lead in Rails: {e!r}")
         return False
 
-def calculate_lead_score(lead_info):
-    """Calculate lead score based on available information."""
-    score = 0
+async def process_conversation(sid, conversation_data):
+    """Create a lead for one conversation if it carries enough information. Returns the lead status."""
+    logger.info(f"📞 Processing conversation {sid}: {len(conversation_data.get('customer_messages', []))} customer "
+                f"and {len(conversation_data.get('ai_messages', []))} AI messages")
     
-    # Contact information
-    if lead_info.get('email'): score += 30
-    if lead_info.get('phone'): score += 25
-    if lead_info.get('name'): score += 15
-    
-    # Engagement indicators
-    if lead_info.get('appointment_requested'): score += 20
-    if lead_info.get('interests'): score += 10
-    if lead_info.get('message_count', 0) >= 5: score += 10
-    
-    return min(score, 100)  # Cap at 100
+    lead_info = None
+    # Check if conversation has enough data to create a lead
+    if len(conversation_data.get('customer_messages', [])) >= 1:  # Lowered threshold
+        # Usually already built utterance by utterance while the call was live
+        lead_info = lead_tracker.lead_info(sid, conversation_data)
+        # Tours actually reserved during the call, matched through its CallSid
+        lead_info['bookings'] = booking_engine.bookings_for_call(conversation_data.get('call_sid'))
+        if lead_info['bookings']:
+            lead_info['appointment_requested'] = True
+        # Contact details stay out of INFO logs
+        logger.debug(f"Extracted lead info for {sid}: {truncate(lead_info)}")
+    try:
+        # Counted once per SID, so reprocessing a conversation does not count it again
+        await lead_analytics.record(sid, conversation_data, lead_info)
+    except Exception as e:
+        logger.error(f"❌ Error updating analytics for {sid}: {e!r}")
+
+    if lead_info is None:
+        logger.info(f"⏭️  Skipping conversation {sid} - not enough messages")
+        return 'no_messages'
+    # Only create lead if we have meaningful information
+    if has_enough_for_lead(lead_info, conversation_data):
+        # Delivery to Rails happens in the outbox worker, with retries
+        if await lead_outbox.enqueue(sid, build_lead_payload(lead_info, sid)):
+            logger.info(f"✅ Queued lead for conversation {sid}")
+            return 'queued'
+        logger.info(f"⏭️  Lead for conversation {sid} already queued")
+        return 'already_queued'
+    logger.info(f"⏭️  Skipping conversation {sid} - not enough meaningful data")
+    return 'skipped'
 
 async def process_completed_transcriptions():
     """Process transcriptions and create leads for completed conversations."""
-    print("🔍 Starting transcription processing...")
-    conversations = parse_transcription_file()
+    logger.info("🔍 Starting transcription processing...")
+    # Calls still in progress are left alone: their lead is queued once, so it must be the final one
+    conversations = await asyncio.to_thread(transcript_store.ended_conversations)
     
-    print(f"📊 Found {len(conversations)} conversations")
+    logger.info(f"📊 Found {len(conversations)} ended conversations")
     
     for sid, conversation_data in conversations.items():
-        print(f"📞 Processing conversation {sid}")
-        print(f"   - Customer messages: {len(conversation_data.get('customer_messages', []))}")
-        print(f"   - AI messages: {len(conversation_data.get('ai_messages', []))}")
-        
-        # Check if conversation has enough data to create a lead
-        if len(conversation_data.get('customer_messages', [])) >= 1:  # Lowered threshold
-            lead_info = extract_lead_info(conversation_data)
-            print(f"   - Extracted lead info: {lead_info}")
-            
-            # Only create lead if we have meaningful information
-            if (lead_info.get('email') or lead_info.get('phone') or 
-                lead_info.get('appointment_requested') or lead_info.get('interests') or
-                len(conversation_data.get('customer_messages', [])) >= 2):  # Or if enough conversation
-                
-                print(f"✅ Creating lead for conversation {sid}")
-                result = await create_lead_in_rails(lead_info, sid)
-                print(f"   - Lead creation result: {result}")
-            else:
-                print(f"⏭️  Skipping conversation {sid} - not enough meaningful data")
-        else:
-            print(f"⏭️  Skipping conversation {sid} - not enough messages")
+        await process_conversation(sid, conversation_data)
     
-    print("🏁 Transcription processing completed")
+    logger.info("🏁 Transcription processing completed")
+
+lead_tracker = LeadTracker()
+transcript_store = open_transcript_store(
+    TRANSCRIPT_STORE,
+    db_path=TRANSCRIPT_DB,
+    file_path=TRANSCRIPTION_FILE,
+    state_path=TRANSCRIPTION_STATE_FILE,
+    fsync_policy=TRANSCRIPT_FSYNC,
+    fsync_interval_ms=TRANSCRIPT_FSYNC_INTERVAL_MS
+)
+
+async def process_ended_conversations():
+    """Claim calls that ended and have not been processed yet, and create their leads.
+
+    Claims are atomic in the store, so with several workers each call is processed once.
+    """
+    while True:
+        completed = await asyncio.to_thread(transcript_store.claim_ended)
+        if not completed:
+            return
+        for sid, conversation_data in completed.items():
+            status = await process_conversation(sid, conversation_data)
+            await asyncio.to_thread(transcript_store.mark_processed, sid, status)
+            lead_tracker.discard(sid)
+
+async def on_transcripts_flushed(batch):
+    """Update live leads, and kick off lead processing once an end-of-conversation record is on disk."""
+    for record in batch:
+        lead_tracker.observe(record)
+    if any(is_conversation_end(record) for record in batch):
+        logger.info("🏁 Conversation completed - processing lead automatically...")
+        asyncio.create_task(process_ended_conversations())
+
+transcript_writer = TranscriptWriter(
+    transcript_store,
+    max_queue=TRANSCRIPT_QUEUE_SIZE,
+    batch_size=TRANSCRIPT_BATCH_SIZE,
+    on_flush=on_transcripts_flushed
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Start and stop the background workers that live for the whole app."""
+    await asyncio.to_thread(transcript_store.open)
+    transcript_writer.start()
+    await rails_client.start()
+    lead_outbox.start()
+    kb_watcher.start()
+    realtime_sessions.start()
+    await asyncio.to_thread(clip_cache.load)
+    if RECORD_CALLS:
+        await asyncio.to_thread(os.makedirs, RECORDINGS_DIR, exist_ok=True)
+    clip_capture = asyncio.create_task(clip_cache.capture_missing(connect_realtime)) if CACHED_GREETING else None
+    loop_lag = asyncio.create_task(metrics.watch_event_loop_lag(LOOP_LAG_INTERVAL)) if LOOP_LAG_INTERVAL > 0 else None
+    # Pick up calls that ended while no worker was running
+    asyncio.create_task(process_ended_conversations())
+    try:
+        yield
+    finally:
+        if loop_lag:
+            loop_lag.cancel()
+        if clip_capture:
+            clip_capture.cancel()
+        await realtime_sessions.stop()
+        clip_cache.close()
+        await kb_watcher.stop()
+        await transcript_writer.stop()
+        await asyncio.to_thread(transcript_store.close)
+        await lead_outbox.stop()
+        await asyncio.to_thread(lead_analytics.close)
+        await rails_client.close()
+        if recording_pool:
+            # Let recordings of the last calls finish writing
+            await asyncio.to_thread(recording_pool.shutdown)
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+# Timed by path; only fixed webhook paths, so label values stay bounded
+TIMED_PATHS = {'/incoming-call', '/transcript-callback'}
+
+@app.middleware("http")
+async def time_webhooks(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    if request.url.path in TIMED_PATHS:
+        metrics.HTTP_DURATION.labels(request.url.path).observe(time.perf_counter() - started)
+    return response
+
+async def connect_realtime():
+    """Open a websocket to the OpenAI Realtime API."""
+    return await websockets.connect(
+        OPENAI_REALTIME_URL,
+        additional_headers={
+            "Authorization": f"Bearer {OPENAI_API_KEY}",
+            "OpenAI-Beta": "realtime=v1"
+        }
+    )
+
+# Realtime sessions opened while Twilio plays the greeting, claimed by /media-stream
+realtime_sessions = RealtimeSessionPool(connect_realtime, REALTIME_PREWARM_MAX, REALTIME_PREWARM_TTL)
+
+# Greetings and fallback replies in Tina's voice, captured once from the realtime API
+clip_cache = ClipCache(AUDIO_CLIP_DIR, clip_texts(kb_watcher.snapshot), VOICE, CLIP_INSTRUCTIONS)
+kb_watcher.subscribers.add(reload_greeting_clips)
 
 if not OPENAI_API_KEY:
     raise ValueError('Missing the OpenAI API key. Please set it in the .env file.')
@@ -396,10 +429,55 @@ async def index_page():
 @app.get("/process-leads", response_class=JSONResponse)
 async def process_leads_endpoint():
     """Manual endpoint to process transcriptions and create leads."""
-    print("🔄 Processing transcriptions to create leads...")
+    logger.info("🔄 Processing transcriptions to create leads...")
     await process_completed_transcriptions()
     return {"message": "Lead processing completed", "status": "success"}
 
+@app.get("/analytics", response_class=JSONResponse)
+async def analytics_endpoint():
+    """Calls, leads, appointment requests, interests and lead scores: all-time, last 24 hours and per hour."""
+    return await asyncio.to_thread(lead_analytics.summary)
+
+@app.get("/knowledge-base/status", response_class=JSONResponse)
+async def knowledge_base_status():
+    """Version, reload cost and time-to-visibility of the live knowledge base."""
+    return kb_watcher.status()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus metrics: call latency and throughput, webhook and lead post timings, queue depths."""
+    metrics.QUEUE_DEPTH.labels('transcript_writer').set(transcript_writer.queue.qsize())
+    metrics.QUEUE_DEPTH.labels('realtime_prewarm').set(len(realtime_sessions.sessions))
+    metrics.QUEUE_DEPTH.labels('admission_hold').set(len(admission.queue))
+    metrics.TASKS.set(len(asyncio.all_tasks()))
+    outbox = await asyncio.to_thread(lead_outbox.counts)
+    metrics.QUEUE_DEPTH.labels('lead_outbox').set(outbox.get('pending', 0))
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/realtime-sessions/status", response_class=JSONResponse)
+async def realtime_sessions_status():
+    """Pre-warmed realtime sessions: parked now, and how many were claimed, missed or expired."""
+    return realtime_sessions.status()
+
+@app.get("/admission/status", response_class=JSONResponse)
+async def admission_status():
+    """Calls in flight and on hold, the last realtime budgets seen, and connect / hold / overflow counts."""
+    return admission.status()
+
+@app.get("/audio-clips/status", response_class=JSONResponse)
+async def audio_clips_status():
+    """Which greeting and fallback clips are cached, and how long they play."""
+    return clip_cache.status()
+
+@app.get("/conversations/{transcription_sid}", response_class=JSONResponse)
+async def conversation_endpoint(transcription_sid: str):
+    """Messages and lead processing status of one call."""
+    status = await asyncio.to_thread(transcript_store.conversation_status, transcription_sid)
+    if status is None:
+        return JSONResponse({"status": "error", "message": "Unknown TranscriptionSid"}, status_code=404)
+    conversation = await asyncio.to_thread(transcript_store.conversation, transcription_sid)
+    return {**status, 'conversation': conversation}
+
 @app.get("/test-lead-creation", response_class=JSONResponse)
 async def test_lead_creation():
     """Test endpoint to verify lead creation functionality."""
@@ -420,73 +498,42 @@ async def test_lead_creation():
 
 @app.api_route("/transcript-callback", methods=["POST"])
 async def transcript_callback(request: Request):
-    # Extract transcription details from the webhook
-    print("****Coming here*******")
+    """Validate a Twilio transcription webhook and queue it for the background writer."""
+    content_type = request.headers.get("content-type", "")
     
     try:
-        # Try to get form data first
-        content_type = request.headers.get("content-type", "")
-        
         if "application/x-www-form-urlencoded" in content_type:
             # Handle URL-encoded form data
             body = await request.body()
-            from urllib.parse import parse_qs
             form_data = parse_qs(body.decode())
             # Convert list values to single values
             form_data = {k: v[0] if v else None for k, v in form_data.items()}
         elif "multipart/form-data" in content_type:
             # Handle multipart form data (requires python-multipart)
-            form_data = await request.form()
-            form_data = dict(form_data)
+            form_data = dict(await request.form())
         else:
-            # Try JSON if it's not form data
-            try:
-                form_data = await request.json()
-            except:
-                # Fallback to reading raw body
-                body = await request.body()
-                print(f"Raw body: {body}")
-                form_data = {}
-        
-        print(f"Test Form data {form_data}")
-        
-        transcription = {
-            'TranscriptionSid': form_data.get('TranscriptionSid'),
-            'TranscriptionData': form_data.get('TranscriptionData'),
-            'TranscriptionStatus': form_data.get('Track')
-        }
-        
-        # Print or process the JSON transcription
-        print("Transcription JSON:", transcription)
-        
-        # Optionally save to a file or database
-        with open('transcription.json', 'a') as f:
-            import json
-            json.dump(transcription, f, separators=(',', ':'))  # Compact format, one line per object
-            f.write('\n')
-            
-        # Check if conversation is complete and process lead automatically
-        transcript_data = transcription.get('TranscriptionData')
-        transcript_status = transcription.get('TranscriptionStatus')
-        
-        # Conversation is complete when both TranscriptionData and TranscriptionStatus are null
-        if transcript_data is None and transcript_status is None:
-            print("🏁 Conversation completed - processing lead automatically...")
-            # Process leads asynchronously in background
-            asyncio.create_task(process_completed_transcriptions())
-        elif transcript_data:
-            # Log the transcript for monitoring
-            try:
-                transcript_json = json.loads(transcript_data)
-                transcript_text = transcript_json.get('transcript', '').strip()
-                if transcript_text:
-                    print(f"📝 Transcription: {transcript_text}")
-            except json.JSONDecodeError:
-                pass
-            
+            form_data = await request.json()
     except Exception as e:
-        print(f"Error processing transcript callback: {e}")
-        return {"status": "error", "message": str(e)}
+        return JSONResponse({"status": "error", "message": f"Unreadable body: {e}"}, status_code=400)
+    
+    if not isinstance(form_data, dict) or not form_data.get('TranscriptionSid'):
+        return JSONResponse({"status": "error", "message": "Missing TranscriptionSid"}, status_code=400)
+    
+    transcription = {
+        'TranscriptionSid': form_data.get('TranscriptionSid'),
+        'TranscriptionData': form_data.get('TranscriptionData'),
+        'TranscriptionStatus': form_data.get('Track'),
+        'CallSid': form_data.get('CallSid')
+    }
+    if form_data.get('Timestamp'):
+        # When Twilio transcribed the utterance; kept so archived logs can be replayed in time order
+        transcription['Timestamp'] = form_data['Timestamp']
+    
+    try:
+        transcript_writer.submit(transcription)
+    except asyncio.QueueFull:
+        # Let Twilio retry rather than silently dropping the transcript
+        return JSONResponse({"status": "error", "message": "Transcript queue full"}, status_code=503)
     
     # Return empty response (Twilio expects 200 or 204 for status callbacks)
     return {"status": "200"}
@@ -494,6 +541,18 @@ async def transcript_callback(request: Request):
 @app.api_route("/incoming-call", methods=["GET", "POST"])
 async def handle_incoming_call(request: Request):
     """Handle incoming call and return TwiML response to connect to Media Stream."""
+    params = await request.form() if request.method == "POST" else request.query_params
+    call_sid = params.get('CallSid')
+    decision, position = admission.admit(call_sid)
+    if decision == HOLD:
+        return twiml_response(hold_twiml(position))
+    if decision != CONNECT:
+        return twiml_response(overflow_twiml())
+    # The dialed number picks the property: one dict lookup, however many there are
+    config = kb_watcher.snapshot.route(params.get('To'))
+    # Connect and configure the realtime session while the prompts below play
+    realtime_sessions.warm(call_sid, config)
+
     response = VoiceResponse()
     start = Start()
     start.transcription(
@@ -503,116 +562,360 @@ async def handle_incoming_call(request: Request):
     outbound_track_label='customer'
     )
     response.append(start)
-    response.say("Please wait while we connect your call to the A.I")
-    response.pause(length=1)
-    response.say("O.K. you can start talking!")
+    if not (CACHED_GREETING and clip_cache.has(greeting_clip(config))):
+        response.say("Please wait while we connect your call to the A.I")
+        response.pause(length=1)
+        response.say("O.K. you can start talking!")
     host = request.url.hostname
     connect = Connect()
-    connect.stream(url=f'wss://{host}/media-stream')
+    stream = connect.stream(url=f'wss://{host}/media-stream')
+    # Comes back in the start event, so a stream that missed the pre-warmed session is still routed
+    stream.parameter(name='property', value=config.key)
     response.append(connect)
+    return twiml_response(response)
+
+def twiml_response(response):
     return HTMLResponse(content=str(response), media_type="application/xml")
 
+def hold_twiml(position):
+    """Tell a held caller their place, then come back to /incoming-call to try again."""
+    response = VoiceResponse()
+    response.say(f"All of our lines are busy. You are number {position} in line, please stay on the line.")
+    response.pause(length=ADMISSION_HOLD_SECONDS)
+    response.redirect('/incoming-call', method='POST')
+    return response
+
+def overflow_twiml():
+    response = VoiceResponse()
+    if ADMISSION_OVERFLOW_NUMBER:
+        response.say("All of our lines are busy. Please hold while we transfer your call.")
+        response.dial(ADMISSION_OVERFLOW_NUMBER)
+    else:
+        response.say("We are experiencing a high call volume. Please call back in a few minutes.")
+        response.hangup()
+    return response
+
 @app.websocket("/media-stream")
 async def handle_media_stream(websocket: WebSocket):
     """Handle WebSocket connections between Twilio and OpenAI."""
-    print("Client connected")
+    logger.debug("Client connected")
     await websocket.accept()
 
-    async with websockets.connect(
-        'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2025-06-03',
-        additional_headers={
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "OpenAI-Beta": "realtime=v1"
-        }
-    ) as openai_ws:
-        await initialize_session(openai_ws)
+    # The CallSid in Twilio's start event picks up the session warmed at /incoming-call
+    start = await wait_for_stream_start(websocket)
+    if start is None:
+        logger.info("Client disconnected before the stream started.")
+        return
+    # Every log record from this call, and the tasks it starts, carries its SIDs
+    bind_call(stream_sid=start['streamSid'], call_sid=start.get('callSid'))
+    logger.info(f"Incoming stream has started {start['streamSid']}")
+
+    snapshot = kb_watcher.snapshot
+    property_key = start.get('customParameters', {}).get('property')
+    config = snapshot.properties.get(property_key, snapshot.default)
+
+    # The caller hears Tina right away, while the realtime session is claimed or connected
+    greeting_name = greeting_clip(config)
+    greeting = list(clip_cache.chunks(greeting_name)) if CACHED_GREETING and clip_cache.has(greeting_name) else []
+    for payload in greeting:
+        await websocket.send_text(relay_codec.twilio_media_message(start['streamSid'], payload))
+
+    claimed = await realtime_sessions.claim(start.get('callSid'))
+    if claimed:
+        openai_ws, config = claimed
+        logger.info(f"Using pre-warmed realtime session for {start.get('callSid')}")
+        current = kb_watcher.snapshot.properties.get(config.key)
+        if current is not None and current is not config:
+            # The property's knowledge base entry changed while the session was parked
+            config = current
+            await initialize_session(openai_ws, config)
+    else:
+        openai_ws = await connect_realtime()
+        # Each call pins the property config it started with
+        await initialize_session(openai_ws, config)
 
+    async with openai_ws:
         # Connection specific state
-        stream_sid = None
+        stream_sid = start['streamSid']
+        call_sid = start.get('callSid')
         latest_media_timestamp = 0
         last_assistant_item = None
-        mark_queue = []
-        response_start_timestamp_twilio = None
+        interrupted_items = set()  # Assistant items cut off by the caller; their late deltas are dropped
+        response_active = False
+        # Keeps the response audio with local VAD, to replay it if a barge-in is not confirmed
+        playout = PlayoutTracker(MARK_INTERVAL_MS, keep_audio=LOCAL_VAD)
+        pending_barge_in = None
+        barge_in_timer = None
+        awaiting_tool_response = False
+
+        # Readers only enqueue; one writer task per socket drains its queue, so a slow
+        # peer backs up its own queue instead of stalling the other direction
+        to_openai = RelayQueue('openai', RELAY_OPENAI_MAX_AUDIO)
+        to_twilio = RelayQueue('twilio', RELAY_TWILIO_MAX_AUDIO)
+
+        async def queue_openai_audio(message):
+            to_openai.put_audio(message)
+
+        # Optional inbound batching: one append per AUDIO_COALESCE_MS instead of one per 20 ms frame
+        coalescer = relay_codec.InboundCoalescer(queue_openai_audio, AUDIO_COALESCE_MS) if AUDIO_COALESCE_MS > 0 else None
+
+        local_vad = LocalVAD(min_energy_db=LOCAL_VAD_MIN_ENERGY_DB, start_frames=LOCAL_VAD_START_FRAMES) if LOCAL_VAD else None
+
+        # Latency and throughput for /metrics
+        call_metrics = metrics.CallMetrics()
+
+        recorder = CallRecorder(
+            os.path.join(RECORDINGS_DIR, f"{call_sid or stream_sid}.{RECORDING_FORMAT}"),
+            recording_pool, RECORDING_FORMAT, max_batches=RECORDING_MAX_BATCHES
+        ) if RECORD_CALLS else None
+
+        async def forward_inbound_audio(payload):
+            if recorder:
+                recorder.inbound(payload, latest_media_timestamp)
+            if local_vad:
+                audio = base64.b64decode(payload)
+                # Cut playback locally; the response is only cancelled once server_vad confirms
+                if (local_vad.process(audio) == 'speech_started' and pending_barge_in is None
+                        and (response_active or playout.has_unplayed())):
+                    logger.debug(f"Local VAD detected speech, pausing response with id: {last_assistant_item}")
+                    start_barge_in()
+            if coalescer and local_vad:
+                await coalescer.add_raw(audio)
+            elif coalescer:
+                await coalescer.add(payload)
+            else:
+                to_openai.put_audio(relay_codec.openai_append_message(payload))
 
         async def receive_from_twilio():
-            """Receive audio data from Twilio and send it to the OpenAI Realtime API."""
-            nonlocal stream_sid, latest_media_timestamp
+            """Receive audio data from Twilio and queue it for the OpenAI Realtime API."""
+            nonlocal stream_sid, call_sid, latest_media_timestamp, last_assistant_item
             try:
                 async for message in websocket.iter_text():
-                    data = json.loads(message)
+                    if FAST_RELAY and relay_codec.peek_twilio_event(message) == 'media':
+                        fields = relay_codec.twilio_media_fields(message)
+                        if fields:
+                            # Audio frames skip the full JSON decode
+                            latest_media_timestamp, payload = fields
+                            await forward_inbound_audio(payload)
+                            continue
+
+                    data = relay_codec.loads(message)
                     if data['event'] == 'media':
                         latest_media_timestamp = int(data['media']['timestamp'])
-                        audio_append = {
-                            "type": "input_audio_buffer.append",
-                            "audio": data['media']['payload']
-                        }
-                        await openai_ws.send(json.dumps(audio_append))
-                    elif data['event'] == 'start':
+                        await forward_inbound_audio(data['media']['payload'])
+                        continue
+
+                    # Control events must not overtake audio still sitting in the coalescer
+                    if coalescer:
+                        await coalescer.flush()
+
+                    if data['event'] == 'start':
                         stream_sid = data['start']['streamSid']
-                        print(f"Incoming stream has started {stream_sid}")
-                        response_start_timestamp_twilio = None
+                        call_sid = data['start'].get('callSid')
+                        bind_call(stream_sid=stream_sid, call_sid=call_sid)
+                        logger.info(f"Incoming stream has started {stream_sid}")
+                        playout.reset()
                         latest_media_timestamp = 0
                         last_assistant_item = None
                     elif data['event'] == 'mark':
-                        if mark_queue:
-                            mark_queue.pop(0)
-            except WebSocketDisconnect:
-                print("Client disconnected.")
-                if openai_ws.open:
-                    await openai_ws.close()
+                        playout.on_mark(data['mark']['name'], latest_media_timestamp)
+                    elif data['event'] == 'stop':
+                        logger.info("Twilio stopped the stream.")
+                        return
+                # Starlette ends iter_text quietly when the client goes away
+                logger.info("Client disconnected.")
+            finally:
+                if coalescer:
+                    coalescer.close()
 
-        async def send_to_twilio():
-            """Receive events from the OpenAI Realtime API, send audio back to Twilio."""
-            nonlocal stream_sid, last_assistant_item, response_start_timestamp_twilio
+        def forward_audio_delta(item_id, payload):
+            """Queue one response.audio.delta payload for Twilio untouched, or hold it during a local barge-in."""
+            if item_id in interrupted_items:
+                # Still streaming after the caller cut it off; it must not play after the clear
+                return
+            call_metrics.delta_received(item_id)
+            if pending_barge_in is not None:
+                pending_barge_in.hold(item_id, payload)
+                return
+            play_audio_delta(item_id, payload)
+
+        def play_audio_delta(item_id, payload):
+            nonlocal last_assistant_item
+            to_twilio.put_audio(relay_codec.twilio_media_message(stream_sid, payload))
+            if recorder:
+                recorder.outbound(payload, latest_media_timestamp)
+
+            if SHOW_TIMING_MATH and playout.start_timestamp is None:
+                logger.debug(f"Setting start timestamp for new response: {latest_media_timestamp}ms")
+
+            # Update last_assistant_item safely
+            if item_id:
+                last_assistant_item = item_id
+
+            # Marks go out every MARK_INTERVAL_MS of audio rather than after every delta
+            mark_name = playout.add_delta(item_id, payload, latest_media_timestamp)
+            if mark_name:
+                queue_mark(mark_name)
+
+        async def answer_function_call(event):
+            """Answer a knowledge base tool call in-process and hand the output back to the model."""
+            nonlocal awaiting_tool_response
+            name = event.get('name')
             try:
-                async for openai_message in openai_ws:
-                    response = json.loads(openai_message)
-                    if response['type'] in LOG_EVENT_TYPES:
-                        print(f"Received event: {response['type']}", response)
-
-                    if response.get('type') == 'response.audio.delta' and 'delta' in response:
-                        audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
-                        audio_delta = {
-                            "event": "media",
-                            "streamSid": stream_sid,
-                            "media": {
-                                "payload": audio_payload
-                            }
-                        }
-                        await websocket.send_json(audio_delta)
-
-                        if response_start_timestamp_twilio is None:
-                            response_start_timestamp_twilio = latest_media_timestamp
-                            if SHOW_TIMING_MATH:
-                                print(f"Setting start timestamp for new response: {response_start_timestamp_twilio}ms")
-
-                        # Update last_assistant_item safely
-                        if response.get('item_id'):
-                            last_assistant_item = response['item_id']
-
-                        await send_mark(websocket, stream_sid)
-
-                    # Trigger an interruption. Your use case might work better using `input_audio_buffer.speech_stopped`, or combining the two.
-                    if response.get('type') == 'input_audio_buffer.speech_started':
-                        print("Speech started detected.")
-                        if last_assistant_item:
-                            print(f"Interrupting response with id: {last_assistant_item}")
-                            await handle_speech_started_event()
+                if name in booking.TOOL_NAMES:
+                    output = await booking_engine.call(name, event.get('arguments'), call_sid, config.key)
+                else:
+                    output = config.engine.call(name, event.get('arguments'))
+                    if name == 'slots' and 'slots' in output:
+                        # Only offer slots nobody else holds or has booked
+                        output['slots'] = [s for s in output['slots'] if booking_engine.is_available(output['unit'], s['start'], config.key)]
+                    elif name == 'unit_details' and 'next_tour_slots' in output:
+                        output['next_tour_slots'] = config.engine.next_tour_slots(
+                            output['unit'], lambda start: booking_engine.is_available(output['unit'], start, config.key))
             except Exception as e:
-                print(f"Error in send_to_twilio: {e}")
-
-        async def handle_speech_started_event():
-            """Handle interruption when the caller's speech starts."""
-            nonlocal response_start_timestamp_twilio, last_assistant_item
-            print("Handling speech started event.")
-            if mark_queue and response_start_timestamp_twilio is not None:
-                elapsed_time = latest_media_timestamp - response_start_timestamp_twilio
+                # A failed tool call must not end the call; the model gets the error instead
+                logger.error(f"❌ Tool call {name} failed: {e!r}")
+                output = {'error': f"{name} failed: {e}"}
+            to_openai.put_control(json.dumps({
+                "type": "conversation.item.create",
+                "item": {
+                    "type": "function_call_output",
+                    "call_id": event.get('call_id'),
+                    "output": json.dumps(output)
+                }
+            }))
+            # response.create must wait until the response that made the call is done
+            awaiting_tool_response = True
+
+        async def send_to_twilio():
+            """Receive events from the OpenAI Realtime API and queue audio back to Twilio."""
+            nonlocal awaiting_tool_response, response_active
+            async for openai_message in openai_ws:
+                if FAST_RELAY and relay_codec.peek_openai_type(openai_message) == 'response.audio.delta':
+                    fields = relay_codec.openai_delta_fields(openai_message)
+                    if fields:
+                        forward_audio_delta(*fields)
+                        if to_twilio.crowded:
+                            # A burst is already buffered in the socket; let the Twilio writer run
+                            await asyncio.sleep(0)
+                        continue
+
+                response = relay_codec.loads(openai_message)
+                event_type = response['type']
+                if event_type == 'error':
+                    logger.warning(f"OpenAI error event: {truncate(response)}")
+                elif event_type in LOG_EVENT_TYPES and logger.isEnabledFor(logging.DEBUG) and event_log_sampler.allow(event_type):
+                    # Sampled and truncated: rate_limits.updated and response.done arrive every turn
+                    suppressed = event_log_sampler.suppressed(event_type)
+                    logger.debug(f"Received event: {event_type} {truncate(response)}"
+                                 + (f" ({suppressed} similar suppressed)" if suppressed else ""))
+
+                if response.get('type') == 'response.audio.delta' and 'delta' in response:
+                    forward_audio_delta(response.get('item_id'), response['delta'])
+                    if to_twilio.crowded:
+                        await asyncio.sleep(0)
+
+                if event_type == 'response.created':
+                    response_active = True
+                elif event_type == 'response.done':
+                    response_active = False
+                    interrupted_items.clear()
+
+                if event_type == 'rate_limits.updated':
+                    admission.observe_rate_limits(response.get('rate_limits', []))
+
+                if response.get('type') == 'response.function_call_arguments.done':
+                    await answer_function_call(response)
+
+                if response.get('type') == 'response.done' and response.get('response', {}).get('status') == 'failed':
+                    # Answer from the clip cache rather than leave the caller in silence
+                    clip = 'unknown_question' if awaiting_tool_response else 'didnt_catch'
+                    awaiting_tool_response = False
+                    if clip_cache.has(clip):
+                        play_clip(clip)
+                elif response.get('type') == 'response.done' and awaiting_tool_response:
+                    # Tool outputs are in the conversation; let the model speak the answer
+                    awaiting_tool_response = False
+                    to_openai.put_control(json.dumps({"type": "response.create"}))
+
+                if response.get('type') == 'response.audio.done':
+                    mark_name = playout.finish()
+                    if mark_name:
+                        queue_mark(mark_name)
+
+                if response.get('type') == 'input_audio_buffer.speech_stopped':
+                    call_metrics.speech_stopped()
+
+                # Trigger an interruption. Your use case might work better using `input_audio_buffer.speech_stopped`, or combining the two.
+                if response.get('type') == 'input_audio_buffer.speech_started':
+                    logger.debug("Speech started detected.")
+                    if pending_barge_in is not None:
+                        confirm_barge_in()
+                    elif last_assistant_item or playout.has_unplayed():
+                        logger.debug(f"Interrupting response with id: {last_assistant_item}")
+                        handle_speech_started_event()
+            logger.info("OpenAI closed the realtime session.")
+
+        def start_barge_in():
+            """Clear Twilio playback for a local VAD barge-in, holding new audio until server_vad confirms it."""
+            nonlocal pending_barge_in, barge_in_timer
+            pending_barge_in = PendingBargeIn(playout, latest_media_timestamp)
+            if pending_barge_in.had_unplayed:
+                call_metrics.speech_started()
+                clear_playback()
+            barge_in_timer = asyncio.get_running_loop().call_later(LOCAL_VAD_CONFIRM_MS / 1000, resume_playback)
+
+        def confirm_barge_in():
+            """server_vad heard the caller too: cancel and truncate the response that was paused."""
+            nonlocal pending_barge_in, last_assistant_item, response_active
+            barge_in = pending_barge_in
+            pending_barge_in = None
+            barge_in_timer.cancel()
+            if response_active:
+                # Otherwise the rest of the response keeps streaming in
+                to_openai.put_control(json.dumps({"type": "response.cancel"}))
+                response_active = False
+            if barge_in.item_id and barge_in.had_unplayed:
+                to_openai.put_control(json.dumps({
+                    "type": "conversation.item.truncate",
+                    "item_id": barge_in.item_id,
+                    "content_index": 0,
+                    "audio_end_ms": barge_in.audio_end_ms
+                }))
+            interrupted_items.update({barge_in.item_id, last_assistant_item, *barge_in.held_items()} - {None})
+            last_assistant_item = None
+
+        def resume_playback():
+            """No confirmation from server_vad in time: play what the caller missed and carry on."""
+            nonlocal pending_barge_in
+            barge_in = pending_barge_in
+            pending_barge_in = None
+            logger.debug(f"Local barge-in not confirmed, resuming response with id: {barge_in.item_id}")
+            if barge_in.unplayed_audio:
+                playout.resume(barge_in.item_id, barge_in.audio_end_ms, barge_in.played_audio, latest_media_timestamp)
+            for item_id, payload in barge_in.replay():
+                if item_id not in interrupted_items:
+                    play_audio_delta(item_id, payload)
+            if not response_active:
+                mark_name = playout.finish()
+                if mark_name:
+                    queue_mark(mark_name)
+
+        def handle_speech_started_event():
+            """Handle interruption when the caller's speech starts; server_vad cancels the response itself."""
+            nonlocal last_assistant_item
+            logger.debug("Handling speech started event.")
+            if playout.has_unplayed():
+                # Timed only when there is audio to clear, until the writer actually sends the clear
+                call_metrics.speech_started()
+                # Cut at what Twilio has confirmed playing, not at what we have sent
+                elapsed_time = playout.played_position(latest_media_timestamp)
                 if SHOW_TIMING_MATH:
-                    print(f"Calculating elapsed time for truncation: {latest_media_timestamp} - {response_start_timestamp_twilio} = {elapsed_time}ms")
+                    logger.debug(f"Calculating played position for truncation: confirmed {playout.played_ms}ms of {playout.sent_ms}ms sent, now {elapsed_time}ms")
 
                 if last_assistant_item:
                     if SHOW_TIMING_MATH:
-                        print(f"Truncating item with ID: {last_assistant_item}, Truncated at: {elapsed_time}ms")
+                        logger.debug(f"Truncating item with ID: {last_assistant_item}, Truncated at: {elapsed_time}ms")
 
                     truncate_event = {
                         "type": "conversation.item.truncate",
@@ -620,28 +923,114 @@ async def handle_media_stream(websocket: WebSocket):
                         "content_index": 0,
                         "audio_end_ms": elapsed_time
                     }
-                    await openai_ws.send(json.dumps(truncate_event))
+                    to_openai.put_control(json.dumps(truncate_event))
+                    interrupted_items.add(last_assistant_item)
 
-                await websocket.send_json({
-                    "event": "clear",
-                    "streamSid": stream_sid
-                })
-
-                mark_queue.clear()
+                clear_playback()
                 last_assistant_item = None
-                response_start_timestamp_twilio = None
 
-        async def send_mark(connection, stream_sid):
+        def clear_playback():
+            # Audio still queued for Twilio would play after the clear
+            to_twilio.discard_audio()
+            to_twilio.put_control(json.dumps({
+                "event": "clear",
+                "streamSid": stream_sid
+            }), on_sent=call_metrics.cleared)
+            if recorder:
+                recorder.clear(latest_media_timestamp)
+            playout.reset()
+
+        def queue_mark(name):
             if stream_sid:
                 mark_event = {
                     "event": "mark",
                     "streamSid": stream_sid,
-                    "mark": {"name": "responsePart"}
+                    "mark": {"name": name}
+                }
+                to_twilio.put_control(json.dumps(mark_event))
+
+        def play_clip(name, payloads=None):
+            """Play a cached clip to the caller and add it to the conversation as said by the assistant.
+
+            `payloads` are chunks already sent to Twilio, as for the greeting.
+            """
+            for payload in payloads if payloads is not None else clip_cache.chunks(name):
+                if payloads is None:
+                    to_twilio.put_audio(relay_codec.twilio_media_message(stream_sid, payload))
+                if recorder:
+                    recorder.outbound(payload, latest_media_timestamp)
+                # Tracked like a response so the caller can interrupt it
+                mark_name = playout.add_delta(f"clip:{name}", payload, latest_media_timestamp)
+                if mark_name:
+                    queue_mark(mark_name)
+            mark_name = playout.finish()
+            if mark_name:
+                queue_mark(mark_name)
+            to_openai.put_control(json.dumps({
+                "type": "conversation.item.create",
+                "item": {
+                    "type": "message",
+                    "role": "assistant",
+                    "content": [{"type": "text", "text": clip_cache.text(name)}]
                 }
-                await connection.send_json(mark_event)
-                mark_queue.append('responsePart')
+            }))
+
+        async def on_knowledge_reload(new_snapshot):
+            """Move this live call onto its property's reloaded entry, if that entry changed."""
+            nonlocal config
+            current = new_snapshot.properties.get(config.key)
+            if current is not None and current is not config:
+                config = current
+                to_openai.put_control(config.session_update)
+
+        if greeting:
+            play_clip(greeting_name, greeting)
+
+        if KB_RELOAD_UPDATE_ACTIVE:
+            kb_watcher.subscribers.add(on_knowledge_reload)
+        admission.session_started(call_sid)
+        try:
+            # Whichever side ends first (hangup, OpenAI close, socket error) ends the call
+            await run_relay(
+                receive_from_twilio=receive_from_twilio(),
+                send_to_twilio=send_to_twilio(),
+                openai_writer=pump(to_openai, openai_ws.send,
+                                   lambda started: call_metrics.inbound_sent(started, openai_ws.transport),
+                                   RELAY_STALL_MS / 1000),
+                twilio_writer=pump(to_twilio, websocket.send_text, call_metrics.outbound_sent, RELAY_STALL_MS / 1000),
+            )
+        finally:
+            if barge_in_timer:
+                barge_in_timer.cancel()
+            admission.session_ended()
+            kb_watcher.subscribers.discard(on_knowledge_reload)
+            to_openai.close()
+            to_twilio.close()
+            if recorder:
+                # Finishes writing in the pool; the call does not wait for it
+                recorder.close()
+                if recorder.dropped_frames:
+                    logger.warning(f"Recording fell behind and dropped {recorder.dropped_frames} frames")
+            await close_twilio_stream(websocket)
+            logger.info(f"📴 Call ended: {call_metrics.finish()}, dropped {to_openai.dropped}/{to_twilio.dropped} "
+                        f"and stalled {to_openai.stalls}/{to_twilio.stalls} times to OpenAI/Twilio")
+    # Leaving `async with` closed the OpenAI socket
+
+async def close_twilio_stream(websocket):
+    """Close the Twilio side of a media stream unless it is already closed."""
+    if websocket.client_state == WebSocketState.CONNECTED and websocket.application_state == WebSocketState.CONNECTED:
+        try:
+            await websocket.close()
+        except (RuntimeError, OSError):
+            pass
 
-        await asyncio.gather(receive_from_twilio(), send_to_twilio())
+async def wait_for_stream_start(websocket):
+    """Read Twilio's stream events up to 'start'. Returns its payload, or None if the stream closed first."""
+    async for message in websocket.iter_text():
+        data = relay_codec.loads(message)
+        if data.get('event') == 'start':
+            return data['start']
+    return None
 
 async def send_initial_conversation_item(openai_ws):
     """Send initial conversation item if AI talks first."""
@@ -662,22 +1051,10 @@ async def send_initial_conversation_item(openai_ws):
     await openai_ws.send(json.dumps({"type": "response.create"}))
 
 
-async def initialize_session(openai_ws):
+async def initialize_session(openai_ws, config):
     """Control initial session with OpenAI."""
-    session_update = {
-        "type": "session.update",
-        "session": {
-            "turn_detection": {"type": "server_vad"},
-            "input_audio_format": "g711_ulaw",
-            "output_audio_format": "g711_ulaw",
-            "voice": VOICE,
-            "instructions": SYSTEM_MESSAGE,
-            "modalities": ["text", "audio"],
-            "temperature": 0.8,
-        }
-    }
-    print('Sending session update:', json.dumps(session_update))
-    await openai_ws.send(json.dumps(session_update))
+    logger.debug(f'Sending session update for {config.key}')
+    await openai_ws.send(config.session_update)
 
     # Uncomment the next line to have the AI speak first
     # await send_initial_conversation_item(openai_ws)
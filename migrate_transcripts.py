@@ -0,0 +1,78 @@
+"""Import an existing transcription.json into the SQLite transcript store.
+
+    python migrate_transcripts.py [transcription.json] [transcripts.db] [--state transcription_state.json]
+
+Records are inserted in file order, in batches of one transaction each.
+Calls the JSONL ingestor had already handed out (listed in its processed log)
+are marked processed, so their leads are not created again. Calls that had
+ended but were never processed are left 'ended' and get their leads on the
+next app start.
+"""
+import sys
+import json
+import time
+import argparse
+
+from transcript_store import SQLiteTranscriptStore
+from transcripts import processed_log_path, read_processed_log
+
+
+def read_records(path):
+    with open(path, 'r') as file:
+        for line_num, line in enumerate(file, 1):
+            line = line.strip()
+            if len(line) <= 5:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"   Line {line_num}: skipping malformed record - {e}")
+
+
+def migrate(source, db_path, state_path=None, batch_size=1000, force=False):
+    store = SQLiteTranscriptStore(db_path, fsync_policy='none')
+    store.open()
+    try:
+        if store.counts() and not force:
+            print(f"❌ {db_path} already holds conversations; pass --force to import anyway")
+            return False
+
+        started = time.perf_counter()
+        imported = 0
+        batch = []
+        for record in read_records(source):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                store.write_batch(batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            store.write_batch(batch)
+            imported += len(batch)
+
+        done = read_processed_log(processed_log_path(state_path)) if state_path else set()
+        for sid in done:
+            store.mark_processed(sid, 'migrated')
+
+        elapsed = time.perf_counter() - started
+        print(f"✅ Imported {imported} records in {elapsed:.2f} s ({imported / max(elapsed, 1e-9):.0f}/s)")
+        print(f"   Conversations by status: {store.counts()}")
+        return True
+    finally:
+        store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('source', nargs='?', default='transcription.json')
+    parser.add_argument('db', nargs='?', default='transcripts.db')
+    parser.add_argument('--state', default='transcription_state.json',
+                        help="JSONL ingest state listing already processed SIDs")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--force', action='store_true', help="Import into a database that already has data")
+    args = parser.parse_args(argv)
+    return 0 if migrate(args.source, args.db, args.state, args.batch_size, args.force) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import base64
+from collections import deque
+
+
+def base64_decoded_length(payload):
+    """Number of bytes a base64 string decodes to, without decoding it."""
+    padding = 2 if payload.endswith('==') else 1 if payload.endswith('=') else 0
+    return len(payload) * 3 // 4 - padding
+
+
+class PlayoutTracker:
+    """Track how much of the current assistant response Twilio has actually played.
+
+    Every audio delta advances the sent position (8 bytes per ms of mu-law).
+    Instead of a mark per delta, a mark is requested every `mark_interval_ms`
+    of audio and at the end of the response; its name encodes the offset it
+    sits at. When Twilio echoes a mark, that offset is confirmed as played,
+    and playback since then is extrapolated from the inbound media clock.
+    With `keep_audio` the response's audio is kept too, so what the caller
+    has not heard yet can be played again (see PendingBargeIn).
+    """
+
+    def __init__(self, mark_interval_ms=200, bytes_per_ms=8, keep_audio=False):
+        self.mark_interval_ms = mark_interval_ms
+        self.bytes_per_ms = bytes_per_ms
+        self.keep_audio = keep_audio
+        self.reset()
+
+    def reset(self):
+        self.item_id = None
+        self.sent_bytes = 0
+        self.played_ms = 0
+        self.start_timestamp = None
+        self.ack_timestamp = None
+        self.last_mark_ms = 0
+        self.pending = deque()
+        self.audio = bytearray()
+
+    @property
+    def sent_ms(self):
+        return self.sent_bytes // self.bytes_per_ms
+
+    def _mark(self):
+        offset = self.sent_ms
+        name = f"{self.item_id}@{offset}"
+        self.pending.append((name, offset))
+        self.last_mark_ms = offset
+        return name
+
+    def add_delta(self, item_id, payload, media_timestamp):
+        """Record one audio delta. Returns a mark name to send, or None."""
+        if item_id != self.item_id:
+            self.reset()
+            self.item_id = item_id
+        if self.start_timestamp is None:
+            self.start_timestamp = media_timestamp
+        if self.keep_audio:
+            self.audio += base64.b64decode(payload)
+        self.sent_bytes += base64_decoded_length(payload)
+        if self.sent_ms - self.last_mark_ms >= self.mark_interval_ms:
+            return self._mark()
+        return None
+
+    def finish(self):
+        """Response audio is complete. Returns a final mark name, or None if already marked."""
+        if self.item_id is not None and self.sent_ms > self.last_mark_ms:
+            return self._mark()
+        return None
+
+    def on_mark(self, name, media_timestamp):
+        """Confirm a mark echoed by Twilio. Marks from a cleared response are ignored."""
+        if not any(pending_name == name for pending_name, _ in self.pending):
+            return
+        while self.pending:
+            pending_name, offset = self.pending.popleft()
+            if pending_name == name:
+                self.played_ms = offset
+                self.ack_timestamp = media_timestamp
+                return
+
+    def has_unplayed(self):
+        return self.item_id is not None and self.sent_ms > self.played_ms
+
+    def played_position(self, media_timestamp):
+        """Best estimate, in ms, of how far into the response the caller has heard."""
+        if self.ack_timestamp is not None:
+            position = self.played_ms + (media_timestamp - self.ack_timestamp)
+        elif self.start_timestamp is not None:
+            position = media_timestamp - self.start_timestamp
+        else:
+            position = 0
+        return max(self.played_ms, min(self.sent_ms, position))
+
+    def resume(self, item_id, position_ms, audio, media_timestamp):
+        """Track `item_id` again from `position_ms` after a clear; `audio` is what was played up to there."""
+        self.reset()
+        self.item_id = item_id
+        self.sent_bytes = position_ms * self.bytes_per_ms
+        self.played_ms = self.last_mark_ms = position_ms
+        self.start_timestamp = media_timestamp - position_ms
+        if self.keep_audio:
+            self.audio = bytearray(audio)
+
+
+class PendingBargeIn:
+    """A local VAD barge-in that the realtime server has not confirmed yet.
+
+    Playback is cleared as soon as the caller seems to speak, but a cough
+    or an "mm-hm" must not cost the assistant its reply, so the response is
+    only cancelled and truncated once server_vad agrees. Until then audio
+    deltas are held here; if it never agrees, `replay()` gives back the audio
+    the caller did not hear, followed by the held deltas.
+    """
+
+    def __init__(self, playout, media_timestamp):
+        """Snapshot what `playout` has sent and played, before it is reset for the clear."""
+        self.item_id = playout.item_id
+        self.audio_end_ms = playout.played_position(media_timestamp)
+        self.had_unplayed = playout.has_unplayed()
+        split = self.audio_end_ms * playout.bytes_per_ms
+        self.played_audio = bytes(playout.audio[:split])
+        self.unplayed_audio = bytes(playout.audio[split:])
+        self.held = []  # (item_id, payload)
+
+    def hold(self, item_id, payload):
+        self.held.append((item_id, payload))
+
+    def held_items(self):
+        return {item_id for item_id, _ in self.held if item_id}
+
+    def replay(self, chunk_bytes=1600):
+        """(item_id, base64 payload) to send, in order: the unheard audio in chunks, then the held deltas."""
+        for start in range(0, len(self.unplayed_audio), chunk_bytes):
+            yield self.item_id, base64.b64encode(self.unplayed_audio[start:start + chunk_bytes]).decode()
+        yield from self.held
@@ -0,0 +1,136 @@
+import time
+import asyncio
+import logging
+import importlib.util
+
+import httpx
+
+from metrics import LEAD_POST
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 keep-alive without it
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+DEFAULT_HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+    'User-Agent': 'FastAPI-Voice-Assistant/1.0'
+}
+
+
+class RailsClient:
+    """Long-lived pooled HTTP client for posting leads to the Rails server.
+
+    One instance lives for the app lifespan so connections are reused across
+    leads. A semaphore caps the number of requests in flight. With a
+    batch_window_ms > 0, leads arriving within the window are gathered and
+    posted together to the bulk endpoint.
+    """
+
+    def __init__(self, base_url, max_connections=20, max_concurrency=10, timeout=10.0,
+                 batch_window_ms=0, batch_max=100, bulk_path='/leads/bulk'):
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.batch_window = batch_window_ms / 1000
+        self.batch_max = batch_max
+        self.bulk_path = bulk_path
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+        self._pending = []
+        self._flush_task = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=HTTP2_AVAILABLE,
+            headers=DEFAULT_HEADERS,
+            timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            )
+        )
+
+    async def close(self):
+        if self._pending:
+            await self._flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, path, payload, headers=None):
+        if self._client is None:
+            await self.start()
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self._client.post(path, json=payload, headers=headers)
+            except httpx.HTTPError:
+                LEAD_POST.labels('error').observe(time.perf_counter() - started)
+                raise
+            LEAD_POST.labels(f"{response.status_code // 100}xx").observe(time.perf_counter() - started)
+            return response
+
+    async def create_lead(self, payload, idempotency_key=None):
+        """Post one lead payload. Returns True when Rails accepted it.
+
+        The idempotency key is sent as an Idempotency-Key header, or as an
+        `idempotency_key` field on each lead in bulk mode.
+        """
+        if self.batch_window > 0:
+            if idempotency_key:
+                payload = {'lead': {**payload['lead'], 'idempotency_key': idempotency_key}}
+            return await self._enqueue(payload)
+
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+        try:
+            response = await self._post('/leads', payload, headers)
+        except httpx.HTTPError as e:
+            logger.error(f"❌ Error creating lead in Rails: {e!r}")
+            return False
+
+        if response.status_code in [200, 201]:
+            logger.info(f"✅ Lead created successfully in Rails ({response.status_code})")
+            return True
+        logger.error(f"❌ Failed to create lead: {response.status_code} - {response.text[:200]}")
+        return False
+
+    async def _enqueue(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.batch_max:
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        leads = [payload['lead'] for payload, _ in batch]
+        try:
+            response = await self._post(self.bulk_path, {'leads': leads})
+            ok = response.status_code in [200, 201]
+            if ok:
+                logger.info(f"✅ {len(batch)} leads created in Rails via {self.bulk_path}")
+            else:
+                logger.error(f"❌ Bulk lead post failed: {response.status_code} - {response.text[:200]}")
+        except httpx.HTTPError as e:
+            logger.error(f"❌ Error posting lead batch to Rails: {e!r}")
+            ok = False
+
+        for _, future in batch:
+            if not future.done():
+                future.set_result(ok)
@@ -0,0 +1,117 @@
+import time
+import json
+import asyncio
+import logging
+
+from websockets.protocol import State
+
+logger = logging.getLogger(__name__)
+
+
+class RealtimeSessionPool:
+    """OpenAI realtime sessions opened at /incoming-call and parked per CallSid.
+
+    `warm()` starts connecting and sends the property's session.update while
+    Twilio is still playing the TwiML prompts, so `claim()` from
+    /media-stream usually gets a configured socket without any round trip.
+    At most `max_sessions` are parked at once; a session that is not claimed
+    within `ttl` seconds (caller hung up, or the stream landed on another
+    worker) is closed.
+    """
+
+    def __init__(self, connect, max_sessions=20, ttl=30.0, ready_timeout=5.0):
+        self.connect = connect  # async () -> websocket
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.ready_timeout = ready_timeout
+        self.sessions = {}  # call_sid -> (task, created_at)
+        self.stats = {'warmed': 0, 'claimed': 0, 'missed': 0, 'expired': 0, 'rejected': 0, 'failed': 0}
+        self._reaper = None
+
+    def warm(self, call_sid, config):
+        """Start opening a session for `call_sid` with a PropertyConfig. Returns False if it was not started."""
+        if not call_sid or self.max_sessions <= 0 or call_sid in self.sessions:
+            return False
+        if len(self.sessions) >= self.max_sessions:
+            self.stats['rejected'] += 1
+            return False
+        self.sessions[call_sid] = (asyncio.create_task(self._open(config)), time.monotonic())
+        self.stats['warmed'] += 1
+        return True
+
+    async def _open(self, config):
+        openai_ws = await self.connect()
+        try:
+            await openai_ws.send(config.session_update)
+            # Wait until the configuration is applied, so the claimed socket is ready for audio
+            await asyncio.wait_for(self._until_configured(openai_ws), self.ready_timeout)
+        except BaseException:
+            await openai_ws.close()
+            raise
+        return openai_ws, config
+
+    @staticmethod
+    async def _until_configured(openai_ws):
+        async for message in openai_ws:
+            event = json.loads(message)
+            if event.get('type') == 'session.updated':
+                return
+            if event.get('type') == 'error':
+                raise RuntimeError(f"session.update rejected: {event.get('error')}")
+
+    async def claim(self, call_sid):
+        """Take the parked (websocket, config) for a call, waiting if it is still opening.
+
+        Returns None if there is no usable session; the caller connects cold.
+        """
+        entry = self.sessions.pop(call_sid, None) if call_sid else None
+        if entry is None:
+            self.stats['missed'] += 1
+            return None
+        task, _ = entry
+        try:
+            openai_ws, config = await task
+        except Exception as e:
+            logger.warning(f"Pre-warmed realtime session for {call_sid} failed: {e!r}")
+            self.stats['failed'] += 1
+            return None
+        if openai_ws.state is not State.OPEN:
+            self.stats['failed'] += 1
+            return None
+        self.stats['claimed'] += 1
+        return openai_ws, config
+
+    async def _discard(self, task):
+        task.cancel()
+        try:
+            openai_ws, _ = await task
+        except BaseException:
+            return
+        await openai_ws.close()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(min(self.ttl, 1.0))
+            now = time.monotonic()
+            for call_sid, (task, created_at) in list(self.sessions.items()):
+                if now - created_at >= self.ttl:
+                    del self.sessions[call_sid]
+                    self.stats['expired'] += 1
+                    await self._discard(task)
+
+    def start(self):
+        self._reaper = asyncio.create_task(self._reap())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        sessions, self.sessions = self.sessions, {}
+        await asyncio.gather(*(self._discard(task) for task, _ in sessions.values()))
+
+    def status(self):
+        return {'parked': len(self.sessions), 'max_sessions': self.max_sessions, 'ttl': self.ttl, **self.stats}
@@ -0,0 +1,154 @@
+"""Fast paths for the Twilio <-> OpenAI audio relay.
+
+Audio frames make up almost all relay traffic, so they skip full JSON
+decoding: the event type and base64 payload are sliced out of the raw text
+and spliced into pre-serialized templates, untouched. Anything that does
+not match the expected compact layout falls back to a full decode.
+"""
+import json
+import base64
+import asyncio
+
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    JSON_CODEC = 'orjson'
+except ImportError:
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+    JSON_CODEC = 'json'
+
+TWILIO_MEDIA_TEMPLATE = '{"event":"media","streamSid":"%s","media":{"payload":"%s"}}'
+OPENAI_APPEND_TEMPLATE = '{"type":"input_audio_buffer.append","audio":"%s"}'
+
+_TWILIO_PREFIX = '{"event":"'
+_OPENAI_PREFIX = '{"type":"'
+_TIMESTAMP = '"timestamp":"'
+_PAYLOAD = '"payload":"'
+_DELTA = '"delta":"'
+_ITEM_ID = '"item_id":"'
+
+
+def _string_field(message, marker, start=0):
+    """Return the string value following `marker` (e.g. '"key":"') in compact JSON, or None."""
+    begin = message.find(marker, start)
+    if begin < 0:
+        return None
+    begin += len(marker)
+    end = message.find('"', begin)
+    if end < 0:
+        return None
+    return message[begin:end]
+
+
+def _leading_value(message, prefix):
+    # Only trust the first key: nested objects may carry their own "type"
+    if not message.startswith(prefix):
+        return None
+    end = message.find('"', len(prefix))
+    return message[len(prefix):end] if end > 0 else None
+
+
+def peek_twilio_event(message):
+    """Event name of a Twilio Media Streams message without decoding it, or None."""
+    return _leading_value(message, _TWILIO_PREFIX)
+
+
+def peek_openai_type(message):
+    """Type of an OpenAI realtime event without decoding it, or None."""
+    return _leading_value(message, _OPENAI_PREFIX)
+
+
+def twilio_media_fields(message):
+    """(timestamp_ms, payload) from a Twilio media message, or None if not in the fast layout."""
+    media_at = message.find('"media":{')
+    if media_at < 0:
+        return None
+    timestamp = _string_field(message, _TIMESTAMP, media_at)
+    payload = _string_field(message, _PAYLOAD, media_at)
+    if timestamp is None or payload is None or '\\' in payload:
+        return None
+    return int(timestamp), payload
+
+
+def openai_delta_fields(message):
+    """(item_id, delta) from a response.audio.delta event, or None if not in the fast layout."""
+    delta = _string_field(message, _DELTA)
+    if delta is None or '\\' in delta:
+        return None
+    return _string_field(message, _ITEM_ID), delta
+
+
+def twilio_media_message(stream_sid, payload):
+    """Serialized Twilio `media` message carrying an already base64-encoded payload."""
+    return TWILIO_MEDIA_TEMPLATE % (stream_sid, payload)
+
+
+def openai_append_message(payload):
+    """Serialized `input_audio_buffer.append` carrying an already base64-encoded payload."""
+    return OPENAI_APPEND_TEMPLATE % payload
+
+
+class InboundCoalescer:
+    """Buffer inbound mu-law audio and forward it as fewer, larger appends.
+
+    Twilio sends one 20 ms frame per message. Frames are decoded into a raw
+    byte buffer (base64 chunks cannot simply be concatenated) and sent as a
+    single input_audio_buffer.append once `window_ms` of audio is buffered,
+    when the window timer fires, or when flush() is called explicitly.
+    """
+
+    def __init__(self, send, window_ms, bytes_per_ms=8):
+        self.send = send
+        self.window = window_ms / 1000
+        self.max_bytes = window_ms * bytes_per_ms  # 8 kHz, 8-bit mu-law
+        self.messages_in = 0
+        self.messages_out = 0
+        self._buffer = bytearray()
+        self._timer = None
+        self._timer_flush = None
+
+    async def add(self, payload):
+        await self.add_raw(base64.b64decode(payload))
+
+    async def add_raw(self, audio):
+        """Buffer already-decoded mu-law bytes."""
+        self._buffer += audio
+        self.messages_in += 1
+        if len(self._buffer) >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        if self._buffer:
+            self._timer_flush = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Send whatever audio is buffered now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        audio = base64.b64encode(self._buffer).decode()
+        self._buffer = bytearray()
+        self.messages_out += 1
+        await self.send(openai_append_message(audio))
+
+    def close(self):
+        """Drop the pending timer; buffered audio is discarded."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._buffer = bytearray()
@@ -0,0 +1,132 @@
+"""Bounded queues and task lifecycle for the Twilio <-> OpenAI media bridge.
+
+Each direction of a call has a RelayQueue drained by its own writer task
+(`pump`), so a slow peer only backs up its own queue: the reader on the
+other side never waits on a socket send. Audio is bounded and the oldest
+audio is dropped on overflow, since late audio is worse than lost audio in
+a live call; control events (marks, clears, truncates, tool outputs) are
+never dropped. `run_relay` runs a call's tasks until the first one ends
+and then cancels the rest, so a hangup on either side tears the call down.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+
+from metrics import QUEUE_DEPTH, RELAY_DROPPED, RELAY_STALLS
+
+logger = logging.getLogger(__name__)
+
+
+class RelayQueue:
+    """FIFO of outgoing messages for one socket, holding at most `max_audio` audio messages."""
+
+    def __init__(self, direction, max_audio):
+        self.direction = direction
+        self.max_audio = max_audio
+        self.dropped = 0  # Audio messages dropped on overflow
+        self.stalls = 0  # Sends slower than the stall threshold
+        self._items = deque()  # (is_audio, message, on_sent)
+        self._audio = 0
+        self._ready = asyncio.Event()
+        self._depth = QUEUE_DEPTH.labels(f"relay_to_{direction}")
+        self._drops = RELAY_DROPPED.labels(direction)
+        self._stalls = RELAY_STALLS.labels(direction)
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def crowded(self):
+        """Half full of audio; the producer should yield so the writer can catch up."""
+        return self._audio * 2 >= self.max_audio
+
+    def put_audio(self, message):
+        if self._audio >= self.max_audio:
+            self._drop_oldest_audio()
+        self._items.append((True, message, None))
+        self._audio += 1
+        self._depth.inc()
+        self._ready.set()
+
+    def put_control(self, message, on_sent=None):
+        """Queue a control event. `on_sent()` is called once the writer has sent it."""
+        self._items.append((False, message, on_sent))
+        self._depth.inc()
+        self._ready.set()
+
+    def _drop_oldest_audio(self):
+        # Control events are rare, so the oldest audio is almost always at the front
+        for index, (is_audio, _, _) in enumerate(self._items):
+            if is_audio:
+                del self._items[index]
+                self._audio -= 1
+                self._depth.dec()
+                self.dropped += 1
+                self._drops.inc()
+                return
+
+    def discard_audio(self):
+        """Drop all queued audio, keeping control events in order. Returns how many were dropped."""
+        count = self._audio
+        if count:
+            self._items = deque(item for item in self._items if not item[0])
+            self._audio = 0
+            self._depth.dec(count)
+        return count
+
+    async def get(self):
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        item = self._items.popleft()
+        if item[0]:
+            self._audio -= 1
+        self._depth.dec()
+        return item
+
+    def close(self):
+        """Forget whatever is still queued."""
+        self._depth.dec(len(self._items))
+        self._items.clear()
+        self._audio = 0
+
+    def stalled(self):
+        self.stalls += 1
+        self._stalls.inc()
+
+
+async def pump(queue, send, on_audio_sent=None, stall_after=0.1):
+    """Send queued messages in order until cancelled.
+
+    `on_audio_sent(send_started)` is called after each audio message, with
+    the perf_counter() taken before sending it, and a control event's own
+    `on_sent()` after that event.
+    """
+    while True:
+        is_audio, message, on_sent = await queue.get()
+        started = time.perf_counter()
+        await send(message)
+        if time.perf_counter() - started > stall_after:
+            queue.stalled()
+        if is_audio and on_audio_sent is not None:
+            on_audio_sent(started)
+        elif on_sent is not None:
+            on_sent()
+
+
+async def run_relay(**coros):
+    """Run named coroutines until the first returns or fails, then cancel the others and wait for them."""
+    tasks = {asyncio.ensure_future(coro): name for name, coro in coros.items()}
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        if not task.cancelled() and task.exception() is not None:
+            logger.info(f"Relay ended by {tasks[task]}: {task.exception()!r}")
+        else:
+            logger.debug(f"Relay ended by {tasks[task]}")
+    return tasks[next(iter(done))]
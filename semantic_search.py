@@ -0,0 +1,214 @@
+"""Model-free semantic search over a property's units, floor plans and amenities.
+
+Text is embedded with signed hashed character n-grams plus whole words,
+weighted by IDF, into a fixed-size float32 vector. Document vectors are
+stored as one contiguous L2-normalized matrix, so a batch of queries is a
+single matrix product followed by a top-k partition.
+"""
+import re
+import json
+import zlib
+import hashlib
+
+import numpy as np
+
+DEFAULT_DIM = 256  # Scoring is memory-bound: 5,000 docs x 256 x 4 bytes = 5 MB per query
+
+# Caller wording -> knowledge base wording
+SYNONYMS = {
+    'dog': 'pet friendly', 'dogs': 'pet friendly', 'cat': 'pet friendly', 'cats': 'pet friendly',
+    'puppy': 'pet friendly', 'pets': 'pet friendly', 'pet': 'pet friendly',
+    'yard': 'fenced yard', 'garden': 'fenced yard garden tub',
+    'gym': 'fitness center', 'workout': 'fitness center', 'exercise': 'fitness center',
+    'pool': 'swimming pool', 'swim': 'swimming pool',
+    'laundry': 'washer/dryer connections laundry facilities', 'washer': 'washer/dryer connections',
+    'elevator': 'lift access', 'lift': 'lift access',
+    'closet': 'walk-in closets', 'storage': 'additional storage',
+    'internet': 'high-speed internet access', 'wifi': 'high-speed internet access',
+    'ac': 'air conditioning', 'parking': 'parking available',
+}
+NUMBER_WORDS = {'one bedroom': '1bhk', 'two bedroom': '2bhk', '1 bedroom': '1bhk', '2 bedroom': '2bhk',
+                'one bed': '1bhk', 'two bed': '2bhk', 'studio': '1bhk'}
+
+_MAX_PRICE_RE = re.compile(r'(?:under|below|less than|max(?:imum)?|up to|at most|<)\s*\$?\s*(\d[\d,]*)')
+_MIN_PRICE_RE = re.compile(r'(?:over|above|more than|at least|min(?:imum)?|>)\s*\$?\s*(\d[\d,]*)')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def parse_price_constraints(text):
+    """Pull 'under 1300' / 'over $1,100' out of a query. Returns (rest, min_price, max_price)."""
+    min_price = max_price = None
+    match = _MAX_PRICE_RE.search(text)
+    if match:
+        max_price = int(match.group(1).replace(',', ''))
+        text = text[:match.start()] + text[match.end():]
+    match = _MIN_PRICE_RE.search(text)
+    if match:
+        min_price = int(match.group(1).replace(',', ''))
+        text = text[:match.start()] + text[match.end():]
+    return text, min_price, max_price
+
+
+def expand_query(text):
+    for phrase, replacement in NUMBER_WORDS.items():
+        text = text.replace(phrase, replacement)
+    extra = [SYNONYMS[word] for word in _WORD_RE.findall(text) if word in SYNONYMS]
+    return ' '.join([text] + extra)
+
+
+def _features(text):
+    """Whole words plus character 3- and 4-grams of each padded word."""
+    for word in _WORD_RE.findall(text.lower()):
+        yield 'w:' + word
+        padded = f' {word} '
+        for n in (3, 4):
+            for i in range(len(padded) - n + 1):
+                yield padded[i:i + n]
+
+
+def embed(text, dim=DEFAULT_DIM):
+    """Raw (un-weighted, un-normalized) hashed feature vector."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in _features(text):
+        # crc32 is stable across processes, unlike hash(), so cached matrices stay valid
+        h = zlib.crc32(feature.encode())
+        vector[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+    return vector
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class SemanticIndex:
+    """Contiguous float32 document matrix with IDF weights and per-document metadata."""
+
+    def __init__(self, matrix, idf, docs, dim=DEFAULT_DIM):
+        self.matrix = matrix
+        self.idf = idf
+        self.docs = docs
+        self.dim = dim
+        self.prices = np.array([d.get('price') or 0 for d in docs], dtype=np.float32)
+        kinds = np.array([d['kind'] for d in docs])
+        self.kind_masks = {kind: kinds == kind for kind in ('unit', 'floorplan', 'amenity')}
+
+    @staticmethod
+    def documents(property_data):
+        """One document per vacant unit, floor plan and amenity.
+
+        Unit documents carry the property's amenities too, since callers ask
+        for units by them ("a yard for my dog"); amenities marked * are only
+        in select units and are worded that way.
+        """
+        plans = {p['class'].upper(): p for p in property_data.get('floorplans', [])}
+        amenities = property_data.get('amenities', [])
+        community = ' '.join(a for a in amenities if not a.endswith('*'))
+        select_units = ' '.join(f"select units {a.rstrip('*')}" for a in amenities if a.endswith('*'))
+        docs = []
+        for vacancy in property_data.get('vacancies', []):
+            plan = plans.get(vacancy['class'].upper(), {})
+            features = sorted({f for room in plan.get('rooms', []) for f in room.get('features', [])})
+            levels = ' '.join(room.get('level', '') for room in plan.get('rooms', []))
+            price = re.sub(r'[^\d]', '', vacancy.get('price', '').split('/')[0])
+            docs.append({
+                'kind': 'unit',
+                'id': vacancy['unit'].upper(),
+                'price': int(price) if price else None,
+                'text': f"{vacancy['unit']} {vacancy['type']} class {vacancy['class']} {plan.get('range', '')} "
+                        f"{levels} {' '.join(features)} {community} {select_units}"
+            })
+        for plan_class, plan in plans.items():
+            rooms = plan.get('rooms', [])
+            docs.append({
+                'kind': 'floorplan',
+                'id': plan_class,
+                'price': None,
+                'text': f"{plan_class} {' '.join(r.get('type', '') for r in rooms)} {plan.get('range', '')} "
+                        f"{' '.join(f for r in rooms for f in r.get('features', []))}"
+            })
+        for amenity in property_data.get('amenities', []):
+            docs.append({'kind': 'amenity', 'id': amenity.rstrip('*'), 'price': None, 'text': amenity.rstrip('*')})
+        return docs
+
+    @classmethod
+    def build(cls, docs, dim=DEFAULT_DIM):
+        raw = np.stack([embed(d['text'], dim) for d in docs]) if docs else np.zeros((0, dim), np.float32)
+        df = np.count_nonzero(raw, axis=0)
+        idf = (np.log((1 + len(docs)) / (1 + df)) + 1).astype(np.float32)
+        matrix = np.ascontiguousarray(_normalize_rows(raw * idf), dtype=np.float32)
+        return cls(matrix, idf, docs, dim)
+
+    @classmethod
+    def from_property(cls, property_data, cache_path=None, dim=DEFAULT_DIM):
+        """Build the index, reusing a memory-mapped cache when it matches this data."""
+        docs = cls.documents(property_data)
+        fingerprint = hashlib.sha1(json.dumps([docs, dim], sort_keys=True).encode()).hexdigest()
+        if cache_path:
+            cached = cls.load(cache_path, fingerprint)
+            if cached is not None:
+                return cached
+        index = cls.build(docs, dim)
+        if cache_path:
+            index.save(cache_path, fingerprint)
+        return index
+
+    def save(self, path, fingerprint):
+        np.save(f"{path}.npy", self.matrix)
+        np.save(f"{path}.idf.npy", self.idf)
+        with open(f"{path}.json", 'w') as file:
+            json.dump({'fingerprint': fingerprint, 'dim': self.dim, 'docs': self.docs}, file)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        try:
+            with open(f"{path}.json") as file:
+                meta = json.load(file)
+            if fingerprint is not None and meta['fingerprint'] != fingerprint:
+                return None
+            matrix = np.load(f"{path}.npy", mmap_mode='r')
+            idf = np.load(f"{path}.idf.npy")
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(matrix, idf, meta['docs'], meta['dim'])
+
+    def embed_queries(self, queries):
+        raw = np.stack([embed(q, self.dim) for q in queries])
+        return _normalize_rows(raw * self.idf)
+
+    def search_batch(self, queries, k=5, kind=None, min_score=0.0):
+        """Cosine top-k for several free-text queries in one matrix product.
+
+        Price phrases such as 'under 1300' become filters on unit documents,
+        and documents scoring `min_score` or less are left out. Returns one
+        list of (doc, score) per query.
+        """
+        prepared = [parse_price_constraints(q.lower()) for q in queries]
+        scores = self.embed_queries([expand_query(text) for text, _, _ in prepared]) @ self.matrix.T
+
+        all_docs = np.ones(len(self.docs), dtype=bool)
+        units = self.kind_masks['unit']
+        results = []
+        for row, (_, min_price, max_price) in zip(scores, prepared):
+            mask = self.kind_masks[kind] if kind else all_docs
+            if min_price is not None or max_price is not None:
+                priced = units.copy()
+                if min_price is not None:
+                    priced &= self.prices >= min_price
+                if max_price is not None:
+                    priced &= self.prices <= max_price
+                mask = mask & (priced | ~units)
+            mask = mask & (row > min_score)
+            row = np.where(mask, row, -np.inf)
+            top = min(k, int(mask.sum()))
+            if top == 0:
+                results.append([])
+                continue
+            idx = np.argpartition(-row, top - 1)[:top]
+            idx = idx[np.argsort(-row[idx])]
+            results.append([(self.docs[i], float(row[i])) for i in idx])
+        return results
+
+    def search(self, query, k=5, kind=None, min_score=0.0):
+        return self.search_batch([query], k, kind, min_score)[0]
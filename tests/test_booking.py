@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from booking import BookingEngine, BookingError
+
+SLOT = '2030-07-03T09:00:00'
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = BookingEngine(str(tmp_path / 'bookings.log'))
+    engine.load_calendar([{'unit': 'A101', 'appointment_slots': [SLOT]}])
+    return engine
+
+
+def test_another_call_cannot_confirm_or_release_a_hold(engine):
+    async def scenario():
+        hold = await engine.hold('A101', SLOT, call_sid='CA1')
+        with pytest.raises(BookingError):
+            await engine.confirm(hold['hold_id'], call_sid='CA2')
+        with pytest.raises(BookingError):
+            await engine.release(hold['hold_id'], call_sid='CA2')
+        assert not engine.is_available('A101', SLOT)
+        booked = await engine.confirm(hold['hold_id'], {'name': 'Ann'}, call_sid='CA1')
+        assert booked['status'] == 'booked'
+        assert await engine.release(hold['hold_id'], call_sid='CA1')
+        assert engine.is_available('A101', SLOT)
+
+    asyncio.run(scenario())
+
+
+def test_tool_calls_are_scoped_to_the_calling_call(engine):
+    async def scenario():
+        hold = await engine.call('hold_tour', f'{{"unit": "A101", "start": "{SLOT}"}}', call_sid='CA1')
+        arguments = f'{{"hold_id": "{hold["hold_id"]}"}}'
+        assert 'error' in await engine.call('confirm_tour', arguments, call_sid='CA2')
+        assert 'error' in await engine.call('cancel_tour', arguments, call_sid='CA2')
+        assert (await engine.call('confirm_tour', arguments, call_sid='CA1'))['status'] == 'booked'
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('name, arguments', [
+    ('hold_tour', '{"unit": "A101", "start": 20300703}'),
+    ('hold_tour', '{"unit": null, "start": "2030-07-03T09:00:00"}'),
+    ('hold_tour', '{"unit": "A101", "start": "tomorrow"}'),
+    ('hold_tour', '[]'),
+    ('confirm_tour', '{"hold_id": ["x"]}'),
+    ('cancel_tour', '{}'),
+])
+def test_malformed_tool_arguments_come_back_as_errors(engine, name, arguments):
+    assert 'error' in asyncio.run(engine.call(name, arguments, call_sid='CA1'))
+
+
+def test_release_keeps_the_slot_taken_if_the_log_write_fails(engine, tmp_path):
+    async def scenario():
+        hold = await engine.hold('A101', SLOT, call_sid='CA1')
+        engine.log_path = str(tmp_path)  # A directory, so the append fails
+        with pytest.raises(BookingError):
+            await engine.release(hold['hold_id'], call_sid='CA1')
+        assert hold['hold_id'] in engine.holds
+        assert not engine.is_available('A101', SLOT)
+
+    asyncio.run(scenario())
+
+
+def test_bookings_by_call(engine):
+    async def scenario():
+        hold = await engine.hold('A101', SLOT, call_sid='CA1')
+        assert engine.bookings_by_call() == {}
+        await engine.confirm(hold['hold_id'], {'name': 'Ann'}, call_sid='CA1')
+        return engine.bookings_by_call()
+
+    by_call = asyncio.run(scenario())
+    assert list(by_call) == ['CA1']
+    assert by_call['CA1'][0]['unit'] == 'A101'
@@ -0,0 +1,55 @@
+import os
+import json
+
+import pytest
+
+from knowledge_engine import KnowledgeEngine
+
+KNOWLEDGE_BASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'knowledge_base.json')
+
+
+@pytest.fixture(scope='module')
+def engine():
+    with open(KNOWLEDGE_BASE) as file:
+        return KnowledgeEngine(json.load(file)['properties'][0])
+
+
+def test_search_units_matches_property_amenities(engine):
+    result = engine.search_units("somewhere with a yard for my dog under 1300")
+    assert result['units']
+    assert all(unit['price_per_month'] <= 1300 for unit in result['units'])
+    assert all(unit['score'] > 0 for unit in result['units'])
+    assert {'Fenced Yard (select units)', 'Pet Friendly'} <= set(result['matching_amenities'])
+
+
+def test_search_units_drops_noise_matches(engine):
+    assert engine.search_units("quantum flux capacitor") == {'units': [], 'matching_amenities': []}
+    assert engine.search_units("what about the weather tomorrow")['units'] == []
+
+
+def test_find_units_does_not_claim_select_unit_amenities_for_every_unit(engine):
+    result = engine.find_units(feature='fenced yard')
+    assert result['units'] == []
+    assert 'select units' in result['note']
+    assert len(engine.find_units(feature='pet friendly')['units']) == len(engine.vacancies)
+
+
+@pytest.mark.parametrize('name, arguments', [
+    ('unit_details', '{"unit": 101}'),
+    ('search_units', '{"query": null}'),
+    ('find_units', '{"type": 2}'),
+    ('slots', '{"unit": "A101", "date": 20300703}'),
+    ('find_units', '[]'),
+    ('find_units', '{"colour": "blue"}'),
+])
+def test_malformed_tool_arguments_come_back_as_errors(engine, name, arguments):
+    assert 'error' in engine.call(name, arguments)
+
+
+def test_next_tour_slots_skips_taken_slots(engine):
+    unit = engine.vacancies[0]['unit']
+    slots = engine.slots(unit)['slots']
+    taken = {slots[0]['start'], slots[2]['start']}
+    offered = engine.next_tour_slots(unit, lambda start: start.isoformat() not in taken)
+    assert offered == [slots[1]['spoken'], slots[3]['spoken'], slots[4]['spoken']]
+    assert engine.unit_details(unit)['next_tour_slots'] == [s['spoken'] for s in slots[:3]]
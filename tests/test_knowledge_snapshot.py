@@ -0,0 +1,48 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+from knowledge_snapshot import KnowledgeBaseWatcher, validate_knowledge_base
+
+KNOWLEDGE_BASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'knowledge_base.json')
+
+
+def session_update(engine):
+    return {'type': 'session.update'}
+
+
+@pytest.fixture
+def property_data():
+    with open(KNOWLEDGE_BASE) as file:
+        return json.load(file)['properties'][0]
+
+
+@pytest.mark.parametrize('mangle', [
+    lambda prop: 'just a string',
+    lambda prop: {**prop, 'name': 42},
+    lambda prop: {**prop, 'vacancies': 'none'},
+    lambda prop: {**prop, 'vacancies': ['A101']},
+    lambda prop: {**prop, 'vacancies': [{**prop['vacancies'][0], 'unit': 101}]},
+    lambda prop: {**prop, 'vacancies': [{**prop['vacancies'][0], 'appointment_slots': [20300703]}]},
+    lambda prop: {**prop, 'floorplans': [{'class': 'A1', 'rooms': ['big']}]},
+    lambda prop: {**prop, 'amenities': [{'name': 'Pool'}]},
+])
+def test_malformed_entries_are_rejected_with_value_error(property_data, mangle):
+    with pytest.raises(ValueError):
+        validate_knowledge_base({'properties': [mangle(property_data)]})
+
+
+def test_watcher_rejects_a_malformed_file_once(tmp_path, property_data, caplog):
+    path = tmp_path / 'knowledge_base.json'
+    path.write_text(json.dumps({'properties': [property_data]}))
+    watcher = KnowledgeBaseWatcher(str(path), session_update, interval=0)
+
+    path.write_text(json.dumps({'properties': [property_data, 'not a property']}))
+    os.utime(path, ns=(0, 10 ** 9))
+    assert not asyncio.run(watcher.check())
+    assert watcher.last_error
+    assert not asyncio.run(watcher.check())
+    assert sum('Rejected knowledge base change' in r.message for r in caplog.records) == 1
+    assert watcher.snapshot.version == 1
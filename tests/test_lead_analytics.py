@@ -0,0 +1,50 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from lead_analytics import LeadAnalytics, epoch_hour
+
+
+def conversation(hours_ago):
+    timestamp = datetime.fromtimestamp(time.time() - hours_ago * 3600, timezone.utc).isoformat()
+    message = {'text': 'hello', 'confidence': 0.9, 'timestamp': timestamp}
+    return {'customer_messages': [], 'ai_messages': [message], 'all_messages': [message]}
+
+
+@pytest.fixture
+def analytics(tmp_path):
+    analytics = LeadAnalytics(str(tmp_path / 'analytics.db'), hours=24)
+    yield analytics
+    analytics.close()
+
+
+def counted_sids(analytics):
+    return {row[0] for row in analytics._connection().execute("SELECT transcription_sid FROM analytics_conversations")}
+
+
+def test_each_conversation_is_counted_once(analytics):
+    assert analytics.add('GT1', conversation(1), None)
+    assert not analytics.add('GT1', conversation(1), None)
+    assert analytics.summary()['total']['calls'] == 1
+
+
+def test_counted_sids_are_pruned_with_their_hour(analytics):
+    analytics._connection().execute("INSERT INTO analytics_conversations VALUES ('GT-old', ?)",
+                                    (epoch_hour(time.time()) - 30,))
+    analytics.add('GT1', conversation(1), None)
+    assert counted_sids(analytics) == {'GT1'}
+
+
+def test_conversations_older_than_the_window_are_left_to_a_rebuild(analytics):
+    assert not analytics.add('GT-old', conversation(30), None)
+    assert analytics.summary()['total']['calls'] == 0
+    assert analytics.rebuild([('GT-old', conversation(30), None), ('GT1', conversation(1), None)]) == 2
+    assert analytics.summary()['total']['calls'] == 2
+    assert counted_sids(analytics) == {'GT1'}
+
+
+def test_pruning_counted_sids_uses_the_hour_index(analytics):
+    plan = analytics._connection().execute(
+        "EXPLAIN QUERY PLAN DELETE FROM analytics_conversations WHERE hour <= ?", (0,)).fetchall()
+    assert any('analytics_conversations_hour' in row[-1] for row in plan)
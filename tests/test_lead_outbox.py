@@ -0,0 +1,134 @@
+import json
+import asyncio
+import sqlite3
+
+from lead_outbox import LeadOutbox, idempotency_key_for
+from rails_client import RailsClient
+
+
+class StubRails:
+    """Minimal HTTP/1.1 server standing in for Rails. Each POST gets the next scripted reply.
+
+    A reply is a status code, or None to never answer (the client times out).
+    """
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                self.requests.append((request_line.decode().split()[1], headers, json.loads(body)))
+                status = self.replies.pop(0) if self.replies else 201
+                if status is None:
+                    await asyncio.sleep(3600)
+                reply = b'{}'
+                writer.write(f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(reply)}\r\n\r\n".encode() + reply)
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def wait_for(condition, timeout=10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def test_retries_5xx_and_timeout_until_rails_accepts(tmp_path):
+    async def run():
+        rails = StubRails([500, None, 503, 201])
+        client = RailsClient(await rails.start(), timeout=0.3)
+        outbox = LeadOutbox(str(tmp_path / 'outbox.db'), send=client.create_lead, base_delay=0.01, max_delay=0.05)
+        outbox.start()
+        try:
+            assert await outbox.enqueue('GT1', {'lead': {'email': 'a@b.com'}})
+            await wait_for(lambda: outbox.counts().get('delivered') == 1)
+        finally:
+            await outbox.stop()
+            await client.close()
+            await rails.stop()
+        return rails.requests
+
+    requests = asyncio.run(run())
+    assert len(requests) == 4
+    for path, headers, body in requests:
+        assert path == '/leads'
+        assert headers['idempotency-key'] == idempotency_key_for('GT1')
+        assert body == {'lead': {'email': 'a@b.com'}}
+    row = sqlite3.connect(tmp_path / 'outbox.db').execute(
+        "SELECT status, attempts, last_error FROM lead_outbox").fetchone()
+    assert row == ('delivered', 3, None)
+
+
+def test_gives_up_after_max_attempts(tmp_path):
+    async def run():
+        rails = StubRails([500] * 10)
+        client = RailsClient(await rails.start(), timeout=0.3)
+        outbox = LeadOutbox(str(tmp_path / 'outbox.db'), send=client.create_lead, base_delay=0.01, max_delay=0.02,
+                            max_attempts=3)
+        outbox.start()
+        try:
+            await outbox.enqueue('GT2', {'lead': {}})
+            await wait_for(lambda: outbox.counts().get('dead') == 1)
+        finally:
+            await outbox.stop()
+            await client.close()
+            await rails.stop()
+        return rails.requests
+
+    assert len(asyncio.run(run())) == 3
+
+
+def test_worker_survives_database_errors(tmp_path):
+    async def run():
+        sent = []
+
+        async def send(payload, idempotency_key):
+            sent.append(idempotency_key)
+            return True
+
+        outbox = LeadOutbox(str(tmp_path / 'outbox.db'), send=send, base_delay=0.01)
+        due = outbox._due
+        failures = [sqlite3.OperationalError('database is locked')] * 2
+
+        def flaky_due():
+            if failures:
+                raise failures.pop()
+            return due()
+
+        outbox._due = flaky_due
+        outbox.start()
+        try:
+            await outbox.enqueue('GT3', {'lead': {}})
+            await wait_for(lambda: sent)
+        finally:
+            await outbox.stop()
+        return sent
+
+    assert asyncio.run(run()) == [idempotency_key_for('GT3')]
@@ -0,0 +1,42 @@
+import base64
+
+from playout import PendingBargeIn, PlayoutTracker
+
+
+def delta(start, ms=100):
+    """`ms` of audio whose bytes count up from `start`, so replayed audio can be told apart."""
+    return base64.b64encode(bytes((start + i) % 256 for i in range(ms * 8))).decode()
+
+
+def decoded(payloads):
+    return b''.join(base64.b64decode(p) for _, p in payloads)
+
+
+def test_unconfirmed_barge_in_replays_what_the_caller_did_not_hear():
+    playout = PlayoutTracker(mark_interval_ms=200, keep_audio=True)
+    sent = [delta(i * 800) for i in range(5)]
+    marks = [playout.add_delta('item_1', payload, 0) for payload in sent]
+    playout.on_mark(marks[1], 200)  # 200 ms confirmed played, 60 ms ago
+    barge_in = PendingBargeIn(playout, 260)
+    assert (barge_in.item_id, barge_in.audio_end_ms, barge_in.had_unplayed) == ('item_1', 260, True)
+
+    playout.reset()  # The clear
+    barge_in.hold('item_1', delta(4000))
+    all_audio = decoded([(None, p) for p in sent + [delta(4000)]])
+    assert decoded(barge_in.replay()) == all_audio[260 * 8:]
+
+    playout.resume(barge_in.item_id, barge_in.audio_end_ms, barge_in.played_audio, 1000)
+    for item_id, payload in barge_in.replay():
+        playout.add_delta(item_id, payload, 1000)
+    assert playout.played_position(1000) == 260
+    assert playout.sent_ms == 600
+    assert bytes(playout.audio) == all_audio
+
+
+def test_barge_in_with_nothing_unplayed_keeps_only_held_deltas():
+    playout = PlayoutTracker(keep_audio=True)
+    barge_in = PendingBargeIn(playout, 0)
+    assert not barge_in.had_unplayed
+    barge_in.hold('item_2', delta(0, 20))
+    assert list(barge_in.replay()) == [('item_2', delta(0, 20))]
+    assert barge_in.held_items() == {'item_2'}
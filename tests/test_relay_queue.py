@@ -0,0 +1,39 @@
+import asyncio
+
+from relay_queue import RelayQueue, pump
+
+
+def test_control_on_sent_runs_after_the_send():
+    async def scenario():
+        queue = RelayQueue('test', max_audio=4)
+        sent = []
+        events = []
+
+        async def send(message):
+            await asyncio.sleep(0.01)
+            sent.append(message)
+
+        queue.put_audio('audio-1')
+        queue.put_control('clear', on_sent=lambda: events.append(list(sent)))
+        queue.put_audio('audio-2')
+        writer = asyncio.ensure_future(pump(queue, send, lambda started: events.append('audio')))
+        while len(sent) < 3:
+            await asyncio.sleep(0.005)
+        writer.cancel()
+        return events
+
+    assert asyncio.run(scenario()) == ['audio', ['audio-1', 'clear'], 'audio']
+
+
+def test_discard_audio_keeps_control_callbacks():
+    async def scenario():
+        queue = RelayQueue('test', max_audio=4)
+        called = []
+        queue.put_audio('audio-1')
+        queue.put_control('clear', on_sent=lambda: called.append(True))
+        assert queue.discard_audio() == 1
+        is_audio, message, on_sent = await queue.get()
+        on_sent()
+        return is_audio, message, called
+
+    assert asyncio.run(scenario()) == (False, 'clear', [True])
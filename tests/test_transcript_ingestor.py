@@ -0,0 +1,39 @@
+import json
+
+from transcripts import TranscriptIngestor
+
+
+def record(sid, text=None):
+    if text is None:
+        return {'TranscriptionSid': sid}
+    return {'TranscriptionSid': sid, 'TranscriptionStatus': 'inbound_track',
+            'TranscriptionData': json.dumps({'transcript': text, 'confidence': 0.9})}
+
+
+def append(path, *records):
+    with open(path, 'a') as file:
+        file.write(''.join(json.dumps(r) + '\n' for r in records))
+
+
+def test_state_holds_only_open_calls_and_processed_sids_are_appended(tmp_path):
+    log, state = tmp_path / 't.jsonl', tmp_path / 'state.json'
+    ingestor = TranscriptIngestor(str(log), str(state))
+    for i in range(50):
+        append(log, record(f'GT{i}', 'hello'), record(f'GT{i}'))
+        assert list(ingestor.consume()) == [f'GT{i}']
+    append(log, record('GTopen', 'still talking'))
+    assert ingestor.consume() == {}
+
+    saved = json.loads(state.read_text())
+    assert set(saved) == {'offset', 'pending'}
+    assert list(saved['pending']) == ['GTopen']
+    assert (tmp_path / 'state.json.processed').read_text().split() == [f'GT{i}' for i in range(50)]
+
+
+def test_restart_ignores_late_records_of_processed_calls(tmp_path):
+    log, state = tmp_path / 't.jsonl', tmp_path / 'state.json'
+    append(log, record('GT1', 'hi'), record('GT1'))
+    TranscriptIngestor(str(log), str(state)).consume()
+    append(log, record('GT1', 'late'), record('GT2', 'hi'), record('GT2'))
+    assert list(TranscriptIngestor(str(log), str(state)).consume()) == ['GT2']
+
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from transcript_store import open_transcript_store
+
+
+def message(sid, text, track='inbound_track'):
+    return {'TranscriptionSid': sid, 'CallSid': f'CA-{sid}', 'TranscriptionStatus': track,
+            'TranscriptionData': json.dumps({'transcript': text, 'confidence': 0.9})}
+
+
+def end(sid):
+    return {'TranscriptionSid': sid, 'CallSid': f'CA-{sid}'}
+
+
+@pytest.fixture(params=['sqlite', 'jsonl'])
+def store(request, tmp_path):
+    store = open_transcript_store(request.param, db_path=str(tmp_path / 't.db'),
+                                  file_path=str(tmp_path / 't.jsonl'), state_path=str(tmp_path / 'state.json'))
+    store.open()
+    yield store
+    store.close()
+
+
+def test_ended_conversations_leave_out_calls_in_progress(store):
+    store.write_batch([message('GT1', 'hello'), message('GT2', 'I want a tour'), end('GT2')])
+    assert list(store.ended_conversations()) == ['GT2']
+    store.write_batch([message('GT1', 'my email is a@b.com'), end('GT1')])
+    ended = store.ended_conversations()
+    assert sorted(ended) == ['GT1', 'GT2']
+    assert [m['text'] for m in ended['GT1']['customer_messages']] == ['hello', 'my email is a@b.com']
+
+
+def test_messages_keep_the_twilio_timestamp(store):
+    store.write_batch([{**message('GT1', 'hello'), 'Timestamp': '2030-07-03T09:00:00Z'},
+                       message('GT1', 'no timestamp'), end('GT1')])
+    messages = store.ended_conversations()['GT1']['all_messages']
+    assert messages[0]['timestamp'] == '2030-07-03T09:00:00Z'
+    assert messages[1]['timestamp']
+
+
+def test_malformed_records_do_not_fail_the_batch(store):
+    store.write_batch([
+        message('GT1', 'hello'),
+        {'TranscriptionSid': 'GT1', 'TranscriptionStatus': 'inbound_track', 'TranscriptionData': json.dumps('abc')},
+        {'TranscriptionSid': 'GT1', 'TranscriptionStatus': 'inbound_track',
+         'TranscriptionData': json.dumps({'transcript': 'x', 'confidence': 'high'})},
+        end('GT1')
+    ])
+    assert [m['text'] for m in store.ended_conversations()['GT1']['all_messages']] == ['hello']
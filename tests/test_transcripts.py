@@ -0,0 +1,63 @@
+import json
+import asyncio
+
+import pytest
+
+from lead_extractor import LeadTracker
+from transcripts import TranscriptWriter, parse_transcription_message
+
+
+def record(sid, transcription_data):
+    return {'TranscriptionSid': sid, 'TranscriptionStatus': 'inbound_track', 'TranscriptionData': transcription_data}
+
+
+@pytest.mark.parametrize('transcription_data', [
+    json.dumps('abc'),
+    json.dumps([1, 2]),
+    json.dumps({'transcript': 'hello', 'confidence': 'high'}),
+    json.dumps({'transcript': 'hello', 'confidence': None}),
+    json.dumps({'transcript': 42, 'confidence': 0.9}),
+    {'transcript': 'hello', 'confidence': 0.9},
+])
+def test_wrongly_shaped_transcription_data_is_not_a_message(transcription_data):
+    assert parse_transcription_message(record('GT1', transcription_data)) is None
+    tracker = LeadTracker()
+    tracker.observe(record('GT1', transcription_data))
+    assert tracker.states == {}
+
+
+def test_valid_transcription_data_is_a_message():
+    message, track = parse_transcription_message(record('GT1', json.dumps({'transcript': ' hi ', 'confidence': 1})))
+    assert (message['text'], track) == ('hi', 'inbound_track')
+
+
+class PickyStore:
+    """Fails any batch containing a record marked bad."""
+
+    def __init__(self):
+        self.written = []
+
+    def idle_sync_after(self):
+        return None
+
+    def sync(self):
+        pass
+
+    def write_batch(self, records):
+        if any(r.get('bad') for r in records):
+            raise RuntimeError('bad record')
+        self.written.extend(records)
+
+
+def test_one_bad_record_does_not_drop_the_rest_of_its_batch():
+    async def scenario():
+        store = PickyStore()
+        writer = TranscriptWriter(store)
+        for i in range(10):
+            writer.submit({'TranscriptionSid': f'GT{i}', 'bad': i == 4})
+        writer.start()
+        await writer.stop()
+        return store.written
+
+    written = asyncio.run(scenario())
+    assert [r['TranscriptionSid'] for r in written] == [f'GT{i}' for i in range(10) if i != 4]
@@ -0,0 +1,84 @@
+import numpy as np
+
+from vad import ULAW_TO_PCM16, LocalVAD
+
+FRAME = 160  # 20 ms at 8 kHz
+_ORDER = np.argsort(ULAW_TO_PCM16)
+_SORTED = ULAW_TO_PCM16[_ORDER]
+
+
+def ulaw(pcm):
+    """Encode PCM16 to mu-law by nearest table entry."""
+    index = np.clip(np.searchsorted(_SORTED, pcm), 0, 255)
+    return bytes(_ORDER[index].astype(np.uint8))
+
+
+def silence():
+    return b'\xff' * FRAME
+
+
+def noise(amplitude, seed=0):
+    """Broadband hiss: loud or not, it crosses zero far too often to be voice."""
+    rng = np.random.default_rng(seed)
+    return ulaw(rng.normal(0, amplitude, FRAME).clip(-32768, 32767).astype(np.int16))
+
+
+def speech(n=0, amplitude=8000, hz=200):
+    """A voiced-like tone, continuous across frames."""
+    t = (np.arange(FRAME) + n * FRAME) / 8000
+    return ulaw((amplitude * np.sin(2 * np.pi * hz * t)).astype(np.int16))
+
+
+def events(vad, frames):
+    """(frame index, event) for every transition."""
+    return [(i, event) for i, frame in enumerate(frames) if (event := vad.process(frame))]
+
+
+def test_silence_never_starts_speech():
+    assert events(LocalVAD(), [silence()] * 200) == []
+
+
+def test_broadband_noise_is_not_speech():
+    assert events(LocalVAD(), [noise(6000, seed) for seed in range(200)]) == []
+
+
+def test_speech_onset_after_start_frames():
+    vad = LocalVAD(start_frames=2)
+    frames = [silence()] * 20 + [speech(n) for n in range(10)]
+    assert events(vad, frames) == [(21, 'speech_started')]
+    assert vad.speaking
+
+
+def test_single_loud_frame_does_not_start_speech():
+    frames = [silence()] * 20 + [speech()] + [silence()] * 20
+    assert events(LocalVAD(start_frames=2), frames) == []
+
+
+def test_hangover_keeps_speech_through_short_pauses():
+    vad = LocalVAD(start_frames=2, hangover_frames=15)
+    frames = [silence()] * 10 + [speech(n) for n in range(20)] + [silence()] * 14 + [speech(n) for n in range(5)]
+    assert events(vad, frames) == [(11, 'speech_started')]
+    assert vad.speaking
+
+
+def test_speech_stops_after_hangover_frames():
+    vad = LocalVAD(start_frames=2, hangover_frames=15)
+    frames = [silence()] * 10 + [speech(n) for n in range(20)] + [silence()] * 30
+    # Last speech frame is index 29, so the 15th silent frame is index 44
+    assert events(vad, frames) == [(11, 'speech_started'), (44, 'speech_stopped')]
+    assert not vad.speaking
+
+
+def test_quiet_speech_below_min_energy_is_ignored():
+    frames = [silence()] * 10 + [speech(n, amplitude=100) for n in range(20)]
+    assert events(LocalVAD(min_energy_db=-45.0), frames) == []
+
+
+def test_noise_floor_tracks_background_hum():
+    # Once the floor sits at a steady hum, the hum stays background and only louder speech starts a turn
+    vad = LocalVAD(start_frames=2)
+    vad.noise_floor_db = -35.0
+    hum = [speech(n, amplitude=1500, hz=120) for n in range(200)]
+    assert events(vad, hum) == []
+    assert abs(vad.noise_floor_db - -29.6) < 1.0  # The hum's own energy
+    assert events(vad, [speech(n, amplitude=16000) for n in range(5)]) == [(1, 'speech_started')]
@@ -0,0 +1,387 @@
+"""Pluggable storage for call transcripts and their lead processing status.
+
+Two backends share one interface:
+
+- SQLiteTranscriptStore (default): WAL database indexed by TranscriptionSid
+  and track. Ended conversations are claimed atomically, so several app
+  workers can share one database without processing a lead twice.
+- JsonlTranscriptStore: the original append-only transcription.json plus
+  an offset-tracking TranscriptIngestor. Single process only.
+
+Store methods block; call them through asyncio.to_thread.
+"""
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+from transcripts import (TranscriptIngestor, apply_transcription_record, is_conversation_end,
+                         new_conversation, parse_transcription_message)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    transcription_sid TEXT NOT NULL,
+    call_sid TEXT,
+    track TEXT,
+    transcript TEXT,
+    confidence REAL,
+    timestamp TEXT,
+    received_at REAL NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcripts_sid_track ON transcripts (transcription_sid, track, id);
+CREATE TABLE IF NOT EXISTS conversations (
+    transcription_sid TEXT PRIMARY KEY,
+    call_sid TEXT,
+    status TEXT NOT NULL DEFAULT 'open',
+    lead_status TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    ended_at REAL,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS conversations_status ON conversations (status, ended_at);
+CREATE INDEX IF NOT EXISTS conversations_call_sid ON conversations (call_sid);
+"""
+
+# TRANSCRIPT_FSYNC policy -> SQLite synchronous level (WAL + NORMAL only syncs at checkpoints)
+SYNCHRONOUS = {'batch': 'FULL', 'interval': 'NORMAL', 'none': 'OFF'}
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+class SQLiteTranscriptStore:
+    """Transcripts and conversation status in a SQLite WAL database.
+
+    A conversation moves open -> ended (end-of-call sentinel written) ->
+    processing (claimed by one worker) -> processed (lead_status recorded).
+    A claim that is not finished within `claim_timeout` seconds, e.g. because
+    the worker died, is handed out again.
+    """
+
+    def __init__(self, path="transcripts.db", fsync_policy='batch', claim_timeout=300.0):
+        if fsync_policy not in SYNCHRONOUS:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.claim_timeout = claim_timeout
+        self._conn = None
+        self._db_lock = threading.Lock()
+
+    def _connection(self):
+        # Opened lazily so importing the app does not create the database file
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"PRAGMA synchronous={SYNCHRONOUS[self.fsync_policy]}")
+            # Other workers hold the write lock briefly; wait instead of failing
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def open(self):
+        with self._db_lock:
+            self._connection()
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def idle_sync_after(self):
+        return None
+
+    def sync(self):
+        pass
+
+    def write_batch(self, records, received_at=None):
+        """Insert a batch of webhook records in one transaction."""
+        now = received_at or time.time()
+        rows = []
+        touched = {}
+        ended = []
+        for record in records:
+            sid = record.get('TranscriptionSid') if isinstance(record, dict) else None
+            if not sid or not isinstance(sid, str):
+                continue
+            try:
+                parsed = parse_transcription_message(record)
+            except ValueError:
+                parsed = None  # Kept verbatim in `record`, just not usable as a message
+            message, _ = parsed if parsed else ({}, None)
+            rows.append((sid, record.get('CallSid'), record.get('TranscriptionStatus'),
+                         message.get('text'), message.get('confidence'), record.get('Timestamp'), now,
+                         json.dumps(record, separators=(',', ':'))))
+            call_sid, count = touched.get(sid, (None, 0))
+            touched[sid] = (record.get('CallSid') or call_sid, count + (1 if parsed else 0))
+            if is_conversation_end(record):
+                ended.append(sid)
+
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO transcripts (transcription_sid, call_sid, track, transcript, confidence, "
+                    "timestamp, received_at, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.executemany(
+                    "INSERT INTO conversations (transcription_sid, call_sid, message_count, started_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT (transcription_sid) DO UPDATE SET "
+                    "call_sid = COALESCE(excluded.call_sid, call_sid), "
+                    "message_count = message_count + excluded.message_count, updated_at = excluded.updated_at",
+                    [(sid, call_sid, count, now, now) for sid, (call_sid, count) in touched.items()]
+                )
+                conn.executemany(
+                    "UPDATE conversations SET status = 'ended', ended_at = ? "
+                    "WHERE transcription_sid = ? AND status = 'open'",
+                    [(now, sid) for sid in ended]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def claim_ended(self, limit=100):
+        """Atomically claim ended conversations for lead processing. Returns {sid: conversation}."""
+        now = time.time()
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                sids = [row[0] for row in conn.execute(
+                    "SELECT transcription_sid FROM conversations "
+                    "WHERE status = 'ended' OR (status = 'processing' AND claimed_at < ?) "
+                    "ORDER BY ended_at LIMIT ?",
+                    (now - self.claim_timeout, limit)
+                )]
+                conn.executemany(
+                    "UPDATE conversations SET status = 'processing', claimed_at = ? WHERE transcription_sid = ?",
+                    [(now, sid) for sid in sids]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return {sid: self._conversation(conn, sid) for sid in sids}
+
+    def mark_processed(self, sid, lead_status):
+        with self._db_lock:
+            self._connection().execute(
+                "UPDATE conversations SET status = 'processed', lead_status = ?, claimed_at = NULL "
+                "WHERE transcription_sid = ?",
+                (lead_status, sid)
+            )
+
+    def _conversation(self, conn, sid):
+        conversation = new_conversation()
+        row = conn.execute("SELECT call_sid FROM conversations WHERE transcription_sid = ?", (sid,)).fetchone()
+        if row and row[0]:
+            conversation['call_sid'] = row[0]
+        for track, text, confidence, timestamp, received_at in conn.execute(
+            "SELECT track, transcript, confidence, timestamp, received_at FROM transcripts "
+            "WHERE transcription_sid = ? AND transcript IS NOT NULL ORDER BY id",
+            (sid,)
+        ):
+            # The record's own Twilio Timestamp, as the JSONL store uses; else when it was written
+            message = {'text': text, 'confidence': confidence, 'timestamp': timestamp or _iso(received_at)}
+            conversation['all_messages'].append(message)
+            if track == 'inbound_track':
+                conversation['customer_messages'].append(message)
+            elif track == 'outbound_track':
+                conversation['ai_messages'].append(message)
+        return conversation
+
+    # Read API
+
+    def conversation(self, sid):
+        """Messages of one conversation, or None if the SID is unknown."""
+        with self._db_lock:
+            conn = self._connection()
+            if conn.execute("SELECT 1 FROM conversations WHERE transcription_sid = ?", (sid,)).fetchone() is None:
+                return None
+            return self._conversation(conn, sid)
+
+    def conversation_status(self, sid):
+        with self._db_lock:
+            cursor = self._connection().execute("SELECT * FROM conversations WHERE transcription_sid = ?", (sid,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def records(self, sid, track=None):
+        """Raw webhook records of one conversation, in arrival order."""
+        sql = "SELECT record FROM transcripts WHERE transcription_sid = ?"
+        params = [sid]
+        if track is not None:
+            sql += " AND track = ?"
+            params.append(track)
+        with self._db_lock:
+            rows = self._connection().execute(sql + " ORDER BY id", params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def conversations(self):
+        """Every conversation, {sid: conversation}."""
+        with self._db_lock:
+            conn = self._connection()
+            sids = [row[0] for row in conn.execute("SELECT transcription_sid FROM conversations ORDER BY started_at")]
+            return {sid: self._conversation(conn, sid) for sid in sids}
+
+    def ended_conversations(self):
+        """Conversations whose end-of-call record has been written, {sid: conversation}."""
+        with self._db_lock:
+            conn = self._connection()
+            sids = [row[0] for row in conn.execute(
+                "SELECT transcription_sid FROM conversations WHERE status != 'open' ORDER BY started_at"
+            )]
+            return {sid: self._conversation(conn, sid) for sid in sids}
+
+    def counts(self):
+        """Number of conversations per status."""
+        with self._db_lock:
+            return dict(self._connection().execute("SELECT status, COUNT(*) FROM conversations GROUP BY status"))
+
+
+class JsonlTranscriptStore:
+    """transcription.json as an append-only log, consumed through TranscriptIngestor.
+
+    Batches go out in a single os.write and follow the fsync policy: 'batch'
+    (after every write), 'interval' (at most every fsync_interval_ms, and
+    when the writer goes idle) or 'none'.
+    """
+
+    def __init__(self, file_path="transcription.json", state_path="transcription_state.json",
+                 fsync_policy='batch', fsync_interval_ms=1000):
+        if fsync_policy not in ('batch', 'interval', 'none'):
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.file_path = file_path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.ingestor = TranscriptIngestor(file_path, state_path)
+        self._fd = None
+        self._dirty = False
+        self._last_fsync = 0.0
+        self._lock = threading.Lock()
+
+    def open(self):
+        self._fd = os.open(self.file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def close(self):
+        if self._fd is not None:
+            self.sync()
+            os.close(self._fd)
+            self._fd = None
+
+    def idle_sync_after(self):
+        return self.fsync_interval if self._dirty and self.fsync_policy == 'interval' else None
+
+    def sync(self):
+        self._maybe_fsync(force=True)
+
+    def write_batch(self, records):
+        data = b''.join(json.dumps(record, separators=(',', ':')).encode() + b'\n' for record in records)
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        self._dirty = True
+        self._maybe_fsync(force=self.fsync_policy == 'batch')
+
+    def _maybe_fsync(self, force=False):
+        if not self._dirty or self.fsync_policy == 'none' or self._fd is None:
+            return
+        now = time.monotonic()
+        if force or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._fd)
+            self._last_fsync = now
+            self._dirty = False
+
+    def claim_ended(self, limit=None):
+        with self._lock:
+            return self.ingestor.consume()
+
+    def mark_processed(self, sid, lead_status):
+        pass  # The ingestor already remembers handed-out SIDs as processed
+
+    # Read API (full scans; use the SQLite store for indexed lookups)
+
+    def _scan(self):
+        try:
+            file = open(self.file_path, 'r')
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                line = line.strip()
+                if len(line) <= 5:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Skipping malformed transcription line: {e}")
+
+    def conversations(self):
+        conversations = {}
+        for data in self._scan():
+            try:
+                apply_transcription_record(conversations, data)
+            except json.JSONDecodeError as e:
+                logger.error(f"Nested JSON decode error for {data.get('TranscriptionSid')}: {e}")
+        return conversations
+
+    def ended_conversations(self):
+        conversations = {}
+        ended = set()
+        for data in self._scan():
+            try:
+                apply_transcription_record(conversations, data)
+            except json.JSONDecodeError as e:
+                logger.error(f"Nested JSON decode error for {data.get('TranscriptionSid')}: {e}")
+            if data.get('TranscriptionSid') and is_conversation_end(data):
+                ended.add(data['TranscriptionSid'])
+        return {sid: conversation for sid, conversation in conversations.items() if sid in ended}
+
+    def conversation(self, sid):
+        conversations = {}
+        for data in self._scan():
+            if data.get('TranscriptionSid') == sid:
+                try:
+                    apply_transcription_record(conversations, data)
+                except json.JSONDecodeError:
+                    pass
+        return conversations.get(sid)
+
+    def conversation_status(self, sid):
+        if sid in self.ingestor.processed:
+            return {'transcription_sid': sid, 'status': 'processed'}
+        if sid in self.ingestor.pending:
+            return {'transcription_sid': sid, 'status': 'open'}
+        return None
+
+    def records(self, sid, track=None):
+        return [data for data in self._scan()
+                if data.get('TranscriptionSid') == sid and (track is None or data.get('TranscriptionStatus') == track)]
+
+    def counts(self):
+        return {'open': len(self.ingestor.pending), 'processed': len(self.ingestor.processed)}
+
+
+def open_transcript_store(backend, db_path="transcripts.db", file_path="transcription.json",
+                          state_path="transcription_state.json", fsync_policy='batch', fsync_interval_ms=1000):
+    """Build the configured store: 'sqlite' or 'jsonl'."""
+    if backend == 'sqlite':
+        return SQLiteTranscriptStore(db_path, fsync_policy)
+    if backend == 'jsonl':
+        return JsonlTranscriptStore(file_path, state_path, fsync_policy, fsync_interval_ms)
+    raise ValueError(f"Unknown transcript store: {backend}")
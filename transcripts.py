@@ -0,0 +1,274 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def new_conversation():
+    """Return an empty per-SID conversation record."""
+    return {
+        'customer_messages': [],
+        'ai_messages': [],
+        'all_messages': []
+    }
+
+
+def is_conversation_end(data):
+    """A record with neither TranscriptionData nor TranscriptionStatus marks the end of a call."""
+    return data.get('TranscriptionData') is None and data.get('TranscriptionStatus') is None
+
+
+def now_iso():
+    return datetime.now().isoformat()
+
+
+def parse_transcription_message(data, timestamp=None, now=now_iso):
+    """The (message, track) carried by one record, or None if it has no usable transcript.
+
+    The message is stamped with `timestamp`, else the record's own Twilio
+    Timestamp, else `now()`. Raises json.JSONDecodeError if TranscriptionData
+    is not valid JSON; JSON of the wrong shape gives None.
+    """
+    transcript_data = data.get('TranscriptionData')
+    if not transcript_data or not isinstance(transcript_data, str):
+        return None
+    # Parse the nested JSON string
+    transcript_json = json.loads(transcript_data)
+    if not isinstance(transcript_json, dict):
+        return None
+    transcript = transcript_json.get('transcript')
+    confidence = transcript_json.get('confidence', 0)
+    if not isinstance(transcript, str) or isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+        return None
+    transcript = transcript.strip()
+    if not transcript or confidence <= 0.3:  # Lowered confidence threshold
+        return None
+    message = {
+        'text': transcript,
+        'confidence': confidence,
+        'timestamp': timestamp or data.get('Timestamp') or now()
+    }
+    return message, data.get('TranscriptionStatus')
+
+
+def apply_transcription_record(conversations, data):
+    """Fold one transcription.json record into the conversations dict. Returns the SID."""
+    sid = data.get('TranscriptionSid')
+    if not sid:
+        return None
+
+    if sid not in conversations:
+        conversations[sid] = new_conversation()
+    if data.get('CallSid'):
+        conversations[sid]['call_sid'] = data['CallSid']
+
+    parsed = parse_transcription_message(data)
+    if parsed:
+        message, status = parsed
+        conversations[sid]['all_messages'].append(message)
+
+        if status == 'inbound_track':  # Customer speaking
+            conversations[sid]['customer_messages'].append(message)
+        elif status == 'outbound_track':  # AI speaking
+            conversations[sid]['ai_messages'].append(message)
+
+    return sid
+
+
+def processed_log_path(state_path):
+    return f"{state_path}.processed"
+
+
+def read_processed_log(path):
+    """SIDs in a processed log, one per line. A torn last line from a crash is skipped."""
+    try:
+        with open(path, 'r') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return set()
+    lines = data.split('\n')
+    return set(line for line in lines[:-1] if line)
+
+
+class TranscriptIngestor:
+    """Incrementally consume transcription.json from a persisted byte offset.
+
+    Only the bytes appended since the last run are read. Conversations are kept
+    per TranscriptionSid until their end-of-call sentinel is seen, at which point
+    they are handed out once and the SID is remembered as processed. The state
+    file only holds the offset and the calls still open; processed SIDs are
+    appended to a separate log, so a hangup costs the same however many calls
+    came before it.
+    """
+
+    def __init__(self, file_path="transcription.json", state_path="transcription_state.json"):
+        self.file_path = file_path
+        self.state_path = state_path
+        self.processed_path = processed_log_path(state_path)
+        self.offset = 0
+        self.pending = {}
+        self.processed = set()
+        self._load_state()
+
+    def _load_state(self):
+        self.processed = read_processed_log(self.processed_path)
+        try:
+            with open(self.state_path, 'r') as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError as e:
+            logger.warning(f"Ignoring corrupt ingest state {self.state_path}: {e}")
+            return
+        self.offset = state.get('offset', 0)
+        self.pending = state.get('pending', {})
+
+    def _append_processed(self, sids):
+        with open(self.processed_path, 'a') as file:
+            file.write(''.join(f"{sid}\n" for sid in sids))
+        self.processed.update(sids)
+
+    def _save_state(self):
+        state = {
+            'offset': self.offset,
+            'pending': self.pending
+        }
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file, separators=(',', ':'))
+        os.replace(tmp_path, self.state_path)
+
+    def _read_new_records(self):
+        """Read complete lines appended since the stored offset."""
+        try:
+            size = os.path.getsize(self.file_path)
+        except FileNotFoundError:
+            return []
+
+        if size < self.offset:
+            # The log was truncated or rotated, start over from the top
+            logger.warning(f"{self.file_path} shrank below the stored offset, rescanning")
+            self.offset = 0
+
+        with open(self.file_path, 'rb') as file:
+            file.seek(self.offset)
+            chunk = file.read()
+
+        # Leave a partially written trailing line for the next run
+        end = chunk.rfind(b'\n') + 1
+        self.offset += end
+
+        records = []
+        for line in chunk[:end].splitlines():
+            line = line.strip()
+            if len(line) <= 5:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping malformed transcription line: {e}")
+                continue
+            if isinstance(record, dict):
+                records.append(record)
+        return records
+
+    def consume(self):
+        """Ingest new records and return {sid: conversation} for calls that just ended. Blocking."""
+        ended = []
+        for data in self._read_new_records():
+            sid = data.get('TranscriptionSid')
+            if sid in self.processed:
+                continue
+            try:
+                apply_transcription_record(self.pending, data)
+            except json.JSONDecodeError as e:
+                logger.error(f"Nested JSON decode error for {sid}: {e}")
+            if sid and is_conversation_end(data) and sid not in ended:
+                ended.append(sid)
+
+        completed = {sid: self.pending.pop(sid, new_conversation()) for sid in ended}
+        if ended:
+            # Appends only the new SIDs; the state file below holds just the offset and open calls
+            self._append_processed(ended)
+        self._save_state()
+        return completed
+
+
+class TranscriptWriter:
+    """Background group-commit writer for transcript records.
+
+    Webhooks enqueue records on a bounded queue and return immediately. The
+    writer drains whatever is queued and hands the batch to the transcript
+    store in one call: a single write for JSONL, a single transaction for
+    SQLite. Stores that defer syncing are synced once the queue goes idle.
+    """
+
+    def __init__(self, store, max_queue=1000, batch_size=256, on_flush=None):
+        self.store = store
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+
+    def submit(self, record):
+        """Queue a record for writing. Raises asyncio.QueueFull when the writer is behind."""
+        self.queue.put_nowait(record)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued."""
+        if self._task is None:
+            return
+        await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self.store.sync)
+
+    async def _next_record(self):
+        idle_sync_after = self.store.idle_sync_after()
+        if idle_sync_after is not None:
+            try:
+                return await asyncio.wait_for(self.queue.get(), idle_sync_after)
+            except asyncio.TimeoutError:
+                # Idle with unsynced data: sync it now rather than waiting for the next write
+                await asyncio.to_thread(self.store.sync)
+        return await self.queue.get()
+
+    def _write_each(self, batch):
+        for record in batch:
+            try:
+                self.store.write_batch([record])
+            except Exception as e:
+                logger.error(f"Dropping transcription record {str(record)[:200]}: {e!r}")
+
+    async def _run(self):
+        while True:
+            batch = [await self._next_record()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await asyncio.to_thread(self.store.write_batch, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} transcription records, retrying one by one: {e!r}")
+                # Their webhooks already returned 200; only the record at fault may be lost
+                await asyncio.to_thread(self._write_each, batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if self.on_flush:
+                try:
+                    await self.on_flush(batch)
+                except Exception as e:
+                    logger.error(f"Error in transcription flush hook: {e}")
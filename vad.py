@@ -0,0 +1,87 @@
+"""Lightweight in-process voice activity detection on Twilio mu-law frames.
+
+Used to cut assistant playback as soon as the caller starts talking, without
+waiting for the realtime server's speech_started event to come back.
+"""
+import numpy as np
+
+
+def _build_ulaw_table():
+    """G.711 mu-law byte -> linear PCM16 lookup table."""
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    sign = codes & 0x80
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(sign, -magnitude, magnitude).astype(np.int16)
+
+
+ULAW_TO_PCM16 = _build_ulaw_table()
+
+
+def ulaw_to_pcm16(frame):
+    """Decode mu-law bytes to an int16 array."""
+    return ULAW_TO_PCM16[np.frombuffer(frame, dtype=np.uint8)]
+
+
+def frame_features(pcm):
+    """(energy in dBFS, zero-crossing rate) of one PCM16 frame."""
+    samples = pcm.astype(np.float32)
+    rms = np.sqrt(np.mean(samples * samples)) if samples.size else 0.0
+    energy_db = 20 * np.log10(max(rms, 1.0) / 32768.0)
+    if samples.size < 2:
+        return float(energy_db), 0.0
+    signs = np.signbit(samples)
+    zcr = np.count_nonzero(signs[1:] != signs[:-1]) / (samples.size - 1)
+    return float(energy_db), float(zcr)
+
+
+class LocalVAD:
+    """Energy + zero-crossing voice activity detector with hangover smoothing.
+
+    A frame counts as speech when its energy is above both `min_energy_db` and
+    the tracked noise floor plus `margin_db`, and its zero-crossing rate is
+    below `max_zcr` (broadband hiss crosses zero far more often than voice).
+    Speech starts after `start_frames` consecutive speech frames and stops
+    after `hangover_frames` consecutive non-speech frames.
+    """
+
+    def __init__(self, min_energy_db=-45.0, margin_db=12.0, max_zcr=0.45,
+                 start_frames=2, hangover_frames=15, noise_alpha=0.05):
+        self.min_energy_db = min_energy_db
+        self.margin_db = margin_db
+        self.max_zcr = max_zcr
+        self.start_frames = start_frames
+        self.hangover_frames = hangover_frames
+        self.noise_alpha = noise_alpha
+        self.noise_floor_db = min_energy_db - margin_db
+        self.speaking = False
+        self._speech_run = 0
+        self._silence_run = 0
+
+    def is_speech_frame(self, energy_db, zcr):
+        threshold = max(self.min_energy_db, self.noise_floor_db + self.margin_db)
+        return energy_db > threshold and zcr < self.max_zcr
+
+    def process(self, frame):
+        """Feed one mu-law frame. Returns 'speech_started', 'speech_stopped' or None."""
+        energy_db, zcr = frame_features(ulaw_to_pcm16(frame))
+        speech = self.is_speech_frame(energy_db, zcr)
+
+        if not speech and not self.speaking:
+            # Only adapt the noise floor on frames we believe are background
+            self.noise_floor_db += self.noise_alpha * (energy_db - self.noise_floor_db)
+
+        if speech:
+            self._speech_run += 1
+            self._silence_run = 0
+            if not self.speaking and self._speech_run >= self.start_frames:
+                self.speaking = True
+                return 'speech_started'
+        else:
+            self._speech_run = 0
+            self._silence_run += 1
+            if self.speaking and self._silence_run >= self.hangover_frames:
+                self.speaking = False
+                return 'speech_stopped'
+        return None